@@ -0,0 +1,328 @@
+#!/usr/bin/python3.7
+#-------------------------------------------------------------------------------
+# Name:        agg_pyramid.py
+# Purpose:     Aggregates of the measurements at 1 minute, 10 minutes, 1 hour
+#              and 1 day, so a plot of months of data does not have to load
+#              every sample. The monitors add every sample as it comes in,
+#              which updates the running min/max/sum/count of every level.
+#              When the time of a level moves into the next bucket, the row of
+#              that bucket is added to the file of the level:
+#                  <root>/<stream>/fields          names of the fields
+#                  <root>/<stream>/60.agg          the 1 minute rows
+#                  <root>/<stream>/600.agg ...
+#              A row is the start of the bucket (epoch seconds), the number of
+#              samples and the min, max and sum of every field.
+#              A query picks the finest level that fits in the number of
+#              points that is asked for.
+#              Used by ser_mon_gpsdo.py and serial_bb_counter.py
+#
+#              python3 agg_pyramid.py <stream> <first day> <last day> [points]
+#              python3 agg_pyramid.py --selftest
+#
+# Author:      paulv
+#
+# Created:     18-10-2026
+# Copyright:   (c) paulv 2018 2019 2020
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+
+import bisect
+import calendar
+import mmap
+import os
+import struct
+import sys
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+VERSION = "1.0"
+
+PYRAMID_DIR = "/home/pi/log_archive/pyramid"
+LEVELS = [60, 600, 3600, 86400]     # seconds per bucket
+FLUSH_ROWS = 10     # 1 minute rows to collect before the files are written
+POINTS = 2000       # default number of points for a query
+
+ROW_HEADER = struct.Struct("<qI4x")     # bucket start, samples
+
+
+def row_format(fields):
+    return struct.Struct("<qI4x{}d".format(3 * len(fields)))
+
+
+class Bucket(object):
+    '''The running aggregate of one level'''
+    __slots__ = ("start", "count", "low", "high", "total")
+
+    def __init__(self, start, fields):
+        self.start = start
+        self.count = 0
+        self.low = [float("inf")] * fields
+        self.high = [float("-inf")] * fields
+        self.total = [0.0] * fields
+
+    def add(self, values):
+        self.count += 1
+        low = self.low
+        high = self.high
+        total = self.total
+        for i, v in enumerate(values):
+            if v < low[i]:
+                low[i] = v
+            if v > high[i]:
+                high[i] = v
+            total[i] += v
+
+    def row(self):
+        values = []
+        for i in range(len(self.total)):
+            values += (self.low[i], self.high[i], self.total[i])
+        return [self.start, self.count] + values
+
+
+class Pyramid(object):
+    '''
+    The levels of one stream. add() costs the same for every sample, no
+    matter how much data there is already.
+
+    '''
+    def __init__(self, stream, fields, root=PYRAMID_DIR, levels=LEVELS):
+        """Needs the name of the stream and the names of its fields."""
+        self.directory = os.path.join(root, stream)
+        self.fields = list(fields)
+        self.levels = list(levels)
+        self.format = row_format(self.fields)
+        self.buckets = [None] * len(self.levels)
+        self.pending = [[] for level in self.levels]
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, "fields")
+        if os.path.exists(path):
+            with open(path) as f:
+                stored = f.read().split()
+            if stored != self.fields:
+                raise ValueError("{} has fields {}, not {}".format(self.directory, stored, self.fields))
+        else:
+            with open(path, "w") as f:
+                f.write("\n".join(self.fields) + "\n")
+
+    def add(self, ts, values):
+        '''Add a sample, ts in seconds since the epoch'''
+        ts = int(ts)
+        for i, width in enumerate(self.levels):
+            start = ts - ts % width
+            bucket = self.buckets[i]
+            if bucket is None or bucket.start != start:
+                if bucket is not None:
+                    self.pending[i].append(self.format.pack(*bucket.row()))
+                bucket = self.buckets[i] = Bucket(start, len(self.fields))
+            bucket.add(values)
+        if len(self.pending[0]) >= FLUSH_ROWS:
+            self.flush()
+
+    def flush(self):
+        for width, rows in zip(self.levels, self.pending):
+            if rows:
+                with open(os.path.join(self.directory, "{}.agg".format(width)), "ab") as f:
+                    f.write(b"".join(rows))
+                del rows[:]
+
+    def close(self):
+        '''
+        Write the buckets that are not complete yet. When we start again in
+        the same bucket, the query adds the two rows together.
+        '''
+        for i, bucket in enumerate(self.buckets):
+            if bucket is not None and bucket.count:
+                self.pending[i].append(self.format.pack(*bucket.row()))
+            self.buckets[i] = None
+        self.flush()
+
+
+def read_fields(directory):
+    with open(os.path.join(directory, "fields")) as f:
+        return f.read().split()
+
+
+class Starts(object):
+    '''The bucket starts of the rows in a level file, a sequence for bisect'''
+
+    def __init__(self, data, size):
+        """Needs the data of the file and the size of a row."""
+        self.data = data
+        self.size = size
+
+    def __len__(self):
+        return len(self.data) // self.size
+
+    def __getitem__(self, i):
+        return ROW_HEADER.unpack_from(self.data, i * self.size)[0]
+
+
+def read_level(directory, width, fields, start, end):
+    '''
+    The rows of a level with a bucket start from start up to end, as a list
+    of (start, count, [low, high, total] per field). The rows are in time
+    order, so only the ones in the window are unpacked. Rows of the same
+    bucket are added together.
+    '''
+    path = os.path.join(directory, "{}.agg".format(width))
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return []
+    fmt = row_format(fields)
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        starts = Starts(data, fmt.size)
+        rows = []
+        for i in range(bisect.bisect_left(starts, start), bisect.bisect_right(starts, end)):
+            row = fmt.unpack_from(data, i * fmt.size)
+            if rows and rows[-1][0] == row[0]:
+                merge(rows[-1], row)
+            else:
+                rows.append(list(row))
+    finally:
+        data.close()
+    return rows
+
+
+def merge(row, other):
+    row[1] += other[1]
+    for i in range(2, len(row), 3):
+        row[i] = min(row[i], other[i])
+        row[i + 1] = max(row[i + 1], other[i + 1])
+        row[i + 2] += other[i + 2]
+
+
+def choose_level(start, end, points, levels=LEVELS):
+    '''The finest level that gives no more than points buckets'''
+    for width in levels:
+        if (end - start) / width <= points:
+            return width
+    return levels[-1]
+
+
+def query(stream, start, end, points=POINTS, root=PYRAMID_DIR):
+    '''
+    The aggregates of a stream between start and end (epoch seconds).
+    Returns (level, {field: {"min", "max", "mean"}}, bucket starts, counts),
+    as numpy arrays when numpy is there.
+    '''
+    directory = os.path.join(root, stream)
+    fields = read_fields(directory)
+    width = choose_level(start, end, points)
+    rows = read_level(directory, width, fields, start - start % width, end)
+    starts = [r[0] for r in rows]
+    counts = [r[1] for r in rows]
+    result = {}
+    for i, name in enumerate(fields):
+        col = 2 + 3 * i
+        result[name] = {
+            "min": [r[col] for r in rows],
+            "max": [r[col + 1] for r in rows],
+            "mean": [r[col + 2] / r[1] for r in rows],
+        }
+    if numpy is not None:
+        starts = numpy.array(starts, dtype="int64")
+        counts = numpy.array(counts, dtype="int64")
+        for columns in result.values():
+            for key in columns:
+                columns[key] = numpy.array(columns[key])
+    return width, result, starts, counts
+
+
+def day_seconds(day):
+    '''Epoch seconds of the start of a UTC day, YYYY-MM-DD'''
+    return calendar.timegm(time.strptime(day, "%Y-%m-%d"))
+
+
+# --- self check --------------------------------------------------------------
+
+def self_check(days=3):
+    '''
+    Feed days of 1 Hz readings with a restart in between, and compare every
+    level with the aggregates computed from the samples themselves
+    '''
+    import random
+    import shutil
+    import tempfile
+
+    print("Aggregate pyramid self check - Version {}".format(VERSION))
+    root = tempfile.mkdtemp()
+    rng = random.Random(1)
+    first = day_seconds("2026-10-01") + 1234
+    samples = [(first + i, [rng.gauss(0, 5), float(i % 97)]) for i in range(days * 86400)]
+    errors = 0
+    try:
+        pyramid = Pyramid("test", ["tic", "dac"], root)
+        split = len(samples) // 3 + 17
+        start = time.perf_counter()
+        for n, (ts, values) in enumerate(samples):
+            if n == split:
+                pyramid.close()
+                pyramid = Pyramid("test", ["tic", "dac"], root)
+            pyramid.add(ts, values)
+        pyramid.close()
+        elapsed = time.perf_counter() - start
+        print("add: {:.1f} us/sample".format(1e6 * elapsed / len(samples)))
+
+        last = samples[-1][0]
+        for width in LEVELS:
+            expected = {}
+            for ts, values in samples:
+                expected.setdefault(ts - ts % width, []).append(values)
+            rows = read_level(os.path.join(root, "test"), width, ["tic", "dac"], 0, last)
+            if [r[0] for r in rows] != sorted(expected):
+                errors += 1
+                print("{}s: bucket starts differ".format(width))
+                continue
+            for row in rows:
+                values = expected[row[0]]
+                for i in range(2):
+                    column = [v[i] for v in values]
+                    mean = row[4 + 3 * i] / row[1]
+                    if (row[1] != len(column) or row[2 + 3 * i] != min(column)
+                            or row[3 + 3 * i] != max(column)
+                            or abs(mean - sum(column) / len(column)) > 1e-9):
+                        errors += 1
+            print("{:>6}s: {} rows, {} bytes".format(width, len(rows),
+                  os.path.getsize(os.path.join(root, "test", "{}.agg".format(width)))))
+
+        for span, points in ((3600, 2000), (86400, 2000), (days * 86400, 100)):
+            start = time.perf_counter()
+            width, result, starts, counts = query("test", first, first + span, points, root)
+            print("{:>7}s window, {} points: level {}s, {} rows in {:.2f} ms".format(
+                span, points, width, len(starts), 1e3 * (time.perf_counter() - start)))
+            if len(starts) > points + 1:
+                errors += 1
+    finally:
+        shutil.rmtree(root)
+    print("{} errors".format(errors))
+    return 1 if errors else 0
+
+
+# --- command line ------------------------------------------------------------
+
+def main():
+    args = sys.argv[1:]
+    if args == ["--selftest"]:
+        sys.exit(self_check())
+    if len(args) < 3:
+        print("usage: python3 agg_pyramid.py <stream> <first day> <last day> [points]")
+        print("       python3 agg_pyramid.py --selftest")
+        sys.exit(1)
+    start = day_seconds(args[1])
+    end = day_seconds(args[2]) + 86399
+    points = int(args[3]) if len(args) > 3 else POINTS
+    width, result, starts, counts = query(args[0], start, end, points)
+    print("{} rows of {}s".format(len(starts), width))
+    for i in range(len(starts)):
+        fields = "  ".join("{} {:.6g}/{:.6g}/{:.6g}".format(
+            name, c["min"][i], c["mean"][i], c["max"][i]) for name, c in result.items())
+        print("{} {:>6} {}".format(time.strftime("%Y-%m-%d %H:%M", time.gmtime(starts[i])), counts[i], fields))
+
+
+if __name__ == '__main__':
+    main()
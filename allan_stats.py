@@ -0,0 +1,213 @@
+#!/usr/bin/python3.7
+#-------------------------------------------------------------------------------
+# Name:        allan_stats.py
+# Purpose:     Running statistics of the counter readings while they come in:
+#               - mean and standard deviation of the frequency (Welford)
+#               - fractional frequency offset from the nominal 10 MHz
+#               - overlapping Allan deviation at tau = 1, 2, 4, 8... gate times
+#              Nothing is kept of the history, except the last phase values
+#              that the longest tau needs.
+#              Used by serial_bb_counter.py
+#
+#              Run it on its own for a self-check against the textbook
+#              formula on simulated readings:
+#              python3 allan_stats.py
+#
+# Author:      paulv
+#
+# Created:     18-10-2026
+# Copyright:   (c) paulv 2018 2019 2020
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+
+import math
+import random
+import sys
+
+VERSION = "1.0"
+
+NOMINAL = 10e6      # Hz
+LEVELS = 8          # tau = 1 .. 128 gate times
+
+
+class Welford(object):
+    '''Running mean and variance, numerically stable'''
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, value):
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (value - self.mean)
+
+    @property
+    def variance(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else 0.0
+
+    @property
+    def stdev(self):
+        return math.sqrt(self.variance)
+
+
+class AllanStats(object):
+    '''
+    The overlapping Allan deviation at octave spaced tau, from the frequency
+    readings of a counter with a fixed gate time.
+
+    Every reading is added to the phase (the time error). For tau = m gate
+    times, a second difference x[k] - 2x[k-m] + x[k-2m] is added to the sum
+    of that level, so each level only keeps a sum and a count. All levels
+    share one ring buffer with the last 2m+1 phases of the longest tau.
+
+    The ring is what makes it the overlapping estimator: a term for every
+    reading needs the phases m and 2m readings back. Decimated accumulators
+    per level would need O(1) memory, but give the non-overlapping deviation,
+    with m times fewer terms and a wider confidence at the long taus that
+    take the longest to collect. The ring holds 2 * 2**(levels-1) + 1 phases,
+    257 floats or about 8 kB at 8 levels. It does not grow with the run, only
+    with the longest tau, and one shared ring is half of a ring per level.
+
+    '''
+    def __init__(self, tau0, nominal=NOMINAL, levels=LEVELS):
+        """Needs the gate time in seconds and the nominal frequency."""
+        self.tau0 = float(tau0)
+        self.nominal = float(nominal)
+        self.levels = levels
+        self.m = [1 << i for i in range(levels)]
+        self.size = 2 * self.m[-1] + 1
+        self.offset = Welford()     # of frequency - nominal, keeps the precision
+        self.reset_phase()
+        self.sums = [0.0] * levels
+        self.counts = [0] * levels
+        self.last_y = None
+
+    def reset_phase(self):
+        '''
+        Start a new phase record, after a gap in the readings. The sums are kept.
+        '''
+        self.phase = [0.0] * self.size
+        self.pos = 0            # where the next phase goes
+        self.stored = 0         # phases in the ring, up to size
+        self.x = 0.0
+
+    def add(self, frequency):
+        '''Add a counter reading in Hz'''
+        self.offset.add(frequency - self.nominal)
+        y = (frequency - self.nominal) / self.nominal
+        self.last_y = y
+        if self.stored == 0:
+            self.store(0.0)     # the phase at the start of this reading
+        self.x += y * self.tau0
+        self.store(self.x)
+
+        phase = self.phase
+        size = self.size
+        k = self.pos - 1        # the phase we just stored
+        for i, m in enumerate(self.m):
+            if self.stored <= 2 * m:
+                break
+            d = phase[k % size] - 2.0 * phase[(k - m) % size] + phase[(k - 2 * m) % size]
+            self.sums[i] += d * d
+            self.counts[i] += 1
+
+    def store(self, x):
+        self.phase[self.pos % self.size] = x
+        self.pos = (self.pos + 1) % self.size
+        self.stored = min(self.stored + 1, self.size)
+
+    def adev(self, level):
+        '''The Allan deviation at tau = 2**level gate times, None when we have no data yet'''
+        count = self.counts[level]
+        if count == 0:
+            return None
+        tau = self.m[level] * self.tau0
+        return math.sqrt(self.sums[level] / (2.0 * tau * tau * count))
+
+    def taus(self):
+        return [m * self.tau0 for m in self.m]
+
+    def table(self):
+        '''[(tau, adev, number of terms)] of the levels that have data'''
+        return [(self.m[i] * self.tau0, self.adev(i), self.counts[i])
+                for i in range(self.levels) if self.counts[i]]
+
+    @property
+    def ffo(self):
+        '''Fractional frequency offset of the last reading'''
+        return self.last_y
+
+    @property
+    def n(self):
+        return self.offset.n
+
+    @property
+    def mean(self):
+        '''Mean frequency in Hz'''
+        return self.nominal + self.offset.mean
+
+    @property
+    def stdev(self):
+        return self.offset.stdev
+
+    @property
+    def mean_ffo(self):
+        return self.offset.mean / self.nominal if self.offset.n else None
+
+    def report(self):
+        if not self.n:
+            return "stats: no readings yet"
+        adevs = "  ".join("{:.0f}s {:.2e}".format(tau, adev) for tau, adev, n in self.table())
+        return "stats: n {} mean {:.4f} Hz stdev {:.4f} Hz ffo {:.3e} adev {}".format(
+            self.n, self.mean, self.stdev, self.last_y, adevs or "-")
+
+
+# --- self-check --------------------------------------------------------------
+
+def overlapping_adev(y, tau0, m):
+    '''The textbook overlapping Allan deviation of the fractional frequencies'''
+    x = [0.0]
+    for v in y:
+        x.append(x[-1] + v * tau0)
+    n = len(x)
+    if n <= 2 * m:
+        return None
+    total = sum((x[i + 2 * m] - 2 * x[i + m] + x[i]) ** 2 for i in range(n - 2 * m))
+    return math.sqrt(total / (2.0 * (m * tau0) ** 2 * (n - 2 * m)))
+
+
+def self_check(readings=2000):
+    print("Streaming Allan deviation self-check - Version {}".format(VERSION))
+    rnd = random.Random(1)
+    stats = AllanStats(1000)
+    freqs = []
+    walk = 0.0
+    for i in range(readings):
+        walk += rnd.gauss(0, 1e-5)
+        f = NOMINAL + 0.002 + walk + rnd.gauss(0, 2e-4)
+        freqs.append(f)
+        stats.add(f)
+
+    y = [(f - NOMINAL) / NOMINAL for f in freqs]
+    errors = 0
+    for level in range(stats.levels):
+        streamed = stats.adev(level)
+        batch = overlapping_adev(y, 1000.0, stats.m[level])
+        ok = streamed is not None and abs(streamed - batch) <= 1e-9 * batch
+        errors += not ok
+        print("tau {:>7.0f}s  streamed {:.6e}  batch {:.6e}  {}".format(
+            stats.m[level] * 1000.0, streamed, batch, "ok" if ok else "DIFFERS"))
+
+    mean = math.fsum(freqs) / len(freqs)
+    stdev = math.sqrt(math.fsum((f - mean) ** 2 for f in freqs) / (len(freqs) - 1))
+    if abs(stats.mean - mean) > 1e-12 * mean or abs(stats.stdev - stdev) > 1e-6 * stdev:
+        print("mean/stdev differ: {} {} / {} {}".format(stats.mean, mean, stats.stdev, stdev))
+        errors += 1
+    print(stats.report())
+    return errors
+
+
+if __name__ == '__main__':
+    sys.exit(1 if self_check() else 0)
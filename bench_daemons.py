@@ -0,0 +1,297 @@
+#!/usr/bin/python3.7
+#-------------------------------------------------------------------------------
+# Name:        bench_daemons.py
+# Purpose:     What the monitors cost, measured with replay.py on made up
+#              streams at 9600, 38400 and 115200 baud and 1, 5 and 10 lines
+#              (or NMEA bursts) per second:
+#                  ser_mon_gpsdo, serial_bb_gps, serial_bb_counter
+#              and the oled driver at 1, 5 and 10 new counter readings per second.
+#              Every case runs in its own process, so the peak RSS and the
+#              context switches are those of that case only. A case is run
+#              twice:
+#               - as fast as possible: the lines per second it can take
+#               - in real time for SECONDS: the cpu seconds per hour, the
+#                 wake-ups of the loop, the context switches and the latency
+#                 from the arrival of the last byte of a sentence to its line
+#                 in the log (the json file is written right after it). A line
+#                 is paired with its sentence by its sequence number, or by
+#                 its arrival when it has none, so a lost line does not shift
+#                 the others. For the oled driver, the loop is woken up by its
+#                 watcher and the latency is from the json file to the frame.
+#              The results go to a json file, with the versions of the
+#              modules. Compare it with the one of an older version with
+#              --compare to see what got slower.
+#
+#              python3 bench_daemons.py [--seconds 10] [--only gpsdo,counter]
+#                                       [--out bench_results.json]
+#              python3 bench_daemons.py --compare old_results.json [new_results.json]
+#
+# Author:      paulv
+#
+# Created:     18-10-2026
+# Copyright:   (c) paulv 2018 2019 2020
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+
+import argparse
+import json
+import logging
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import time
+
+import replay
+
+VERSION = "1.1"     # the oled paced by its watcher, lines paired by sequence or arrival
+
+BAUDS = [9600, 38400, 115200]
+RATES = [1, 5, 10]
+SECONDS = 10        # real-time seconds of every case
+FAST_LINES = 2000   # lines for the as fast as possible run
+CHUNK = 16          # bytes per chunk, about what the UART hands over per interrupt
+OUT_FILE = "bench_results.json"
+WORSE = 0.10        # a result that is this much worse shows up in --compare
+
+# what a source writes to the log for every sentence, and the sentence that
+# triggers it. A group in the pattern is the sequence number of the line.
+OUTPUTS = {
+    "counter": (re.compile(r"^gate\t"), b""),
+    "gps": (re.compile(r"Satellites:"), b"GGA"),
+    "gpsdo": (re.compile(r"^(\d+) -?\d+ \d+ "), b""),
+}
+
+
+class OutputTimes(logging.Handler):
+    '''
+    Notes the monotonic time of every log line of the output, with its
+    sequence number when the pattern has one
+    '''
+    def __init__(self, pattern):
+        """Needs the regular expression of an output line."""
+        logging.Handler.__init__(self)
+        self.pattern = pattern
+        self.times = []
+
+    def emit(self, record):
+        match = self.pattern.search(record.getMessage())
+        if match:
+            self.times.append((time.monotonic_ns(), int(match.group(1)) if self.pattern.groups else None))
+
+
+def pair(outputs, marks):
+    '''
+    The (output, arrival) times of every output line and its sentence. With
+    a sequence number that is the sentence, without one it is the last
+    sentence that arrived before the line, those before it were lost.
+    '''
+    pairs = []
+    j = 0
+    for t, seq in outputs:
+        if seq is not None:
+            if 0 <= seq < len(marks) and marks[seq] <= t:
+                pairs.append((t, marks[seq]))
+            continue
+        while j + 1 < len(marks) and marks[j + 1] <= t:
+            j += 1
+        if j < len(marks) and marks[j] <= t:
+            pairs.append((t, marks[j]))
+            j += 1
+    return pairs
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100.0), len(values) - 1)]
+
+
+def settings(source, baud, rate, times=None):
+    '''The setup() for replay.replay() of a case'''
+    def setup(mod):
+        if source == "gpsdo":
+            mod.baudrate = baud
+        else:
+            mod.baud = baud
+        if source == "gps":
+            mod.NMEA_INTERVAL = 1.0 / rate
+        if times is not None:
+            mod.logger.addHandler(times)
+    return setup
+
+
+def usage():
+    r = resource.getrusage(resource.RUSAGE_SELF)
+    return r.ru_nvcsw, r.ru_nivcsw
+
+
+def run_case(source, baud, rate, seconds):
+    '''Both runs of a case, in this process. Returns a dict of the results.'''
+    result = {"source": source, "baud": baud, "rate": rate, "seconds": seconds}
+    if source == "oled":
+        return run_oled(result, rate, seconds)
+    pattern, marker = OUTPUTS[source]
+    make = replay.LINES[source]
+
+    # as fast as possible, the sentences come in faster than the baud rate allows
+    lines = make(FAST_LINES, rate)
+    fast = replay.replay(source, replay.timeline(lines, baud, CHUNK), setup=settings(source, baud, rate))
+    result["version"] = fast["module"].VERSION
+    result["lines_per_s"] = fast["outputs"] / fast["seconds"]
+    result["cpu_us_per_line"] = 1e6 * fast["cpu"] / max(fast["outputs"], 1)
+
+    # real time, the lines that arrive within seconds
+    lines = make(int(seconds * rate), rate)
+    events = replay.timeline(lines, baud, CHUNK)
+    marks = replay.arrivals(lines, baud, CHUNK, marker)
+    end = seconds * 10**9
+    events = [e for e in events if e[0] <= end]
+    marks = [m for m in marks if m <= end]
+    times = OutputTimes(pattern)
+    switches = usage()
+    run = replay.replay(source, events, realtime=True, setup=settings(source, baud, rate, times))
+    voluntary, involuntary = [b - a for a, b in zip(switches, usage())]
+    elapsed = max(run["seconds"], 1e-6)
+    outputs = [(t - run["start"], seq) for t, seq in times.times if t >= run["start"]]
+    latency = [(t - m) / 1e6 for t, m in pair(outputs, marks)]
+    wakeups = run.get("polls", run.get("wakeups", 0))
+    result.update({
+        "lines_in": len(marks),
+        "outputs": len(outputs),
+        "bytes_per_s": run["bytes"] / elapsed,
+        "line_load": run["bytes"] / elapsed / (baud / 10.0),   # part of what the port can carry
+        "cpu_s_per_hour": run["cpu"] * 3600.0 / elapsed,
+        "wakeups_per_s": wakeups / elapsed,
+        "voluntary_switches_per_s": voluntary / elapsed,
+        "involuntary_switches_per_s": involuntary / elapsed,
+        "overruns": run["overruns"],
+        "latency_ms": {"mean": sum(latency) / len(latency) if latency else None,
+                       "p50": percentile(latency, 50), "p99": percentile(latency, 99),
+                       "max": max(latency) if latency else None},
+    })
+    return result
+
+
+def run_oled(result, rate, seconds):
+    '''
+    The render and the I2C writes of a frame as fast as possible, and the
+    loop of the driver in real time with rate new readings per second
+    '''
+    frames = int(seconds * rate)
+    fast = replay.replay_oled(FAST_LINES)
+    result["version"] = fast["module"].VERSION
+    result["lines_per_s"] = FAST_LINES / fast["seconds"]
+    result["cpu_us_per_line"] = 1e6 * fast["cpu"] / FAST_LINES
+    run = replay.replay_oled_paced(frames, rate)
+    elapsed = max(run["seconds"], 1e-6)
+    latency = [t / 1e6 for t in run["latency_ns"]]
+    result.update({
+        "lines_in": frames,
+        "outputs": run["shown"],
+        "i2c_bytes_per_frame": run["i2c_bytes"] / float(max(run["shown"], 1)),
+        "cpu_s_per_hour": run["cpu"] * 3600.0 / elapsed,
+        "wakeups_per_s": run["wakeups"] / elapsed,
+        "voluntary_switches_per_s": run["voluntary_switches"] / elapsed,
+        "involuntary_switches_per_s": run["involuntary_switches"] / elapsed,
+        "latency_ms": {"mean": sum(latency) / len(latency) if latency else None,
+                       "p50": percentile(latency, 50), "p99": percentile(latency, 99),
+                       "max": max(latency) if latency else None},
+    })
+    return result
+
+
+def cases(only=None):
+    for source in ("gpsdo", "gps", "counter"):
+        if only is None or source in only:
+            for baud in BAUDS:
+                for rate in RATES:
+                    yield source, baud, rate
+    if only is None or "oled" in only:
+        for rate in RATES:
+            yield "oled", None, rate
+
+
+def run_all(seconds=SECONDS, only=None, out=OUT_FILE):
+    '''Run every case in a process of its own, write the results to out'''
+    print("Daemon benchmark - Version {}".format(VERSION))
+    results = []
+    for source, baud, rate in cases(only):
+        case = json.dumps([source, baud, rate, seconds])
+        p = subprocess.run([sys.executable, os.path.abspath(__file__), "--case", case],
+                           stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                           universal_newlines=True, timeout=seconds * 20 + 120)
+        try:
+            result = json.loads(p.stdout.strip().splitlines()[-1])
+        except (IndexError, ValueError):
+            error = (p.stderr.strip().splitlines() or ["exit code {}".format(p.returncode)])[-1]
+            result = {"source": source, "baud": baud, "rate": rate, "error": error}
+        results.append(result)
+        print(line(result))
+    with open(out, "w") as f:
+        json.dump({"version": VERSION, "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                   "host": platform.node(), "machine": platform.machine(),
+                   "python": platform.python_version(), "seconds": seconds,
+                   "results": results}, f, indent=1)
+    print("results in {}".format(out))
+
+
+def line(r):
+    name = "{:7s} {:>6} {:>2} Hz".format(r["source"], r["baud"] or "", r["rate"])
+    if "error" in r:
+        return "{}: {}".format(name, r["error"])
+    lat = r["latency_ms"]
+    return ("{}: {:8.0f} lines/s, cpu {:6.2f} s/h, {:6.1f} wakeups/s, {:6.1f}+{:.1f} cs/s, "
+            "rss {:6d} kB, latency {} / {} ms".format(
+            name, r["lines_per_s"], r["cpu_s_per_hour"], r["wakeups_per_s"],
+            r["voluntary_switches_per_s"], r["involuntary_switches_per_s"], r["max_rss_kb"],
+            "-" if lat["p50"] is None else "{:.2f}".format(lat["p50"]),
+            "-" if lat["p99"] is None else "{:.2f}".format(lat["p99"])))
+
+
+def compare(old_path, new_path=OUT_FILE):
+    '''The cases that got WORSE slower, in cpu or in latency'''
+    with open(old_path) as f:
+        old = {(r["source"], r["baud"], r["rate"]): r for r in json.load(f)["results"]}
+    with open(new_path) as f:
+        new = json.load(f)["results"]
+    worse = 0
+    for r in new:
+        o = old.get((r["source"], r["baud"], r["rate"]))
+        if o is None or "error" in o or "error" in r:
+            continue
+        for name, a, b in (("cpu s/h", o["cpu_s_per_hour"], r["cpu_s_per_hour"]),
+                           ("p99 ms", o["latency_ms"]["p99"], r["latency_ms"]["p99"])):
+            if a and b and b > a * (1 + WORSE):
+                worse += 1
+                print("{:7s} {:>6} {:>2} Hz: {} {:.3f} -> {:.3f} (+{:.0f}%), version {} -> {}".format(
+                    r["source"], r["baud"] or "", r["rate"], name, a, b, 100.0 * (b / a - 1),
+                    o.get("version"), r.get("version")))
+    print("{} results more than {:.0f}% worse".format(worse, 100 * WORSE))
+    return worse
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU, wake-ups and latency of the monitors")
+    parser.add_argument("--seconds", type=float, default=SECONDS, help="real-time seconds per case")
+    parser.add_argument("--only", help="sources to run, like gpsdo,counter,gps,oled")
+    parser.add_argument("--out", default=OUT_FILE)
+    parser.add_argument("--compare", nargs="+", metavar="FILE", help="old [new] results")
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        result = run_case(*json.loads(args.case))
+        result["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        print(json.dumps(result))
+    elif args.compare:
+        sys.exit(1 if compare(*args.compare[:2]) else 0)
+    else:
+        run_all(args.seconds, args.only.split(",") if args.only else None, args.out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+#!/usr/bin/python3.7
+#-------------------------------------------------------------------------------
+# Name:        columnar_capture.py
+# Purpose:     Binary capture of the GPSDO reports, one file per field.
+#              Every report line of the Nano is parsed into numbers, with the
+#              schema of nano_report.py, and added to fixed-width column files
+#              in a directory per day:
+#                  <root>/2026-10-18/ts.q      time of arrival, int64 ns
+#                  <root>/2026-10-18/tic.i     int32
+#                  <root>/2026-10-18/temp.f    float32
+#              The extension is the array typecode of the column. There is no
+#              header, so a reader can map the files and use them as they are,
+#              with numpy.memmap when numpy is there.
+#              Used by ser_mon_gpsdo.py when CAPTURE = True
+#
+#              Summary of a day, and moving the old days off the RAM disk:
+#              python3 columnar_capture.py /mnt/ramdisk/capture/2026-10-18
+#              python3 columnar_capture.py --archive /home/pi/gpsdo_capture
+#
+# Author:      paulv
+#
+# Created:     18-10-2026
+# Copyright:   (c) paulv 2018 2019 2020
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+
+import array
+import mmap
+import os
+import shutil
+import sys
+import time
+
+import nano_report
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+VERSION = "1.3"     # a flush that fails leaves the files and the buffers as they were
+
+CAPTURE_DIR = "/mnt/ramdisk/capture"
+FLUSH_ROWS = 60     # rows to collect before they are written, a minute at 1 Hz
+
+TIMESTAMP = ("ts", "q")
+
+# the numpy types of the array typecodes, the files are little-endian like the Pi
+DTYPES = {"b": "<i1", "h": "<i2", "i": "<i4", "q": "<i8", "f": "<f4", "d": "<f8"}
+
+
+class ColumnWriter(object):
+    '''
+    Collects the rows in arrays and adds them to the column files of the day
+    every FLUSH_ROWS rows, when the day changes and at close().
+    When a write fails (the RAM disk is full) the files are cut back to the
+    rows they had, the rows stay in the buffers for the next flush and the
+    OSError goes to the caller.
+
+    '''
+    def __init__(self, root=CAPTURE_DIR, schema=nano_report.report, flush_rows=FLUSH_ROWS):
+        """Needs the capture directory and the nano_report schema of a row."""
+        self.root = root
+        self.schema = schema
+        self.columns = [TIMESTAMP] + list(zip(schema.names, schema.typecodes))
+        self.buffers = [array.array(typecode) for name, typecode in self.columns]
+        self.flush_rows = flush_rows
+        self.day = None
+        self.pending = 0    # rows in the buffers
+        self.rows = 0       # rows written to the files
+        self.rejected = 0   # lines that could not be parsed
+        self.failed = 0     # flushes that could not be written
+
+    def add_line(self, text, ts=None):
+        '''
+        Parse a report line and add it, returns False when it was rejected
+        '''
+        try:
+            self.append(self.schema.values(text), ts)
+        except ValueError:   # also nano_report.ReportFormatError
+            self.rejected += 1
+            return False
+        return True
+
+    def append(self, values, ts=None):
+        '''
+        Add a row of values, ts is the time of arrival in ns since the epoch
+        '''
+        if ts is None:
+            ts = time.time_ns()
+        day = time.strftime("%Y-%m-%d", time.localtime(ts // 1000000000))
+        if day != self.day:
+            self.flush()
+            self.day = day
+        row = [ts] + list(values)
+        done = 0
+        try:
+            for buf, value in zip(self.buffers, row):
+                buf.append(value)
+                done += 1
+        except (OverflowError, TypeError) as e:
+            # take the row out again, the columns have to stay the same length
+            for buf in self.buffers[:done]:
+                buf.pop()
+            raise ValueError("can't store {}: {}".format(row, e))
+        self.pending += 1
+        if self.pending >= self.flush_rows:
+            self.flush()
+
+    def path(self, day=None):
+        return os.path.join(self.root, day or self.day)
+
+    def flush(self):
+        if self.pending == 0:
+            return
+        directory = self.path()
+        os.makedirs(directory, exist_ok=True)
+        paths = [os.path.join(directory, "{}.{}".format(name, typecode))
+                 for name, typecode in self.columns]
+        sizes = [os.path.getsize(path) if os.path.exists(path) else 0 for path in paths]
+        try:
+            for path, buf in zip(paths, self.buffers):
+                with open(path, "ab") as f:
+                    buf.tofile(f)
+        except OSError:
+            # all columns or none, or the rows no longer line up
+            for path, size in zip(paths, sizes):
+                try:
+                    os.truncate(path, size)
+                except OSError:
+                    pass    # load_day() still cuts the columns to the shortest
+            self.failed += 1
+            raise
+        for buf in self.buffers:
+            del buf[:]
+        self.rows += self.pending
+        self.pending = 0
+
+    def report(self):
+        return "capture: {} rows written, {} buffered, {} lines rejected, {} flushes failed".format(
+            self.rows, self.pending, self.rejected, self.failed)
+
+    def close(self):
+        self.flush()
+
+
+def column_files(directory):
+    '''
+    Returns [(name, typecode, path)] of the columns in a day directory
+    '''
+    columns = []
+    for entry in sorted(os.listdir(directory)):
+        name, _, typecode = entry.rpartition(".")
+        if name and typecode in DTYPES:
+            columns.append((name, typecode, os.path.join(directory, entry)))
+    return columns
+
+
+def map_column(path, typecode, rows):
+    '''
+    Map the first rows of a column file, as a numpy array when we have numpy,
+    otherwise as a memoryview of the typecode
+    '''
+    if rows == 0:
+        return numpy.zeros(0, DTYPES[typecode]) if numpy is not None else memoryview(array.array(typecode))
+    if numpy is not None:
+        return numpy.memmap(path, dtype=DTYPES[typecode], mode="r", shape=(rows,))
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(mm)[:rows * array.array(typecode).itemsize].cast(typecode)
+
+
+def load_day(directory):
+    '''
+    Map all columns of a day, returns {name: column}. The columns all get the
+    length of the shortest one, a crash can leave a partly written row behind.
+    '''
+    columns = column_files(directory)
+    if not columns:
+        return {}
+    rows = column_rows(columns)
+    return {name: map_column(path, typecode, rows) for name, typecode, path in columns}
+
+
+def load_days(root, first, last):
+    '''
+    The columns of the days first..last (YYYY-MM-DD) joined together.
+    With numpy, the result is one array per column.
+    '''
+    days = [d for d in sorted(os.listdir(root)) if first <= d <= last]
+    joined = {}
+    for day in days:
+        for name, column in load_day(os.path.join(root, day)).items():
+            joined.setdefault(name, []).append(column)
+    if numpy is not None:
+        return {name: numpy.concatenate(parts) for name, parts in joined.items()}
+    result = {}
+    for name, parts in joined.items():
+        result[name] = array.array(parts[0].format)
+        for part in parts:
+            result[name].extend(part)
+    return result
+
+
+def archive(destination, root=CAPTURE_DIR):
+    '''
+    Move all days except today to the destination, run by cron after midnight.
+    A day that is already there gets the new rows added to it, it is never
+    replaced.
+    '''
+    today = time.strftime("%Y-%m-%d")
+    os.makedirs(destination, exist_ok=True)
+    for day in sorted(os.listdir(root)):
+        if day < today:
+            source = os.path.join(root, day)
+            target = os.path.join(destination, day)
+            if not os.path.exists(target):
+                shutil.move(source, target)
+                print("moved {} to {}".format(day, target))
+            elif merge_day(source, target):
+                shutil.rmtree(source)
+
+
+def column_rows(columns):
+    '''The complete rows of the column files, the shortest column'''
+    return min(os.path.getsize(path) // array.array(typecode).itemsize
+               for name, typecode, path in columns)
+
+
+def merge_day(source, target):
+    '''
+    Add the rows of the day in source to the same day in target. The rows
+    that are already there are skipped. Returns False, and leaves both as
+    they are, when they can't be merged.
+    '''
+    new = column_files(source)
+    old = column_files(target)
+    if [(name, typecode) for name, typecode, path in new] != \
+            [(name, typecode) for name, typecode, path in old]:
+        print("{}: not merged, the columns differ from {}".format(source, target))
+        return False
+    if not new:
+        return True
+    new_rows = column_rows(new)
+    old_rows = column_rows(old)
+    new_ts = load_day(source).get(TIMESTAMP[0])
+    old_ts = load_day(target).get(TIMESTAMP[0])
+    # the rows are in the order they came in, skip those up to the last one
+    # in the archive, but only when they are in there
+    last = old_ts[old_rows - 1] if old_rows and old_ts is not None else None
+    skip = 0
+    if last is not None and new_ts is not None:
+        while skip < new_rows and new_ts[skip] <= last:
+            skip += 1
+        if skip and not set(new_ts[:skip].tolist()) <= set(old_ts[:old_rows].tolist()):
+            print("{}: not merged, it has rows that are not in {} and older than its last".format(
+                source, target))
+            return False
+    del new_ts, old_ts     # the maps, before the files change
+    for (name, typecode, new_path), (_, _, old_path) in zip(new, old):
+        size = array.array(typecode).itemsize
+        with open(new_path, "rb") as f:
+            f.seek(skip * size)
+            data = f.read((new_rows - skip) * size)
+        with open(old_path, "r+b") as f:
+            # a crash can have left a partly written row behind
+            f.truncate(old_rows * size)
+            f.seek(0, os.SEEK_END)
+            f.write(data)
+    print("merged {} rows of {} into {}, {} were already there".format(
+        new_rows - skip, source, target, skip))
+    return True
+
+
+def summary(directory):
+    columns = load_day(directory)
+    if not columns:
+        print("no columns in {}".format(directory))
+        return
+    ts = columns.get(TIMESTAMP[0])
+    rows = len(ts) if ts is not None else 0
+    print("{}: {} rows".format(directory, rows))
+    if rows:
+        print("from {} to {}".format(time.ctime(ts[0] / 1e9), time.ctime(ts[rows - 1] / 1e9)))
+    for name, column in sorted(columns.items()):
+        if name == TIMESTAMP[0] or len(column) == 0:
+            continue
+        if numpy is not None:
+            low, high, mean = column.min(), column.max(), column.mean()
+        else:
+            low, high, mean = min(column), max(column), sum(column) / float(len(column))
+        print("{:>10}: min {}  max {}  mean {:.4f}".format(name, low, high, mean))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == "--archive":
+        archive(sys.argv[2])
+    else:
+        summary(sys.argv[1] if len(sys.argv) > 1 else os.path.join(CAPTURE_DIR, time.strftime("%Y-%m-%d")))
@@ -0,0 +1,621 @@
+#!/usr/bin/python3.7
+#-------------------------------------------------------------------------------
+# Name:        compressed_log.py
+# Purpose:     Logs on the RAM disk that are compressed while they are written,
+#              about 10x smaller than the text logs.
+#              CompressedRotatingHandler is the TimedRotatingFileHandler of the
+#              monitors, but it writes gpsdo.log.gz (or .xz) and rotates it at
+#              midnight into gpsdo.log.2026-10-17.gz. Every FLUSH_INTERVAL
+#              seconds the compressed data is flushed to the file:
+#               - gzip: a sync flush, the file can be read up to that point
+#                 even after a crash, without the end of the gzip stream
+#               - xz: the stream is ended and a new one started, a file with
+#                 several streams is still a normal .xz file
+#              A file that was not closed, after a crash or a kill, is cut back
+#              to its last flush and ended when it is opened again, so the
+#              file stays a normal .gz or .xz file over the restarts.
+#              The readers here read a plain, a .gz and a .xz log, also the
+#              active one, and tail() follows a log as it is written.
+#              Used by the monitors, log_archive.py, day_charts.py and
+#              mail_reports.py
+#
+#              python3 compressed_log.py tail /mnt/ramdisk/gpsdo.log.gz
+#              python3 compressed_log.py cat /mnt/ramdisk/gpsdo.log.2026-10-17.xz
+#              python3 compressed_log.py --selftest
+#
+# Author:      paulv
+#
+# Created:     18-10-2026
+# Copyright:   (c) paulv 2018 2019 2020
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+
+import gzip
+import logging.handlers
+import lzma
+import os
+import re
+import struct
+import sys
+import time
+import zlib
+
+VERSION = "1.1"     # end the file of a crash before appending, resync the readers
+
+FLUSH_INTERVAL = 60     # seconds between flushes to the file
+GZIP_LEVEL = 6
+XZ_PRESET = 6
+READ_SIZE = 64 * 1024
+EXTENSIONS = {"gz": ".gz", "xz": ".xz"}
+
+GZIP_MAGIC = b"\x1f\x8b\x08"       # the start of a gzip member, with deflate
+XZ_MAGIC = b"\xfd7zXZ\x00"         # the start of an xz stream
+SYNC_MARK = b"\x00\x00\xff\xff"    # the end of the empty block of a sync flush
+
+
+class GzipStream(object):
+    '''
+    A text stream into a gzip file that stays readable. The file is opened
+    to append, a restart adds a new gzip member after the member of the last
+    run is ended.
+
+    '''
+    def __init__(self, path, interval=FLUSH_INTERVAL, level=GZIP_LEVEL):
+        """Needs the path of the file and the seconds between flushes."""
+        finish_file(path, gzip_end)
+        self.file = open(path, "ab")
+        self.interval = interval
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        self.last_flush = time.monotonic()
+
+    def write(self, text):
+        self.file.write(self.compressor.compress(text.encode("utf-8", "replace")))
+
+    def flush(self):
+        '''Called by the handler after every record, only flushes now and then'''
+        if time.monotonic() - self.last_flush >= self.interval:
+            self.sync()
+
+    def sync(self):
+        self.file.write(self.compressor.flush(zlib.Z_SYNC_FLUSH))
+        self.file.flush()
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        if self.compressor is not None:
+            self.file.write(self.compressor.flush(zlib.Z_FINISH))
+            self.compressor = None
+        self.file.close()
+
+
+class XzStream(GzipStream):
+    '''
+    A text stream into an xz file. lzma has no sync flush, so a flush ends
+    the stream and the next write starts a new one.
+
+    '''
+    def __init__(self, path, interval=FLUSH_INTERVAL, preset=XZ_PRESET):
+        """Needs the path of the file and the seconds between flushes."""
+        finish_file(path, xz_end)
+        self.file = open(path, "ab")
+        self.interval = interval
+        self.preset = preset
+        self.compressor = None
+        self.last_flush = time.monotonic()
+
+    def write(self, text):
+        if self.compressor is None:
+            self.compressor = lzma.LZMACompressor(preset=self.preset)
+        self.file.write(self.compressor.compress(text.encode("utf-8", "replace")))
+
+    def sync(self):
+        if self.compressor is not None:
+            self.file.write(self.compressor.flush())
+            self.compressor = None
+        self.file.flush()
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+
+STREAMS = {"gz": GzipStream, "xz": XzStream}
+
+
+class CompressedRotatingHandler(logging.handlers.TimedRotatingFileHandler):
+    '''
+    TimedRotatingFileHandler that writes a compressed log. The filename is the
+    one of the text log, the extension of the compression is added to it.
+
+    '''
+    def __init__(self, filename, compression="gz", interval=FLUSH_INTERVAL, **kwargs):
+        """Needs the filename of the text log, "gz" or "xz" and the seconds between flushes."""
+        # _open() is called by the constructor, so set these first
+        self.compression = compression
+        self.flush_interval = interval
+        self.extension = EXTENSIONS[compression]
+        logging.handlers.TimedRotatingFileHandler.__init__(
+            self, filename + self.extension, **kwargs)
+        self.namer = self.rotated_name
+
+    def _open(self):
+        return STREAMS[self.compression](self.baseFilename, self.flush_interval)
+
+    def rotated_name(self, name):
+        '''gpsdo.log.gz.2026-10-17 -> gpsdo.log.2026-10-17.gz'''
+        return name.replace(self.extension + ".", ".", 1) + self.extension
+
+    def getFilesToDelete(self):
+        directory, name = os.path.split(self.baseFilename)
+        prefix = name[:-len(self.extension)] + "."
+        found = []
+        for entry in os.listdir(directory):
+            if entry.startswith(prefix) and entry.endswith(self.extension):
+                if self.extMatch.match(entry[len(prefix):-len(self.extension)]):
+                    found.append(os.path.join(directory, entry))
+        found.sort()
+        if len(found) <= self.backupCount:
+            return []
+        return found[:len(found) - self.backupCount]
+
+    def sync(self):
+        '''Flush the compressed data to the file now'''
+        self.acquire()
+        try:
+            if self.stream is not None:
+                self.stream.sync()
+        finally:
+            self.release()
+
+
+def log_handler(filename, compression=None, backup_count=31):
+    '''
+    The midnight rotating handler of the monitors, compressed with "gz" or
+    "xz", or the plain text log for None
+    '''
+    if compression:
+        return CompressedRotatingHandler(filename, compression, when="midnight",
+                                         backupCount=backup_count)
+    return logging.handlers.TimedRotatingFileHandler(filename, when="midnight",
+                                                     backupCount=backup_count)
+
+
+# --- readers -----------------------------------------------------------------
+
+def gzip_body(data, pos):
+    '''The offset of the deflate data of the gzip member at pos'''
+    flags = data[pos + 3]
+    body = pos + 10
+    if flags & 4:           # FEXTRA
+        body += 2 + struct.unpack_from("<H", data, body)[0]
+    for flag in (8, 16):    # FNAME, FCOMMENT, zero terminated
+        if flags & flag:
+            body = data.index(b"\0", body) + 1
+    if flags & 2:           # FHCRC
+        body += 2
+    return body
+
+
+def last_sync_point(data, start, end=None):
+    '''
+    The gzip member at start, cut off before end, up to its last sync flush.
+    Returns (offset of the end of the sync flush, the data up to it), None
+    when there is no complete sync flush.
+    '''
+    end = len(data) if end is None else end
+    try:
+        body = gzip_body(data, start)
+    except (IndexError, ValueError, struct.error):
+        return None
+    pos = data.rfind(SYNC_MARK, body, end)
+    while pos >= 0:
+        # after a real sync flush, an empty last block ends the deflate data
+        d = zlib.decompressobj(-15)
+        try:
+            text = d.decompress(data[body:pos + len(SYNC_MARK)] + b"\x03\x00")
+            if d.eof and not d.unused_data:
+                return pos + len(SYNC_MARK), text
+        except zlib.error:
+            pass
+        pos = data.rfind(SYNC_MARK, body, pos + len(SYNC_MARK) - 1)
+    return None
+
+
+def next_stream(data, pos, magic, make, errors):
+    '''
+    The offset of the next gzip member or xz stream from pos on, None when
+    there is none. The magic can also be in the compressed data, so its
+    start has to decompress.
+    '''
+    pos = data.find(magic, pos)
+    while pos >= 0:
+        try:
+            make().decompress(data[pos:pos + READ_SIZE])
+            return pos
+        except errors:
+            pos = data.find(magic, pos + 1)
+    return None
+
+
+def decompress_gzip(data):
+    '''
+    The data of all the gzip members. A member that was cut off by a crash
+    and has another one after it is read up to its last sync flush. The last
+    member can be cut off, it is read up to where it is written.
+    Returns (data, offset of the last member, complete).
+    '''
+    out = []
+    start = last = 0
+    complete = True
+    while start < len(data):
+        last = start
+        d = zlib.decompressobj(31)
+        try:
+            part = d.decompress(data[start:])
+        except zlib.error:
+            part = None
+        if part is not None and d.eof:
+            out.append(part)
+            start = len(data) - len(d.unused_data)
+            continue
+        following = next_stream(data, start + 1, GZIP_MAGIC, lambda: zlib.decompressobj(31), zlib.error)
+        if following is None and part is not None:
+            # the active member
+            out.append(part)
+            complete = False
+            break
+        sync = last_sync_point(data, start, following)
+        if sync is not None:
+            out.append(sync[1])
+        if following is None:
+            complete = False
+            break
+        start = following
+    return b"".join(out), last, complete
+
+
+def decompress_xz(data):
+    '''
+    The data of all the xz streams. A stream that was cut off by a crash and
+    has another one after it is skipped, it only has what came after the
+    last flush. The last stream can be cut off, it is read up to where it is
+    written. Returns (data, offset of the last stream, complete).
+    '''
+    out = []
+    start = last = 0
+    complete = True
+    while start < len(data):
+        last = start
+        d = lzma.LZMADecompressor()
+        try:
+            part = d.decompress(data[start:])
+        except lzma.LZMAError:
+            part = None
+        if part is not None and d.eof:
+            out.append(part)
+            start = len(data) - len(d.unused_data)
+            continue
+        complete = False
+        following = next_stream(data, start + 1, XZ_MAGIC, lzma.LZMADecompressor, lzma.LZMAError)
+        if following is None:
+            if part is not None:
+                out.append(part)    # the active stream
+            break
+        start = following
+        complete = True
+    return b"".join(out), last, complete
+
+
+def decompress(path, data):
+    if path.endswith(".gz"):
+        return decompress_gzip(data)[0]
+    if path.endswith(".xz"):
+        return decompress_xz(data)[0]
+    return data
+
+
+def read_log(path):
+    '''The text of a plain, .gz or .xz log, as bytes'''
+    with open(path, "rb") as f:
+        return decompress(path, f.read())
+
+
+def log_path(path):
+    '''
+    The path of the log or of its compressed version, whichever is there,
+    None when there is none
+    '''
+    for extension in ("",) + tuple(EXTENSIONS.values()):
+        if os.path.isfile(path + extension):
+            return path + extension
+    return None
+
+
+def strip_extension(name):
+    for extension in EXTENSIONS.values():
+        if name.endswith(extension):
+            return name[:-len(extension)]
+    return name
+
+
+def gzip_end(data):
+    '''
+    How a gzip file that was not closed gets the end of its last member:
+    returns (offset to cut it at, bytes to add). The member is cut after
+    its last sync flush, the compressor can have written more after it,
+    and gets an empty last block and the gzip trailer.
+    '''
+    text, last, complete = decompress_gzip(data)
+    if complete:
+        return len(data), b""
+    sync = last_sync_point(data, last)
+    if sync is None:
+        return last, b""    # nothing of the last member was flushed
+    end, text = sync
+    return end, b"\x03\x00" + struct.pack("<II", zlib.crc32(text) & 0xffffffff, len(text) & 0xffffffff)
+
+
+def xz_end(data):
+    '''
+    How an xz file that was not closed is ended: cut off the stream that was
+    not finished. Returns (offset to cut it at, bytes to add).
+    '''
+    text, last, complete = decompress_xz(data)
+    if complete:
+        return len(data), b""
+    return last, b""
+
+
+def finished_gzip(data):
+    '''
+    The data of a gzip log that is still written to, with the end of the
+    gzip stream added, so gzip -d takes it without a warning
+    '''
+    end, ending = gzip_end(data)
+    return data[:end] + ending
+
+
+def finish_file(path, ends):
+    '''
+    End a compressed file that was not closed, after a crash or a kill, so a
+    new gzip member or xz stream can be added after it. ends is gzip_end or
+    xz_end.
+    '''
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return
+    end, ending = ends(data)
+    if end == len(data) and not ending:
+        return
+    with open(path, "r+b") as f:
+        f.truncate(end)
+        f.seek(end)
+        f.write(ending)
+    print("{}: ended the file of the last run, {} bytes cut off".format(path, len(data) - end))
+
+
+class Decoder(object):
+    '''
+    Decompresses a log that comes in a piece at a time, over the ends of the
+    gzip members or xz streams
+
+    '''
+    def __init__(self, path):
+        """Needs the path of the log, for its extension."""
+        if path.endswith(".gz"):
+            self.make = lambda: zlib.decompressobj(31)
+            self.magic = GZIP_MAGIC
+        elif path.endswith(".xz"):
+            self.make = lzma.LZMADecompressor
+            self.magic = XZ_MAGIC
+        else:
+            self.make = None
+        self.decompressor = None
+
+    def feed(self, data):
+        if self.make is None:
+            return data
+        out = []
+        while data:
+            if self.decompressor is None:
+                self.decompressor = self.make()
+            try:
+                out.append(self.decompressor.decompress(data))
+            except (zlib.error, lzma.LZMAError):
+                # a member that was cut off in a file of an older version,
+                # go on at the next one
+                self.decompressor = None
+                pos = data.find(self.magic, 1)
+                data = data[pos:] if pos > 0 else b""
+                continue
+            if self.decompressor.eof:
+                data = self.decompressor.unused_data
+                self.decompressor = None
+            else:
+                data = b""
+        return b"".join(out)
+
+
+def tail(path, follow=True, interval=1.0):
+    '''
+    Yields the lines of a log as they are written, also when it is
+    compressed. A new file after the rotation is read from its start.
+    '''
+    f = None
+    while True:
+        if f is None:
+            try:
+                f = open(path, "rb")
+            except FileNotFoundError:
+                if not follow:
+                    return
+                time.sleep(interval)
+                continue
+            inode = os.fstat(f.fileno()).st_ino
+            decoder = Decoder(path)
+            pending = b""
+        while True:
+            data = f.read(READ_SIZE)
+            if not data:
+                break
+            lines = (pending + decoder.feed(data)).split(b"\n")
+            pending = lines.pop()
+            for line in lines:
+                yield line
+        if not follow:
+            f.close()
+            if pending:
+                yield pending
+            return
+        time.sleep(interval)
+        try:
+            if os.stat(path).st_ino != inode:
+                f.close()
+                f = None    # rotated, read the new file
+        except FileNotFoundError:
+            pass
+
+
+# --- self test ---------------------------------------------------------------
+
+def restart_test(path, compression):
+    '''
+    Log, flush, log more and "crash" without closing the file, then start
+    again: the file has to be a normal compressed file with the flushed
+    lines and those of the new run
+    '''
+    errors = 0
+    formatter = logging.Formatter('%(message)s')
+    logger = logging.getLogger("selftest.restart." + compression)
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    handler = log_handler(path, compression)
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+    for i in range(1000):
+        logger.info("flushed %d", i)
+    handler.sync()
+    for i in range(20000):
+        # enough for the compressor to write some of it after the flush
+        logger.info("lost %d %d", i, i * 7919 % 10007)
+    handler.stream.file.flush()
+    handler.stream.file.close()     # the crash, the stream is not ended
+    logger.removeHandler(handler)
+    active = handler.baseFilename
+    flushed = b"".join(b"flushed %d\n" % i for i in range(1000))
+    if compression == "gz":
+        with open(active, "rb") as f:
+            if gzip.decompress(finished_gzip(f.read())) != flushed:
+                errors += 1
+                print("gz: the finished copy has more than the flushed lines")
+
+    handler = log_handler(path, compression)
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+    for i in range(1000):
+        logger.info("restarted %d", i)
+    logger.removeHandler(handler)
+    handler.close()
+
+    expected = flushed + b"".join(b"restarted %d\n" % i for i in range(1000))
+    with open(active, "rb") as f:
+        data = f.read()
+    try:
+        whole = gzip.decompress(data) if compression == "gz" else lzma.decompress(data)
+    except (OSError, EOFError, zlib.error, lzma.LZMAError) as e:
+        whole = "{}".format(e)
+    if read_log(active) != expected or whole != expected:
+        errors += 1
+        print("{}: the log differs after a restart: {}".format(compression, whole[:60]))
+    return errors
+
+
+def selftest():
+    '''
+    Log with both compressions, read the active file after a "crash",
+    rotate and compare with what was logged
+    '''
+    import shutil
+    import tempfile
+
+    print("Compressed log self test - Version {}".format(VERSION))
+    root = tempfile.mkdtemp()
+    errors = 0
+    try:
+        for compression in ("gz", "xz"):
+            path = os.path.join(root, "test.log")
+            logger = logging.getLogger("selftest." + compression)
+            logger.propagate = False
+            logger.setLevel(logging.INFO)
+            handler = log_handler(path, compression)
+            handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)-8s %(message)s'))
+            logger.addHandler(handler)
+            n = 86400
+            start = time.perf_counter()
+            for i in range(n):
+                logger.info("%d %d %d %.2f %d", i, 500 + i % 37, 32000 + i // 100, 25.0 + i % 7 / 10.0, 0)
+            elapsed = time.perf_counter() - start
+            handler.sync()
+            active = handler.baseFilename
+            lines = read_log(active).splitlines()
+            followed = list(tail(active, follow=False))
+            if len(lines) != n or followed != lines or not lines[-1].endswith(b" 0"):
+                errors += 1
+                print("{}: the active log has {} lines".format(compression, len(lines)))
+            if compression == "gz":
+                with open(active, "rb") as f:
+                    if gzip.decompress(finished_gzip(f.read())).splitlines() != lines:
+                        errors += 1
+                        print("gz: the finished copy differs")
+            size = os.path.getsize(active)
+            plain = sum(len(line) + 1 for line in lines)
+            handler.doRollover()
+            rotated = [e for e in os.listdir(root) if re.match(r"test\.log\.\d{4}-\d\d-\d\d\." + compression, e)]
+            if len(rotated) != 1 or read_log(os.path.join(root, rotated[0])).splitlines() != lines:
+                errors += 1
+                print("{}: the rotated log differs {}".format(compression, rotated))
+            logger.removeHandler(handler)
+            handler.close()
+            print("{}: {} lines in {:.1f} us/line, {} bytes into {} ({:.1f}x)".format(
+                compression, n, 1e6 * elapsed / n, plain, size, plain / float(size)))
+            for entry in os.listdir(root):
+                os.remove(os.path.join(root, entry))
+            errors += restart_test(path, compression)
+            for entry in os.listdir(root):
+                os.remove(os.path.join(root, entry))
+
+        # a file of the older version: a member cut off after a sync flush and
+        # more compressed data, with the member of the next run after it
+        c = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        first = c.compress(b"first run\n") + c.flush(zlib.Z_SYNC_FLUSH) + \
+            c.compress(bytes(range(256)) * 200)
+        data = first + gzip.compress(b"second run\n")
+        if decompress_gzip(data)[0] != b"first run\nsecond run\n":
+            errors += 1
+            print("gz: no resync on the member after a cut off one")
+    finally:
+        shutil.rmtree(root)
+    print("{} errors".format(errors))
+    return errors
+
+
+def main():
+    args = sys.argv[1:]
+    if args == ["--selftest"]:
+        sys.exit(1 if selftest() else 0)
+    elif len(args) == 2 and args[0] in ("tail", "cat"):
+        out = sys.stdout.buffer
+        for line in tail(args[1], follow=args[0] == "tail"):
+            out.write(line + b"\n")
+            out.flush()
+    else:
+        print("usage: python3 compressed_log.py tail|cat <log>")
+        print("       python3 compressed_log.py --selftest")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+#!/usr/bin/python3.7
+#-------------------------------------------------------------------------------
+# Name:        day_charts.py
+# Purpose:     Charts of a day of the logs, as PNG files that the mail scripts
+#              put in the zip next to the log:
+#                  gpsdo_chart.png     the TIC, DAC and temperature of the Nano
+#                  counter_chart.png   the frequency offset of the counter
+#                  nmea_chart.png      the number of satellites
+#              A log is parsed in one pass into numpy arrays. The samples are
+#              then reduced to the min and max of every pixel column, so
+#              drawing costs the same for a day at 1 Hz or at 1000 s.
+#              Run by cron just before the mail scripts:
+#              56 23 * * * /usr/bin/python3 /home/pi/day_charts.py
+#
+#              python3 day_charts.py [YYYY-MM-DD]    a day from the log archive
+#              python3 day_charts.py --bench
+#
+# Author:      paulv
+#
+# Created:     18-10-2026
+# Copyright:   (c) paulv 2018 2019 2020
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+
+import os
+import re
+import sys
+import time
+
+import numpy
+from PIL import Image
+from PIL import ImageDraw
+from PIL import ImageFont
+
+import compressed_log
+import nano_report
+import log_archive
+
+VERSION = "1.2"     # the counter and nmea logs are parsed with one findall
+
+LOG_DIR = "/mnt/ramdisk"
+CHART_DIR = "/mnt/ramdisk"
+WIDTH = 960         # pixels of the plot area
+PANEL = 180         # pixels of the height of a plot
+MARGIN = (70, 20, 10, 24)   # left, top, right, bottom around a plot
+NOMINAL = 10e6      # Hz
+
+BACKGROUND = (255, 255, 255)
+GRID = (220, 220, 220)
+AXIS = (0, 0, 0)
+COLORS = [(0, 90, 200), (200, 60, 0), (0, 140, 60)]
+
+# "2026-10-17 22:00:00,123 INFO     Time: ... Satellites: 9 ..."
+SATELLITES = re.compile(rb"^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d),\d{3} INFO .*?Satellites: (\d+)", re.M)
+# "2026-10-17 22:00:00,123 INFO     gate\t1000s\tcounter\t10000000.002\ttimestamp\t..."
+READING = re.compile(rb"^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d),\d{3} INFO     gate\t[^\t\n]*\tcounter\t"
+                     rb"([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\r?(?:\t|$)", re.M)
+
+
+# --- parsing -----------------------------------------------------------------
+
+def day_seconds(stamps, day):
+    '''Seconds since the start of the day of datetime64 times'''
+    return (stamps - numpy.datetime64(day)).astype("timedelta64[ms]").astype("float64") / 1000.0
+
+
+def gpsdo_series(data, day):
+    columns = nano_report.parse_log(data)
+    t = day_seconds(columns["time"], day)
+    return [("TIC", t, columns["tic"]), ("DAC", t, columns["dac"]),
+            ("temperature", t, columns["temp"])]
+
+
+def matches(pattern, data):
+    '''
+    The (time stamp, value) of the lines of a log that match, in one findall,
+    as a datetime64 array and an array of the value as bytes
+    '''
+    found = numpy.array(pattern.findall(data), dtype=[("time", "S19"), ("value", "S32")])
+    return found["time"].astype("datetime64[ms]"), found["value"]
+
+
+def counter_series(data, day):
+    stamps, values = matches(READING, data)
+    values = values.astype("float64")
+    keep = values != 0.0    # the start-up value after a reset
+    t = day_seconds(stamps[keep], day)
+    return [("offset mHz", t, (values[keep] - NOMINAL) * 1000.0)]
+
+
+def nmea_series(data, day):
+    stamps, sats = matches(SATELLITES, data)
+    return [("satellites", day_seconds(stamps, day), sats.astype("int32"))]
+
+
+SERIES = {
+    "gpsdo": gpsdo_series,
+    "counter": counter_series,
+    "nmea": nmea_series,
+}
+
+
+# --- drawing -----------------------------------------------------------------
+
+def decimate(t, y, start, end, width):
+    '''
+    The (column, min, max) of the samples in every pixel column of the
+    window start..end. The times must be in order, the columns without
+    samples are left out.
+    '''
+    t = numpy.asarray(t, dtype="float64")
+    y = numpy.asarray(y, dtype="float64")
+    keep = (t >= start) & (t < end) & numpy.isfinite(y)
+    t = t[keep]
+    y = y[keep]
+    if not len(t):
+        return numpy.zeros(0, dtype="int64"), numpy.zeros(0), numpy.zeros(0)
+    col = ((t - start) * (width / float(end - start))).astype("int64")
+    # the first sample of every column, the columns go up with the time
+    first = numpy.flatnonzero(numpy.r_[True, col[1:] != col[:-1]])
+    return col[first], numpy.minimum.reduceat(y, first), numpy.maximum.reduceat(y, first)
+
+
+def y_range(lo, hi):
+    bottom = float(lo.min())
+    top = float(hi.max())
+    if top == bottom:
+        top += 0.5
+        bottom -= 0.5
+    pad = (top - bottom) * 0.05
+    return bottom - pad, top + pad
+
+
+def draw_panel(draw, font, origin, title, col, lo, hi, color):
+    '''A plot with its grid, labels and the min/max band of the columns'''
+    x0, y0 = origin
+    draw.rectangle((x0, y0, x0 + WIDTH, y0 + PANEL), outline=AXIS)
+    draw.text((x0 + 4, y0 - MARGIN[1] + 4), title, font=font, fill=AXIS)
+    for hour in range(0, 25, 3):
+        x = x0 + hour * WIDTH // 24
+        draw.line((x, y0 + 1, x, y0 + PANEL - 1), fill=GRID)
+        draw.text((x - 6, y0 + PANEL + 4), "{:02d}".format(hour % 24), font=font, fill=AXIS)
+    if not len(col):
+        draw.text((x0 + WIDTH // 2 - 20, y0 + PANEL // 2), "no data", font=font, fill=AXIS)
+        return
+    bottom, top = y_range(lo, hi)
+    scale = (PANEL - 2) / (top - bottom)
+    for i in range(5):
+        value = bottom + (top - bottom) * i / 4.0
+        y = y0 + PANEL - 1 - int((value - bottom) * scale)
+        draw.line((x0 + 1, y, x0 + WIDTH - 1, y), fill=GRID)
+        draw.text((x0 - MARGIN[0] + 2, y - 5), "{:.6g}".format(value), font=font, fill=AXIS)
+
+    px = (x0 + col).tolist()
+    ptop = (y0 + PANEL - 1 - ((hi - bottom) * scale).astype("int64")).tolist()
+    pbottom = (y0 + PANEL - 1 - ((lo - bottom) * scale).astype("int64")).tolist()
+    # samples further apart than a column (like the counter) are joined by
+    # lines, unless the step is much larger than usual: that is a gap
+    step = int(numpy.median(numpy.diff(col))) if len(col) > 1 else 1
+    join = 2 * step
+    previous = None
+    for x, a, b in zip(px, ptop, pbottom):
+        if previous is not None and x - previous[0] == 1:
+            # connect to the column before, or a step shows as a gap
+            a = min(a, previous[2])
+            b = max(b, previous[1])
+        elif previous is not None and x - previous[0] <= join:
+            draw.line((previous[0], (previous[1] + previous[2]) // 2, x, (a + b) // 2), fill=color)
+        if step > 2:
+            draw.rectangle((x - 1, a - 1, x + 1, b + 1), fill=color)
+        else:
+            draw.line((x, a, x, b), fill=color)
+        previous = (x, a, b)
+
+
+def render(series, title):
+    '''An image with a plot of every (name, seconds of the day, values)'''
+    height = len(series) * (PANEL + MARGIN[1] + MARGIN[3]) + MARGIN[1]
+    image = Image.new("RGB", (MARGIN[0] + WIDTH + MARGIN[2], height), BACKGROUND)
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default()
+    draw.text((MARGIN[0], 2), title, font=font, fill=AXIS)
+    for i, (name, t, y) in enumerate(series):
+        top = MARGIN[1] + i * (PANEL + MARGIN[1] + MARGIN[3]) + MARGIN[1]
+        col, lo, hi = decimate(t, y, 0, 86400, WIDTH)
+        draw_panel(draw, font, (MARGIN[0], top), name, col, lo, hi, COLORS[i % len(COLORS)])
+    return image
+
+
+def chart(stream, data, day, directory=CHART_DIR):
+    '''Render the chart of a log of a day, returns the path of the PNG'''
+    path = os.path.join(directory, "{}_chart.png".format(stream))
+    image = render(SERIES[stream](data, day), "{} {}".format(stream, day))
+    image.save(path + ".tmp", "PNG")
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def charts(day=None, log_dir=LOG_DIR, directory=CHART_DIR):
+    '''
+    The charts of all streams, of the active logs when there is no day,
+    or of a day in the log archive
+    '''
+    for stream in SERIES:
+        if day is None:
+            path = compressed_log.log_path(os.path.join(log_dir, stream + ".log"))
+            if path is None:
+                continue
+            data = compressed_log.read_log(path)
+            which = time.strftime("%Y-%m-%d")
+        else:
+            found = list(log_archive.day_data(stream, day, day))
+            if not found:
+                continue
+            which, data = found[0]
+        start = time.perf_counter()
+        path = chart(stream, data, which, directory)
+        print("{}: {} in {:.2f}s".format(stream, path, time.perf_counter() - start))
+
+
+# --- benchmark ---------------------------------------------------------------
+
+def bench(samples=86400):
+    print("Day charts benchmark - Version {}".format(VERSION))
+    rnd = numpy.random.RandomState(3)
+    t = numpy.arange(samples, dtype="float64") * (86400.0 / samples)
+    series = [("TIC", t, rnd.normal(500, 20, samples).astype("int32")),
+              ("DAC", t, 32000 + numpy.cumsum(rnd.normal(0, 1, samples))),
+              ("temperature", t, 25 + numpy.sin(t / 86400.0 * 6.28) + rnd.normal(0, 0.05, samples))]
+    start = time.perf_counter()
+    for name, tt, y in series:
+        decimate(tt, y, 0, 86400, WIDTH)
+    decimated = time.perf_counter() - start
+    start = time.perf_counter()
+    image = render(series, "benchmark")
+    rendered = time.perf_counter() - start
+    start = time.perf_counter()
+    image.save(os.devnull, "PNG")
+    saved = time.perf_counter() - start
+    print("{} samples x {} plots: decimate {:.1f} ms, render {:.1f} ms, PNG {:.1f} ms".format(
+        samples, len(series), 1e3 * decimated, 1e3 * rendered, 1e3 * saved))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args and args[0] == "--bench":
+        bench(int(args[1]) if len(args) > 1 else 86400)
+    elif len(args) <= 1 and not (args and args[0].startswith("-")):
+        charts(*args)
+    else:
+        print("usage: python3 day_charts.py [YYYY-MM-DD]")
+        print("       python3 day_charts.py --bench [samples]")
+        sys.exit(1)
@@ -0,0 +1,382 @@
+#!/usr/bin/python3.7
+#-------------------------------------------------------------------------------
+# Name:        gpsdo_supervisor.py
+# Purpose:     Run all the monitors in a single process, as tasks of one
+#              asyncio event loop with one shared pigpio connection:
+#               - ser_mon_gpsdo.py      the GPSDO reports on the hardware UART
+#               - serial_bb_gps.py      the NEO GPS on a bit-banged port
+#               - serial_bb_counter.py  the counter on a bit-banged port
+#               - oled_driver.py        the OLED display refresh
+#               - metrics_server.py     the HTTP state server, when it is in TASKS
+#              Each monitor still writes its own log file. When a task fails,
+#              it is restarted on its own, just like systemd would do with
+#              the separate services.
+#
+#              The systemd service file : gpsdo_supervisor.service
+#              It replaces the four separate services, disable those.
+#
+#              To compare the memory and cpu use with the four process setup,
+#              run this while either setup is running:
+#              python3 gpsdo_supervisor.py --compare
+#
+# Author:      paulv
+#
+# Created:     18-10-2026
+# Copyright:   (c) paulv 2018 2019 2020
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+
+import asyncio
+import contextvars
+import importlib
+import logging
+import logging.handlers
+import os
+import signal
+import sys
+import time
+import traceback
+
+VERSION = "1.7"     # a bit-bang monitor is closed also when its setup() fails
+
+DEBUG = False
+DAEMON = True   # if False, pipe the print statements to the console
+
+# the monitors to run in this process, add "metrics_server" to serve the
+# state over HTTP from this process too
+TASKS = ["ser_mon_gpsdo", "serial_bb_gps", "serial_bb_counter", "oled_driver"]
+
+# restart policy, the same as the systemd service files
+RESTART_SEC = 5             # wait this long before restarting a failed task
+START_LIMIT_INTERVAL = 500  # give up on a task when it fails START_LIMIT_BURST
+START_LIMIT_BURST = 5       # times within START_LIMIT_INTERVAL seconds
+
+OLED_INTERVAL = 1           # seconds between display refreshes
+USAGE_INTERVAL = 3600       # seconds between memory/cpu reports in the log, 0 = off
+
+# the scripts of the four process setup, used by --compare
+SCRIPTS = ["ser_mon_gpsdo.py", "serial_bb_gps.py", "serial_bb_counter.py",
+           "oled_driver.py", "gpsdo_supervisor.py"]
+
+# data path is on a RAM disk to protect the SD card
+log_path = "/mnt/ramdisk/supervisor.log"
+
+# -- Logger definitions
+LOG_FILENAME = log_path
+LOG_LEVEL = logging.INFO  # Could be e.g. "INFO", "DEBUG", "ERROR" or "WARNING"
+
+# the logger of the monitor the running task belongs to
+current_logger = contextvars.ContextVar("current_logger")
+
+# the one pigpio connection all tasks share
+shared_pi = None
+
+# the monitor modules that have been loaded
+modules = {}
+
+
+class TaskLogger(object):
+    '''
+    Replace stdout and stderr with logging to the log file of the monitor
+    whose task is running. That way the print statements of every monitor
+    still end-up in their own log, like they do with MyLogger when they run
+    on their own.
+
+    '''
+    def __init__(self, level):
+            """Needs a logger level."""
+            self.level = level
+
+    def write(self, message):
+            # Only log if there is a message (not just a new line)
+            if message.rstrip() != "":
+                current_logger.get(logger).log(self.level, message.rstrip())
+
+    def flush(self): # prevents warning: 'TaskLogger' object has no attribute 'flush'
+        return
+
+
+def init():
+    global logger, handler
+
+    if DEBUG:
+        print ("Setting up the logger functionality")
+    logger = logging.getLogger(__name__)
+    logger.setLevel(LOG_LEVEL)
+    handler = logging.handlers.TimedRotatingFileHandler(LOG_FILENAME, when="midnight", backupCount=31)
+    formatter = logging.Formatter('%(asctime)s %(levelname)-8s %(message)s')
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+
+    if DAEMON :
+        # pipe the stdout and stderr messages to the logger of the running task
+        sys.stdout = TaskLogger(logging.INFO)
+        sys.stderr = TaskLogger(logging.ERROR)
+    return
+
+
+def connect_pigpio():
+    '''
+    Create the pigpio connection all the bit-bang tasks share
+    '''
+    global shared_pi
+    import pigpio
+
+    shared_pi = pigpio.pi()
+    if not shared_pi.connected:
+        os.system("sudo pigpiod")
+        time.sleep(1)
+        shared_pi = pigpio.pi()
+    return shared_pi
+
+
+def load(name):
+    '''
+    Import a monitor and setup its logger, the first time only.
+    From now on, the prints of this task go to the log of this monitor.
+    '''
+    mod = modules.get(name)
+    if mod is None:
+        mod = importlib.import_module(name)
+        mod.DAEMON = False  # stdout is already piped by the supervisor
+        if hasattr(mod, "init"):
+            mod.init()
+        modules[name] = mod
+    current_logger.set(getattr(mod, "logger", logger))
+    return mod
+
+
+async def run_blocking(func):
+    '''
+    Run a function that blocks for a while (like the counter reset) in a
+    thread, with the logger of the calling task
+    '''
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, contextvars.copy_context().run, func)
+
+
+async def run_gpsdo():
+    '''
+    The hardware UART: wait until the port is readable, then read it all
+    '''
+    mod = load("ser_mon_gpsdo")
+    mod.open_port()
+    mod.open_capture()
+    loop = asyncio.get_event_loop()
+    fd = mod.serialPort.fileno()
+    coalesce = mod.coalesce_time()
+    ready = asyncio.Event()
+
+    def readable():
+        # stop watching until we have read the data, or we keep getting called
+        loop.remove_reader(fd)
+        ready.set()
+
+    try:
+        while True:
+            loop.add_reader(fd, readable)
+            try:
+                await asyncio.wait_for(ready.wait(), mod.READ_TIMEOUT)
+                ready.clear()
+                await asyncio.sleep(coalesce)
+                mod.read_available()
+            except asyncio.TimeoutError:
+                loop.remove_reader(fd)
+                mod.stats.timeouts += 1
+            mod.stats.wakeups += 1
+
+            if mod.stats.due():
+                print(mod.stats.report())
+                mod.stats.reset()
+    finally:
+        loop.remove_reader(fd)
+        mod.serialPort.close()
+        mod.close_capture()
+
+
+def bit_bang_task(name):
+    '''
+    The bit-bang monitors: poll the port and sleep as long as the poll scheduler says
+    '''
+    async def run():
+        mod = load(name)
+        mod.init_pigpio(shared_pi)
+        try:
+            # in the try, a setup() that fails half way is closed too
+            await run_blocking(mod.setup)
+            while True:
+                await asyncio.sleep(mod.poll())
+        finally:
+            if hasattr(mod, "close_capture"):
+                mod.close_capture()
+    return run
+
+
+async def run_oled():
+    mod = load("oled_driver")
+    mod.init_display()
+    try:
+        while True:
+            mod.refresh()
+            await asyncio.sleep(OLED_INTERVAL)
+    finally:
+        mod.close_stats()
+        mod.clear_display()
+
+
+async def run_metrics():
+    mod = load("metrics_server")
+    await mod.serve()
+
+
+FACTORIES = {
+    "ser_mon_gpsdo": run_gpsdo,
+    "serial_bb_gps": bit_bang_task("serial_bb_gps"),
+    "serial_bb_counter": bit_bang_task("serial_bb_counter"),
+    "oled_driver": run_oled,
+    "metrics_server": run_metrics,
+}
+
+
+async def supervise(name, factory):
+    '''
+    Run a task and restart it when it fails. When it fails too often, give up
+    on this task, the others keep running.
+    '''
+    starts = []
+    while True:
+        now = time.monotonic()
+        starts = [t for t in starts if now - t < START_LIMIT_INTERVAL]
+        if len(starts) >= START_LIMIT_BURST:
+            logger.error("{} failed {} times within {}s, giving up".format(
+                name, len(starts), START_LIMIT_INTERVAL))
+            return
+        starts.append(now)
+
+        try:
+            await factory()
+            logger.warning("{} stopped".format(name))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # the traceback goes to the log of the monitor
+            print("Got exception: {}".format(e))
+            print(traceback.format_exc())
+            logger.error("{} failed: {}, restarting in {}s".format(name, e, RESTART_SEC))
+        await asyncio.sleep(RESTART_SEC)
+
+
+def read_status(pid, key):
+    '''
+    Get a value in kB from /proc/<pid>/status, like VmRSS or VmHWM
+    '''
+    with open("/proc/{}/status".format(pid)) as f:
+        for line in f:
+            if line.startswith(key + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+def cpu_usage(pid):
+    '''
+    Returns (cpu seconds, seconds running) of a process
+    '''
+    ticks = os.sysconf("SC_CLK_TCK")
+    with open("/proc/{}/stat".format(pid)) as f:
+        # the name can have spaces, the fields we want come after the ")"
+        fields = f.read().rsplit(")", 1)[1].split()
+    with open("/proc/uptime") as f:
+        uptime = float(f.read().split()[0])
+    cpu = (int(fields[11]) + int(fields[12])) / float(ticks)  # utime + stime
+    running = uptime - int(fields[19]) / float(ticks)       # starttime
+    return cpu, running
+
+
+def usage_report(pid="self"):
+    rss = read_status(pid, "VmRSS")
+    peak = read_status(pid, "VmHWM")
+    cpu, running = cpu_usage(pid)
+    return ("rss {} kB (peak {} kB), cpu {:.1f}s in {:.0f}s ({:.2f}%)".format(
+            rss, peak, cpu, running, 100.0 * cpu / max(running, 1e-6)))
+
+
+async def report_usage():
+    while USAGE_INTERVAL > 0:
+        await asyncio.sleep(USAGE_INTERVAL)
+        logger.info("usage: {}".format(usage_report()))
+
+
+def compare():
+    '''
+    Print the memory and cpu use of the monitors that are running now, either
+    as four processes or as the supervisor
+    '''
+    total_rss = 0
+    total_cpu = 0.0
+    found = 0
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open("/proc/{}/cmdline".format(pid), "rb") as f:
+                cmdline = f.read().replace(b"\0", b" ").decode("utf-8", "ignore")
+            script = next((s for s in SCRIPTS if s in cmdline), None)
+            if script is None or "--compare" in cmdline:
+                continue
+            rss = read_status(pid, "VmRSS")
+            cpu, running = cpu_usage(pid)
+        except (OSError, IndexError, ValueError):
+            continue    # the process is gone
+        found += 1
+        total_rss += rss
+        total_cpu += 100.0 * cpu / max(running, 1e-6)
+        print("{:>7} {:22s} {}".format(pid, script, usage_report(pid)))
+    print("{} processes, total rss {} kB, total cpu {:.2f}%".format(found, total_rss, total_cpu))
+
+
+async def run_all():
+    tasks = [asyncio.ensure_future(supervise(name, FACTORIES[name])) for name in TASKS]
+    tasks.append(asyncio.ensure_future(report_usage()))
+    await asyncio.gather(*tasks)
+
+
+def sigterm(signum, frame):
+    '''
+    systemd stops the service with SIGTERM, take the Ctrl-C way out so the
+    tasks are cancelled and close their captures
+    '''
+    raise KeyboardInterrupt
+
+
+def main():
+    if "--compare" in sys.argv:
+        compare()
+        return
+
+    init()
+    signal.signal(signal.SIGTERM, sigterm)
+    print("GPSDO monitor supervisor - Version {}".format(VERSION))
+
+    if "serial_bb_gps" in TASKS or "serial_bb_counter" in TASKS:
+        connect_pigpio()
+
+    try:
+        asyncio.run(run_all())
+
+    except KeyboardInterrupt: # Ctrl-C
+        print("\nCtrl-C - Terminated")
+
+    except Exception as e:
+        sys.stderr.write("Got exception: {}".format(e))
+        print(traceback.format_exc())
+
+    finally:
+        logger.info("usage: {}".format(usage_report()))
+        if shared_pi is not None:
+            shared_pi.stop()
+        logging.shutdown()  # the compressed logs of the monitors get their end
+        os._exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+#!/usr/bin/python3.7
+#-------------------------------------------------------------------------------
+# Name:        hotpath_stats.py
+# Purpose:     Where the time goes, and where a line gets lost, in the path of
+#              a sentence through a monitor:
+#                  read -> frame -> parse -> publish (log, json, shared memory)
+#              and of a frame through the oled driver:
+#                  read (json/shared memory) -> render -> i2c
+#              Every stage has a histogram of its duration in fixed buckets of
+#              powers of 2 microseconds, and there are counters of the reads,
+#              bytes, sentences, decode errors, parse errors, discarded partial
+#              sentences, overruns and published lines. It is all kept in
+#              arrays that are allocated once, a lap of a stage adds to them
+#              in place.
+#              The stats are written every SNAPSHOT_INTERVAL seconds to
+#                  /mnt/ramdisk/<name>_stats.json
+#              and are served on the Unix socket
+#                  /mnt/ramdisk/<name>_stats.sock
+#              that returns a fresh snapshot to every connection.
+#              Optional in the monitors with HOTPATH_STATS = True
+#
+#              python3 hotpath_stats.py counter|gps|gpsdo|oled [--json]
+#              python3 hotpath_stats.py --selftest
+#
+# Author:      paulv
+#
+# Created:     18-10-2026
+# Copyright:   (c) paulv 2018 2019 2020
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from array import array
+
+VERSION = "1.1"     # a watch or a snapshot that fails does not stop the monitor
+
+STATS_DIR = "/mnt/ramdisk"
+SNAPSHOT_INTERVAL = 60  # seconds between the json snapshots
+BUCKETS = 24            # bucket b holds the laps below 2**b us, the last one the rest
+
+# the stages of a monitor, and of the oled driver
+READ, FRAME, PARSE, PUBLISH = range(4)
+RENDER, I2C = 1, 2
+CAPTURE_STAGES = ["read", "frame", "parse", "publish"]
+DISPLAY_STAGES = ["read", "render", "i2c"]
+
+# the counters
+READS, BYTES, SENTENCES, DECODE_ERRORS, PARSE_ERRORS, PARTIALS, OVERRUNS, PUBLISHED = range(8)
+COUNTERS = ["reads", "bytes", "sentences", "decode_errors", "parse_errors", "partials",
+            "overruns", "published"]
+
+
+class HotPathStats(object):
+    '''
+    The counters and the stage histograms of one monitor. start() notes the
+    time, every lap() adds the time since the last lap to a stage.
+
+    '''
+    def __init__(self, name, stages=CAPTURE_STAGES, directory=None, interval=None):
+        """Needs the name of the monitor and the names of its stages."""
+        directory = directory or STATS_DIR
+        interval = interval or SNAPSHOT_INTERVAL
+        self.name = name
+        self.stages = stages
+        self.directory = directory
+        self.interval = interval
+        self.counts = array("Q", bytes(8 * len(COUNTERS)))
+        self.histogram = array("Q", bytes(8 * BUCKETS * len(stages)))
+        self.total_ns = array("Q", bytes(8 * len(stages)))
+        self.max_ns = array("Q", bytes(8 * len(stages)))
+        self.watches = []       # (counter, function), read at a snapshot
+        self.failed_watches = set()
+        self.t = time.perf_counter_ns()
+        self.started = time.time()
+        self.next_snapshot = time.monotonic() + interval
+        self.server = None
+        self.json_path = os.path.join(directory, "{}_stats.json".format(name))
+        self.socket_path = os.path.join(directory, "{}_stats.sock".format(name))
+
+    def start(self):
+        self.t = time.perf_counter_ns()
+
+    def lap(self, stage):
+        now = time.perf_counter_ns()
+        ns = now - self.t
+        self.t = now
+        bucket = (ns // 1000).bit_length()
+        if bucket >= BUCKETS:
+            bucket = BUCKETS - 1
+        self.histogram[stage * BUCKETS + bucket] += 1
+        self.total_ns[stage] += ns
+        if ns > self.max_ns[stage]:
+            self.max_ns[stage] = ns
+
+    def count(self, counter, n=1):
+        self.counts[counter] += n
+
+    def watch(self, counter, function):
+        '''
+        A counter that is kept elsewhere, like the sentences of the framer,
+        function() gives its value at a snapshot
+        '''
+        self.watches.append((counter, function))
+
+    def snapshot(self):
+        for counter, function in self.watches:
+            try:
+                self.counts[counter] = function()
+            except (ArithmeticError, TypeError, ValueError, AttributeError) as e:
+                # like a value below 0 for the array, keep the last one
+                if counter not in self.failed_watches:
+                    self.failed_watches.add(counter)
+                    print("hotpath stats: watch of {} failed: {!r}".format(COUNTERS[counter], e))
+        stages = {}
+        for i, name in enumerate(self.stages):
+            hist = self.histogram[i * BUCKETS:(i + 1) * BUCKETS].tolist()
+            n = sum(hist)
+            stages[name] = {
+                "count": n,
+                "mean_us": self.total_ns[i] / 1000.0 / n if n else None,
+                "p50_us": bucket_percentile(hist, 50),
+                "p99_us": bucket_percentile(hist, 99),
+                "max_us": self.max_ns[i] / 1000.0,
+                "buckets": hist,
+            }
+        return {"name": self.name, "version": VERSION, "time": time.time(),
+                "uptime": time.time() - self.started,
+                "counters": dict(zip(COUNTERS, self.counts.tolist())),
+                "stages": stages, "bucket_us": [2 ** b for b in range(BUCKETS)]}
+
+    def tick(self):
+        '''Called in the loop of the monitor, writes the snapshot when it is time'''
+        if time.monotonic() >= self.next_snapshot:
+            self.write()
+
+    def write(self):
+        '''Write the snapshot, the stats are never a reason to stop the monitor'''
+        self.next_snapshot = time.monotonic() + self.interval
+        tmp_path = self.json_path + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp_path, self.json_path)
+        except Exception as e:
+            print("hotpath stats: {!r}".format(e))
+
+    def serve(self):
+        '''Answer the connections on the Unix socket, in a thread of its own'''
+        try:
+            os.remove(self.socket_path)
+        except FileNotFoundError:
+            pass
+        try:
+            self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.server.bind(self.socket_path)
+            self.server.listen(4)
+        except OSError as e:
+            print("hotpath stats: no socket {}: {}".format(self.socket_path, e))
+            self.server = None
+            return
+        threading.Thread(target=self.answer, args=(self.server,), daemon=True).start()
+
+    def answer(self, server):
+        while True:
+            try:
+                conn, address = server.accept()
+            except OSError:
+                return  # closed
+            try:
+                conn.sendall(json.dumps(self.snapshot()).encode("ascii") + b"\n")
+            except Exception:
+                pass    # keep answering the next ones
+            finally:
+                conn.close()
+
+    def close(self):
+        self.write()
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+            try:
+                os.remove(self.socket_path)
+            except FileNotFoundError:
+                pass
+
+    def report(self):
+        counters = self.snapshot()["counters"]
+        return "hotpath {}: {}".format(self.name, ", ".join(
+            "{} {}".format(name, counters[name]) for name in COUNTERS))
+
+
+def open_stats(name, stages=CAPTURE_STAGES, directory=None):
+    '''The stats of a monitor, with the socket served'''
+    stats = HotPathStats(name, stages, directory)
+    stats.serve()
+    return stats
+
+
+def bucket_percentile(hist, p):
+    '''The upper bound in us of the bucket that holds percentile p'''
+    n = sum(hist)
+    if not n:
+        return None
+    limit = n * p / 100.0
+    seen = 0
+    for b, count in enumerate(hist):
+        seen += count
+        if seen >= limit:
+            return 2 ** b
+    return 2 ** (len(hist) - 1)
+
+
+def query(name, directory=None, timeout=2.0):
+    '''The snapshot of a running monitor, from its socket'''
+    directory = directory or STATS_DIR
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+    try:
+        client.connect(os.path.join(directory, "{}_stats.sock".format(name)))
+        data = b""
+        while True:
+            part = client.recv(65536)
+            if not part:
+                break
+            data += part
+    finally:
+        client.close()
+    return json.loads(data.decode("ascii"))
+
+
+def show(snapshot):
+    print("{} up {:.0f}s".format(snapshot["name"], snapshot["uptime"]))
+    print("  " + ", ".join("{} {}".format(k, v) for k, v in snapshot["counters"].items()))
+    for name, s in snapshot["stages"].items():
+        if not s["count"]:
+            print("  {:8s} -".format(name))
+            continue
+        print("  {:8s} {:9d} laps, mean {:9.1f} us, p50 < {:6d} us, p99 < {:6d} us, max {:9.1f} us".format(
+            name, s["count"], s["mean_us"], s["p50_us"], s["p99_us"], s["max_us"]))
+
+
+# --- self test ---------------------------------------------------------------
+
+def selftest():
+    '''
+    Known laps into the histograms, read back over the socket and from the
+    json file, and the cost of a lap
+    '''
+    import shutil
+    import tempfile
+
+    print("Hot path stats self test - Version {}".format(VERSION))
+    errors = 0
+    directory = tempfile.mkdtemp()
+    try:
+        stats = open_stats("test", CAPTURE_STAGES, directory)
+        stats.watch(SENTENCES, lambda: 42)
+        for i in range(1000):
+            stats.start()
+            stats.lap(READ)
+            if i % 100 == 0:
+                time.sleep(0.0003)
+            stats.lap(FRAME)
+            stats.count(READS)
+            stats.count(BYTES, 16)
+        got = query("test", directory)
+        if got["counters"]["reads"] != 1000 or got["counters"]["bytes"] != 16000 or \
+                got["counters"]["sentences"] != 42:
+            errors += 1
+            print("wrong counters {}".format(got["counters"]))
+        frame = got["stages"]["frame"]
+        if frame["count"] != 1000 or sum(frame["buckets"][9:]) < 10 or frame["max_us"] < 300:
+            errors += 1
+            print("wrong frame histogram {}".format(frame))
+        if got["stages"]["parse"]["count"] != 0:
+            errors += 1
+            print("laps in parse")
+        # a watch below 0 can't go in the array, the snapshot keeps the last value
+        below = [7]
+        stats.watch(PARTIALS, lambda: below[0])
+        stats.write()
+        below[0] = -1
+        stats.write()
+        if query("test", directory)["counters"]["partials"] != 7:
+            errors += 1
+            print("watch below 0 not kept at its last value")
+        stats.close()
+        with open(os.path.join(directory, "test_stats.json")) as f:
+            if json.load(f)["counters"]["reads"] != 1000:
+                errors += 1
+                print("wrong json snapshot")
+        if os.path.exists(stats.socket_path):
+            errors += 1
+            print("socket left behind")
+
+        n = 1000000
+        start = time.perf_counter()
+        for i in range(n):
+            stats.lap(PARSE)
+        print("a lap costs {:.2f} us".format(1e6 * (time.perf_counter() - start) / n))
+    finally:
+        shutil.rmtree(directory)
+    print("{} errors".format(errors))
+    return errors
+
+
+def main():
+    args = sys.argv[1:]
+    if args == ["--selftest"]:
+        sys.exit(1 if selftest() else 0)
+    elif args and not args[0].startswith("-") and args[1:] in ([], ["--json"]):
+        try:
+            snapshot = query(args[0])
+        except OSError as e:
+            print("{} is not running with HOTPATH_STATS: {}".format(args[0], e))
+            sys.exit(1)
+        if args[1:]:
+            print(json.dumps(snapshot, indent=1))
+        else:
+            show(snapshot)
+    else:
+        print("usage: python3 hotpath_stats.py counter|gps|gpsdo|oled [--json]")
+        print("       python3 hotpath_stats.py --selftest")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
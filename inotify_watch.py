@@ -0,0 +1,87 @@
+#!/usr/bin/python3.7
+#-------------------------------------------------------------------------------
+# Name:        inotify_watch.py
+# Purpose:     Wait for files in a directory to be replaced or written, with
+#              the Linux inotify interface, so a script can sleep until there
+#              is something new instead of polling the files.
+#              No extra packages needed, it uses the C library through ctypes.
+#
+# Author:      paulv
+#
+# Created:     18-10-2026
+# Copyright:   (c) paulv 2018 2019 2020
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+VERSION = "1.0"
+
+# event masks from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008     # a file opened for writing was closed
+IN_MOVED_TO = 0x00000080        # a file was renamed into the directory
+
+EVENT = struct.Struct("iIII")   # wd, mask, cookie, length of the name
+
+libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+
+
+class DirWatcher(object):
+    '''
+    Watch a directory for files that are written or renamed into it.
+    When names are given, only those files are reported.
+
+    '''
+    def __init__(self, directory, names=None, mask=IN_CLOSE_WRITE | IN_MOVED_TO):
+        """Needs the directory, optionally the file names we are interested in."""
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, "inotify_init1: {}".format(os.strerror(e)))
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(directory), mask)
+        if wd < 0:
+            e = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(e, "inotify_add_watch {}: {}".format(directory, os.strerror(e)))
+        self.names = set(os.fsencode(n) for n in names) if names else None
+
+    def fileno(self):
+        return self.fd
+
+    def wait(self, timeout):
+        '''
+        Sleep until one of the files changes or the timeout expires.
+        Returns the set of names that changed, empty on a timeout.
+        '''
+        deadline = time.monotonic() + timeout
+        while True:
+            ready, _, _ = select.select([self.fd], [], [], max(deadline - time.monotonic(), 0))
+            if not ready:
+                return set()
+            changed = self.read_events()
+            if changed:
+                return changed
+            # only files we are not interested in, keep waiting
+
+    def read_events(self):
+        changed = set()
+        try:
+            data = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return changed
+        pos = 0
+        while pos + EVENT.size <= len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, pos)
+            name = data[pos + EVENT.size:pos + EVENT.size + length].rstrip(b"\0")
+            pos += EVENT.size + length
+            if self.names is None or name in self.names:
+                changed.add(os.fsdecode(name))
+        return changed
+
+    def close(self):
+        os.close(self.fd)
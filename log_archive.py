@@ -0,0 +1,327 @@
+#!/usr/bin/python3.7
+#-------------------------------------------------------------------------------
+# Name:        log_archive.py
+# Purpose:     Archive of the rotated logs of the three monitors, with fast
+#              queries on a time window.
+#              Just after midnight, the ingest step takes the rotated logs
+#              (gpsdo.log.2026-10-17, counter.log..., nmea.log..., also when
+#              they are compressed by compressed_log.py) from the RAM disk and
+#              stores every day as blocks of about 64 kB that are compressed
+#              on their own:
+#                  <archive>/gpsdo/2026-10-17.chunk
+#                      the compressed blocks
+#                  <archive>/gpsdo/2026-10-17.idx
+#                      first and last time stamp, offset and size of every block
+#              A query only reads the index and decompresses the blocks that
+#              overlap with the window. The log time stamps sort as text, so
+#              the index keeps them as they are.
+#              It replaces the mv lines in the crontab:
+#              01 00 * * * /usr/bin/python3 /home/pi/log_archive.py ingest
+#
+#              python3 log_archive.py query gpsdo "2026-10-17 22:00" \
+#                                                 "2026-10-17 23:30"
+#              python3 log_archive.py stats
+#
+# Author:      paulv
+#
+# Created:     18-10-2026
+# Copyright:   (c) paulv 2018 2019 2020
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+
+import bisect
+import os
+import struct
+import sys
+import time
+import zlib
+
+import compressed_log
+
+VERSION = "1.2"     # a day that is already archived is merged, not replaced
+
+LOG_DIR = "/mnt/ramdisk"
+ARCHIVE_DIR = "/home/pi/log_archive"
+STREAMS = ["gpsdo", "counter", "nmea"]
+
+# where the crontab used to move the logs, still read for the older days
+LEGACY_DIRS = {
+    "gpsdo": "/home/pi/gpsdo_log",
+    "counter": "/home/pi/counter_log",
+    "nmea": "/home/pi/nmea_log",
+}
+
+BLOCK_SIZE = 64 * 1024  # uncompressed bytes per block
+LEVEL = 6               # zlib compression level
+KEEP_DAYS = 730         # days to keep in the archive, 0 = forever
+
+STAMP_LEN = 23          # "2026-10-17 22:00:00,123"
+# first stamp, last stamp, offset in the chunk, compressed size, lines
+INDEX = struct.Struct("<23s23sQII")
+
+
+def is_day(text):
+    '''True for a day like 2026-10-17'''
+    return len(text) == 10 and text[4] == "-" and text[7] == "-" and \
+        text[:4].isdigit() and text[5:7].isdigit() and text[8:].isdigit()
+
+
+def line_stamp(line):
+    '''The time stamp of a log line, None for a line without (like a traceback)'''
+    stamp = line[:STAMP_LEN]
+    if len(stamp) == STAMP_LEN and stamp[4:5] == b"-" and stamp[19:20] == b",":
+        return stamp
+    return None
+
+
+def blocks(data, size=BLOCK_SIZE):
+    '''Split a log into blocks of whole lines of about size bytes'''
+    pos = 0
+    while pos < len(data):
+        end = data.find(b"\n", pos + size)
+        end = len(data) if end < 0 else end + 1
+        yield data[pos:end]
+        pos = end
+
+
+def block_stamps(block, previous):
+    '''(first, last) stamp of a block, lines without one get the stamp before them'''
+    first = last = None
+    for line in block.splitlines():
+        stamp = line_stamp(line)
+        if stamp is not None:
+            if first is None:
+                first = stamp
+            last = stamp
+    first = first or previous or b"0" * STAMP_LEN
+    return first, last or first
+
+
+def last_stamp(data):
+    '''The last time stamp of a log, None when it has none'''
+    end = len(data)
+    while end > 0:
+        start = data.rfind(b"\n", 0, end - 1) + 1
+        stamp = line_stamp(data[start:end])
+        if stamp is not None:
+            return stamp
+        end = start
+    return None
+
+
+def merge_lines(old, new):
+    '''
+    The log of a day that is already archived, with the lines of new added.
+    The lines of new up to the last time stamp of old are skipped, but only
+    when they are all in old, like the same log ingested again. Returns None
+    when they are not, new has lines that would have to go in between.
+    '''
+    last = last_stamp(old)
+    lines = new.splitlines()
+    skip = 0
+    stamp = None
+    if last is not None:
+        while skip < len(lines):
+            stamp = line_stamp(lines[skip]) or stamp
+            if stamp is not None and stamp > last:
+                break
+            skip += 1
+        if skip and not set(lines[:skip]) <= set(old.splitlines()):
+            return None
+    if old and not old.endswith(b"\n"):
+        old += b"\n"
+    rest = lines[skip:]
+    return old + b"".join(line + b"\n" for line in rest), len(rest), skip
+
+
+def write_day(directory, day, data):
+    '''
+    Store the log of a day as compressed blocks with their index.
+    Both files are written under a temporary name first, so a crash leaves
+    no half-written day behind. A day that is already in the archive gets
+    the new lines added, see merge_lines(). Returns the compressed size,
+    None when the lines can't be merged and the day is left as it was.
+    '''
+    os.makedirs(directory, exist_ok=True)
+    chunk_path = os.path.join(directory, day + ".chunk")
+    index_path = os.path.join(directory, day + ".idx")
+    if os.path.exists(index_path):
+        merged = merge_lines(read_day_from(directory, day), data)
+        if merged is None:
+            return None
+        data, added, skipped = merged
+        print("{}: merged {} lines into the archived day, {} were already there".format(
+            day, added, skipped))
+    offset = 0
+    previous = None
+    entries = []
+    with open(chunk_path + ".tmp", "wb") as chunk:
+        for block in blocks(data):
+            packed = zlib.compress(block, LEVEL)
+            first, last = block_stamps(block, previous)
+            previous = last
+            entries.append(INDEX.pack(first, last, offset, len(packed), block.count(b"\n")))
+            chunk.write(packed)
+            offset += len(packed)
+    with open(index_path + ".tmp", "wb") as index:
+        index.write(b"".join(entries))
+    os.replace(chunk_path + ".tmp", chunk_path)
+    os.replace(index_path + ".tmp", index_path)
+    return offset
+
+
+def read_index(directory, day):
+    path = os.path.join(directory, day + ".idx")
+    with open(path, "rb") as f:
+        data = f.read()
+    return [INDEX.unpack_from(data, pos) for pos in range(0, len(data) - INDEX.size + 1, INDEX.size)]
+
+
+def read_blocks(directory, day, entries):
+    '''Decompress the blocks of the index entries'''
+    with open(os.path.join(directory, day + ".chunk"), "rb") as chunk:
+        for first, last, offset, size, lines in entries:
+            chunk.seek(offset)
+            yield zlib.decompress(chunk.read(size))
+
+
+def days(stream, archive=ARCHIVE_DIR):
+    directory = os.path.join(archive, stream)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(e[:-4] for e in os.listdir(directory) if e.endswith(".idx"))
+
+
+def read_day(stream, day, archive=ARCHIVE_DIR):
+    '''The complete log of a day'''
+    return read_day_from(os.path.join(archive, stream), day)
+
+
+def read_day_from(directory, day):
+    return b"".join(read_blocks(directory, day, read_index(directory, day)))
+
+
+def day_data(stream, first, last, archive=ARCHIVE_DIR):
+    '''
+    Yields (day, log) of the days first..last (YYYY-MM-DD), from the archive,
+    or from the directory the crontab used to move the logs to
+    '''
+    found = {d: None for d in days(stream, archive) if first <= d <= last}
+    legacy = LEGACY_DIRS.get(stream)
+    name = stream + ".log."
+    if legacy and os.path.isdir(legacy):
+        for entry in os.listdir(legacy):
+            day = entry[len(name):len(name) + 10]
+            if entry.startswith(name) and is_day(day) and first <= day <= last and day not in found:
+                found[day] = os.path.join(legacy, entry)
+    for day in sorted(found):
+        path = found[day]
+        if path is None:
+            yield day, read_day(stream, day, archive)
+        else:
+            yield day, compressed_log.read_log(path)
+
+
+def query(stream, start, end, archive=ARCHIVE_DIR):
+    '''
+    Yields the lines of a stream with a time stamp from start up to and
+    including end. The times are text like "2026-10-17 22:00" and can be cut
+    off after any part, "2026-10-17" is the whole day.
+    '''
+    start = start.encode() if isinstance(start, str) else start
+    end = end.encode() if isinstance(end, str) else end
+    directory = os.path.join(archive, stream)
+    for day in days(stream, archive):
+        # the logs rotate at midnight, a day only has its own lines
+        name = day.encode()
+        if name < start[:10]:
+            continue
+        if name[:len(end)] > end:
+            break
+        entries = read_index(directory, day)
+        # the blocks are in time order, skip to the first one that ends after start
+        lasts = [e[1] for e in entries]
+        i = bisect.bisect_left(lasts, start)
+        wanted = []
+        for entry in entries[i:]:
+            if entry[0][:len(end)] > end:
+                break
+            wanted.append(entry)
+        stamp = None
+        for block in read_blocks(directory, day, wanted):
+            for line in block.splitlines():
+                stamp = line_stamp(line) or stamp
+                if stamp is None or stamp < start:
+                    continue
+                if stamp[:len(end)] > end:
+                    return
+                yield line
+
+
+def ingest(log_dir=LOG_DIR, archive=ARCHIVE_DIR):
+    '''
+    Move the rotated logs into the archive, and drop the days older than KEEP_DAYS
+    '''
+    for stream in STREAMS:
+        name = stream + ".log."
+        for entry in sorted(os.listdir(log_dir)):
+            if not entry.startswith(name) or entry.endswith(".tmp"):
+                continue
+            # gpsdo.log.2026-10-17, or .gz and .xz with LOG_COMPRESSION, but
+            # not the active gpsdo.log.gz
+            day = entry[len(name):len(name) + 10]
+            if not is_day(day):
+                continue
+            path = os.path.join(log_dir, entry)
+            data = compressed_log.read_log(path)
+            size = write_day(os.path.join(archive, stream), day, data)
+            if size is None:
+                # keep it, to sort out by hand
+                print("{}: not archived, it has lines older than the end of {} in the archive".format(
+                    entry, day))
+                continue
+            print("{}: {} bytes into {} bytes".format(entry, len(data), size))
+            os.remove(path)
+        if KEEP_DAYS > 0:
+            oldest = time.strftime("%Y-%m-%d", time.localtime(time.time() - KEEP_DAYS * 86400))
+            for day in days(stream, archive):
+                if day < oldest:
+                    for ext in (".chunk", ".idx"):
+                        os.remove(os.path.join(archive, stream, day + ext))
+                    print("{}: removed {}".format(stream, day))
+
+
+def stats(archive=ARCHIVE_DIR):
+    for stream in STREAMS:
+        directory = os.path.join(archive, stream)
+        stored = lines = blocks_n = 0
+        found = days(stream, archive)
+        for day in found:
+            entries = read_index(directory, day)
+            blocks_n += len(entries)
+            lines += sum(e[4] for e in entries)
+            stored += os.path.getsize(os.path.join(directory, day + ".chunk"))
+        print("{:8s} {} days ({} .. {}), {} blocks, {} lines, {:.1f} MB".format(
+            stream, len(found), found[0] if found else "-", found[-1] if found else "-",
+            blocks_n, lines, stored / 1e6))
+
+
+def main():
+    args = sys.argv[1:]
+    if args and args[0] == "ingest":
+        ingest(*args[1:2])
+    elif len(args) == 4 and args[0] == "query":
+        out = sys.stdout.buffer
+        for line in query(args[1], args[2], args[3]):
+            out.write(line + b"\n")
+    elif args and args[0] == "stats":
+        stats()
+    else:
+        print("usage: python3 log_archive.py ingest [log dir]")
+        print("       python3 log_archive.py query <gpsdo|counter|nmea> <start> <end>")
+        print("       python3 log_archive.py stats")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -18,12 +18,13 @@ import email
 from time import time, sleep, gmtime, strftime, localtime
 import zipfile
 
-VERSION="1.1" #  added support for a RAM disk
+VERSION="1.2" #  the chart of day_charts.py goes in the zip
 DEBUG = False
 
 # here is where we store the files
 log_file = "/mnt/ramdisk/nmea.log"
 zip_file = "/mnt/ramdisk/nmea.zip"
+chart_file = "/mnt/ramdisk/nmea_chart.png"  # made by day_charts.py
 # target email account
 mail_address = "your e-mail address"
 
@@ -36,7 +37,11 @@ def mail_err_log():
     try:
         print("zip the file")
         os.chdir('/mnt/ramdisk')
-        zipfile.ZipFile('nmea.zip', mode='w').write('nmea.log', compress_type=zipfile.ZIP_DEFLATED)
+        with zipfile.ZipFile('nmea.zip', mode='w') as zf:
+            zf.write('nmea.log', compress_type=zipfile.ZIP_DEFLATED)
+            if os.path.isfile(chart_file):
+                # a PNG is compressed already
+                zf.write('nmea_chart.png', compress_type=zipfile.ZIP_STORED)
     except Exception as e:
         print("*** Exception {}".format(e))
 
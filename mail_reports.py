@@ -0,0 +1,367 @@
+#!/usr/bin/python3.7
+#-------------------------------------------------------------------------------
+# Name:        mail_reports.py
+# Purpose:     One mail with the logs of the day of all the monitors, instead
+#              of the three mail_..._log.py scripts with mpack.
+#              The logs are zipped in parallel, with the chart of
+#              day_charts.py when it is there. The mail is written to a
+#              spool file on the SD card, with the attachments encoded a
+#              block at a time, and sent from there over SMTP. When the send
+#              fails, the file stays in the spool and is tried again the next
+#              time, so a report is not lost when the mail server is down.
+#              It replaces the three mail lines in the crontab:
+#              57 23 * * * /usr/bin/python3 /home/pi/mail_reports.py
+#              and optional, to send what is left in the spool every hour:
+#              30 * * * * /usr/bin/python3 /home/pi/mail_reports.py --retry
+#
+#              python3 mail_reports.py --selftest
+#
+# Author:      paulv
+#
+# Created:     18-10-2026
+# Copyright:   (c) paulv 2018 2019 2020
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+
+import base64
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate, make_msgid
+import os
+import smtplib
+import socket
+import sys
+import time
+import zipfile
+
+import compressed_log
+
+VERSION = "1.1"     # the compressed logs go in the zip as they are
+
+LOG_DIR = "/mnt/ramdisk"
+SPOOL_DIR = "/home/pi/mail_spool"   # on the SD card, it has to survive a reboot
+KEEP_DAYS = 14          # drop a mail from the spool after this many days
+
+# the logs to send: name of the log on the RAM disk and the subject line
+REPORTS = [
+    ("gpsdo", "Bliley GPSDO log file"),
+    ("counter", "Bliley Counter log file"),
+    ("nmea", "Bliley NMEA log file"),
+]
+SUBJECT = "Bliley GPSDO logs"
+
+SMTP_HOST = "localhost"
+SMTP_PORT = 25
+SMTP_USER = None        # set both for a server that needs a login
+SMTP_PASSWORD = None
+SMTP_TLS = False
+SMTP_TIMEOUT = 60
+
+# target email account
+mail_address = "your e-mail address"
+sender = "pi@{}".format(socket.gethostname())
+
+BLOCK = 57 * 1024       # bytes per base64 block, a multiple of 57 gives whole lines
+
+
+# --- compression -------------------------------------------------------------
+
+def zip_report(name, log_dir=LOG_DIR):
+    '''
+    Zip the log with its chart, returns the path of the zip or None when there
+    is no log. zlib lets go of the GIL, so the logs can be zipped in threads.
+    A compressed log (LOG_COMPRESSION in the monitors) is stored as it is.
+    '''
+    log = compressed_log.log_path(os.path.join(log_dir, name + ".log"))
+    if log is None:
+        return None
+    path = os.path.join(log_dir, name + ".zip")
+    with zipfile.ZipFile(path + ".tmp", mode="w") as zf:
+        member = os.path.basename(log)
+        if log.endswith(".gz"):
+            # still written to, end the gzip stream in the copy
+            with open(log, "rb") as f:
+                data = compressed_log.finished_gzip(f.read())
+            zf.writestr(member, data, compress_type=zipfile.ZIP_STORED)
+        elif log.endswith(".xz"):
+            zf.write(log, member, compress_type=zipfile.ZIP_STORED)
+        else:
+            zf.write(log, member, compress_type=zipfile.ZIP_DEFLATED)
+        chart = os.path.join(log_dir, name + "_chart.png")
+        if os.path.isfile(chart):
+            # a PNG is compressed already
+            zf.write(chart, name + "_chart.png", compress_type=zipfile.ZIP_STORED)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def zip_reports(reports=REPORTS, log_dir=LOG_DIR):
+    '''The zips of all reports that have a log, made in parallel'''
+    with ThreadPoolExecutor(max_workers=len(reports)) as pool:
+        paths = pool.map(lambda report: zip_report(report[0], log_dir), reports)
+        return [(report, path) for report, path in zip(reports, paths) if path]
+
+
+# --- the mail ----------------------------------------------------------------
+
+def write_mail(f, subject, text, attachments, to, frm):
+    '''
+    Write a multipart MIME mail with the files as base64 attachments.
+    The files are read and encoded a block at a time.
+    '''
+    boundary = "=====gpsdo{}=====".format(make_msgid().strip("<>").split("@")[0])
+    head = [
+        "From: {}".format(frm),
+        "To: {}".format(to),
+        "Subject: {}".format(subject),
+        "Date: {}".format(formatdate(localtime=True)),
+        "Message-ID: {}".format(make_msgid()),
+        "MIME-Version: 1.0",
+        'Content-Type: multipart/mixed; boundary="{}"'.format(boundary),
+        "",
+        "--{}".format(boundary),
+        'Content-Type: text/plain; charset="us-ascii"',
+        "Content-Transfer-Encoding: 7bit",
+        "",
+        text,
+    ]
+    f.write("\r\n".join(head).encode("ascii") + b"\r\n")
+    for path in attachments:
+        name = os.path.basename(path)
+        part = [
+            "--{}".format(boundary),
+            "Content-Type: application/zip",
+            "Content-Transfer-Encoding: base64",
+            'Content-Disposition: attachment; filename="{}"'.format(name),
+            "",
+        ]
+        f.write("\r\n".join(part).encode("ascii") + b"\r\n")
+        with open(path, "rb") as data:
+            while True:
+                block = data.read(BLOCK)
+                if not block:
+                    break
+                f.write(base64.encodebytes(block).replace(b"\n", b"\r\n"))
+    f.write("--{}--\r\n".format(boundary).encode("ascii"))
+
+
+def spool_mail(subject, text, attachments, spool=SPOOL_DIR):
+    '''Write the mail into the spool, returns its path'''
+    os.makedirs(spool, exist_ok=True)
+    path = os.path.join(spool, "{}-{}.eml".format(time.strftime("%Y%m%d-%H%M%S"), os.getpid()))
+    with open(path + ".tmp", "wb") as f:
+        write_mail(f, subject, text, attachments, mail_address, sender)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def send_file(path, host=None, port=None):
+    '''
+    Send a spooled mail. smtplib wants the whole mail as one string for
+    DATA, so we give the command ourselves and send the file a block of lines
+    at a time, with the dot-stuffing of the SMTP protocol.
+    '''
+    smtp = smtplib.SMTP(host or SMTP_HOST, port or SMTP_PORT, timeout=SMTP_TIMEOUT)
+    try:
+        smtp.ehlo_or_helo_if_needed()
+        if SMTP_TLS:
+            smtp.starttls()
+            smtp.ehlo()
+        if SMTP_USER:
+            smtp.login(SMTP_USER, SMTP_PASSWORD)
+        code, reply = smtp.mail(sender)
+        if code != 250:
+            raise smtplib.SMTPSenderRefused(code, reply, sender)
+        code, reply = smtp.rcpt(mail_address)
+        if code not in (250, 251):
+            raise smtplib.SMTPRecipientsRefused({mail_address: (code, reply)})
+        smtp.putcmd("data")
+        code, reply = smtp.getreply()
+        if code != 354:
+            raise smtplib.SMTPDataError(code, reply)
+        with open(path, "rb") as f:
+            lines = []
+            size = 0
+            for line in f:
+                if line.startswith(b"."):
+                    line = b"." + line
+                lines.append(line)
+                size += len(line)
+                if size >= BLOCK:
+                    smtp.send(b"".join(lines))
+                    lines = []
+                    size = 0
+            smtp.send(b"".join(lines) + b".\r\n")
+        code, reply = smtp.getreply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, reply)
+        smtp.quit()
+    finally:
+        smtp.close()
+
+
+def send_spool(spool=SPOOL_DIR, host=None, port=None):
+    '''
+    Try to send all mails in the spool, oldest first. Returns the number
+    of mails that are still waiting.
+    '''
+    if not os.path.isdir(spool):
+        return 0
+    waiting = 0
+    oldest = time.time() - KEEP_DAYS * 86400
+    for entry in sorted(os.listdir(spool)):
+        if not entry.endswith(".eml"):
+            continue
+        path = os.path.join(spool, entry)
+        try:
+            send_file(path, host, port)
+        except (OSError, smtplib.SMTPException) as e:
+            if os.path.getmtime(path) < oldest:
+                print("{}: dropped after {} days: {}".format(entry, KEEP_DAYS, e))
+                os.remove(path)
+            else:
+                print("{}: not sent, stays in the spool: {}".format(entry, e))
+                waiting += 1
+            continue
+        print("{}: sent".format(entry))
+        os.remove(path)
+    return waiting
+
+
+def mail_reports(reports=REPORTS, log_dir=LOG_DIR, spool=SPOOL_DIR):
+    start = time.perf_counter()
+    zips = zip_reports(reports, log_dir)
+    if not zips:
+        print("no logs to send")
+    else:
+        text = "\r\n".join("{}: {}".format(os.path.basename(path), subject)
+                           for (name, subject), path in zips)
+        path = spool_mail("{} {}".format(SUBJECT, time.strftime("%Y-%m-%d")), text,
+                          [path for report, path in zips], spool)
+        print("{} zipped into {} in {:.1f}s".format(", ".join(r[0] for r, p in zips),
+              path, time.perf_counter() - start))
+        for report, path in zips:
+            os.remove(path)
+    return send_spool(spool)
+
+
+# --- self test ---------------------------------------------------------------
+
+class FakeSMTP(object):
+    '''
+    A minimal SMTP server on a local port that keeps the mails it gets, to
+    test the send without a mail server. fail = True refuses the DATA.
+
+    '''
+    def __init__(self):
+        """Needs nothing, listens on a free port of localhost."""
+        import threading
+        self.mails = []
+        self.fail = False
+        self.server = socket.socket()
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            conn, addr = self.server.accept()
+            with conn, conn.makefile("rb") as rf:
+                conn.sendall(b"220 fake\r\n")
+                for line in rf:
+                    cmd = line[:4].upper()
+                    if cmd in (b"EHLO", b"HELO"):
+                        conn.sendall(b"250 fake\r\n")
+                    elif cmd == b"DATA":
+                        if self.fail:
+                            conn.sendall(b"451 try again later\r\n")
+                            continue
+                        conn.sendall(b"354 go ahead\r\n")
+                        data = []
+                        for line in rf:
+                            if line == b".\r\n":
+                                break
+                            data.append(line[1:] if line.startswith(b".") else line)
+                        self.mails.append(b"".join(data))
+                        conn.sendall(b"250 ok\r\n")
+                    elif cmd == b"QUIT":
+                        conn.sendall(b"221 bye\r\n")
+                        break
+                    else:
+                        conn.sendall(b"250 ok\r\n")
+
+
+def selftest():
+    import email
+    import io
+    import random
+    import shutil
+    import tempfile
+
+    print("Mail reports self test - Version {}".format(VERSION))
+    global SMTP_HOST, SMTP_PORT
+    root = tempfile.mkdtemp()
+    logs = os.path.join(root, "logs")
+    spool = os.path.join(root, "spool")
+    os.makedirs(logs)
+    errors = 0
+    rng = random.Random(4)
+    try:
+        for name, subject in REPORTS:
+            with open(os.path.join(logs, name + ".log"), "w") as f:
+                for i in range(50000):
+                    f.write(".{} {} {}\n".format(name, i, rng.random()))
+        with open(os.path.join(logs, "gpsdo_chart.png"), "wb") as f:
+            f.write(bytes(rng.getrandbits(8) for i in range(20000)))
+
+        server = FakeSMTP()
+        SMTP_HOST, SMTP_PORT = "127.0.0.1", server.port
+        server.fail = True
+        waiting = mail_reports(REPORTS, logs, spool)
+        if waiting != 1 or server.mails:
+            errors += 1
+            print("a failed send should stay in the spool")
+        server.fail = False
+        if send_spool(spool, SMTP_HOST, SMTP_PORT) != 0 or len(server.mails) != 1:
+            errors += 1
+            print("the spool was not sent")
+
+        message = email.message_from_bytes(server.mails[0])
+        found = {}
+        for part in message.walk():
+            if part.get_filename():
+                with zipfile.ZipFile(io.BytesIO(part.get_payload(decode=True))) as zf:
+                    for member in zf.namelist():
+                        found[member] = zf.read(member)
+        for name, subject in REPORTS:
+            with open(os.path.join(logs, name + ".log"), "rb") as f:
+                if found.get(name + ".log") != f.read():
+                    errors += 1
+                    print("{}.log differs".format(name))
+        with open(os.path.join(logs, "gpsdo_chart.png"), "rb") as f:
+            if found.get("gpsdo_chart.png") != f.read():
+                errors += 1
+                print("the chart differs")
+        print("{} bytes mailed, {} files".format(len(server.mails[0]), len(found)))
+    finally:
+        shutil.rmtree(root)
+    print("{} errors".format(errors))
+    return errors
+
+
+def main():
+    args = sys.argv[1:]
+    if args == ["--selftest"]:
+        sys.exit(1 if selftest() else 0)
+    print("Mail GPSDO reports - Version {}".format(VERSION))
+    if args == ["--retry"]:
+        send_spool()
+    elif not args:
+        mail_reports()
+    else:
+        print("usage: python3 mail_reports.py [--retry | --selftest]")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,409 @@
+#!/usr/bin/python3.7
+#-------------------------------------------------------------------------------
+# Name:        metrics_server.py
+# Purpose:     A small HTTP server with the live state of the GPSDO, straight
+#              from the shared memory the monitors publish in (shm_state.py):
+#               - the counter value, gate and tstamp of serial_bb_counter
+#               - the satellites and the fix of serial_bb_gps
+#               - the last report of the Nano from ser_mon_gpsdo
+#               - the running statistics of the counter
+#              The shared memory is looked at every SAMPLE_INTERVAL seconds,
+#              and at every request. A section with a new sequence number is
+#              copied into the current state and into a history ring of the
+#              last HISTORY updates. A response is built once for every change
+#              of the state and served from memory to every scraper, nothing
+#              is read from or written to a file.
+#                  /state      the current state, json
+#                  /history    the history ring, json, ?section=counter&n=60
+#                  /metrics    the current state for Prometheus
+#              Runs on its own, or as a task of gpsdo_supervisor.py.
+#
+#              The systemd service file : metrics_server.service
+#
+#              python3 metrics_server.py [--host 0.0.0.0] [--port 9110]
+#              python3 metrics_server.py --selftest
+#
+# Author:      paulv
+#
+# Created:     18-10-2026
+# Copyright:   (c) paulv 2018 2019 2020
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+
+import argparse
+import asyncio
+import collections
+import json
+import math
+import sys
+import time
+from urllib.parse import parse_qs
+
+import nano_report
+import shm_state
+
+VERSION = "1.1"     # the Nano metrics follow nano_report.REPORT
+
+HOST = "0.0.0.0"        # all interfaces, so a dashboard can reach it
+PORT = 9110
+SAMPLE_INTERVAL = 1.0   # seconds between looks at the shared memory
+HISTORY = 3600          # updates kept of every section
+IDLE_TIMEOUT = 30       # seconds a keep-alive connection may be idle
+MAX_HEADER = 8192       # bytes of a request head
+CACHE_SIZE = 32         # responses kept for the current state
+
+# the Prometheus metrics: (section, field, name, help)
+METRICS = [
+    ("counter", "counter", "gpsdo_counter_frequency_hz", "Frequency of the last counter reading"),
+    ("counter", "gate", "gpsdo_counter_gate_seconds", "Gate time of the counter"),
+    ("counter", "tstamp", "gpsdo_counter_tstamp_minutes", "Minute the counter reading came in"),
+    ("stats", "n", "gpsdo_counter_readings", "Readings in the running statistics"),
+    ("stats", "mean", "gpsdo_counter_mean_hz", "Mean of the counter readings"),
+    ("stats", "stdev", "gpsdo_counter_stdev_hz", "Standard deviation of the counter readings"),
+    ("stats", "ffo", "gpsdo_counter_fractional_offset", "Fractional frequency offset of the last reading"),
+    ("nmea", "sats", "gpsdo_gps_satellites", "Satellites in the fix"),
+    ("nmea", "in_view", "gpsdo_gps_satellites_in_view", "Satellites in view"),
+    ("nmea", "used", "gpsdo_gps_satellites_used", "Satellites used in the solution"),
+    ("nmea", "snr_avg", "gpsdo_gps_snr_avg_db", "Average SNR of the satellites in view"),
+    ("nmea", "snr_min", "gpsdo_gps_snr_min_db", "Lowest SNR of the satellites in view"),
+    ("nmea", "fix", "gpsdo_gps_fix", "1 with a valid fix"),
+    ("nmea", "qerr", "gpsdo_gps_qerr_ps", "Quantization error of the next time pulse"),
+    ("gpsdo", "time", "gpsdo_nano_report_timestamp_seconds", "Time the last Nano report came in"),
+]
+
+# the fields of the Nano report follow nano_report.REPORT, these get a name
+# with their unit, the others are gpsdo_nano_<field>
+NANO_METRICS = {"seconds": "gpsdo_nano_uptime_seconds", "temp": "gpsdo_nano_temperature_celsius"}
+METRICS += [("gpsdo", name, NANO_METRICS.get(name, "gpsdo_nano_" + name), description[:1].upper() + description[1:])
+            for name, kind, typecode, description in nano_report.REPORT]
+
+STATUS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+
+
+class StateCache(object):
+    '''
+    The current state and the history of the sections of the shared memory,
+    and the responses built from them. Every change of the state bumps
+    version, that drops the responses of the old state.
+
+    '''
+    def __init__(self, path=None, history=HISTORY):
+        """Needs the path of the shared memory, None for the one of the monitors."""
+        self.path = path or shm_state.SHM_PATH
+        self.channel = None
+        self.seqs = {name: 0 for name in shm_state.SECTIONS}
+        self.current = {}       # name -> dict of the fields
+        self.history = {name: collections.deque(maxlen=history) for name in shm_state.SECTIONS}
+        self.version = 0
+        self.responses = {}     # (path, query) -> response, of this version
+        self.builds = 0         # responses built
+        self.requests = 0
+
+    def sample(self):
+        '''Copy the sections that were updated, returns True when one was'''
+        if self.channel is None:
+            self.channel = shm_state.open_reader(self.path)
+            if self.channel is None:
+                return False
+        changed = False
+        for name, fields in shm_state.FIELDS.items():
+            seq = self.channel.sequence(name)
+            if seq == self.seqs[name] or seq & 1:
+                continue
+            snap = self.channel.snapshot(name)
+            if snap is None:
+                continue    # the writer kept us busy, next time
+            self.seqs[name] = snap[0]
+            values = dict(zip(fields, snap[1]))
+            values["seq"] = snap[0] // 2
+            values["sampled"] = time.time()
+            if name == "nmea":
+                values["fix"] = values["fix"].decode("ascii", "replace")
+            self.current[name] = values
+            self.history[name].append(values)
+            changed = True
+        if changed:
+            self.version += 1
+            self.responses.clear()
+        return changed
+
+    def response(self, path, query):
+        '''The cached (status, content type, body) of a request'''
+        self.requests += 1
+        self.sample()
+        key = (path, query)
+        found = self.responses.get(key)
+        if found is None:
+            found = self.build(path, query)
+            self.builds += 1
+            if len(self.responses) >= CACHE_SIZE:
+                self.responses.clear()
+            self.responses[key] = found
+        return found
+
+    def build(self, path, query):
+        if path == "/state":
+            return 200, "application/json", self.json(self.current)
+        if path == "/history":
+            args = parse_qs(query)
+            names = args.get("section", list(self.history))
+            if any(name not in self.history for name in names):
+                return 404, "text/plain", b"unknown section\n"
+            try:
+                n = int(args.get("n", [HISTORY])[0])
+            except ValueError:
+                return 400, "text/plain", b"n is not a number\n"
+            return 200, "application/json", self.json(
+                {name: list(self.history[name])[-n:] if n > 0 else [] for name in names})
+        if path == "/metrics":
+            return 200, "text/plain; version=0.0.4; charset=utf-8", self.prometheus()
+        if path == "/":
+            return 200, "application/json", self.json(
+                {"version": VERSION, "endpoints": ["/state", "/history", "/metrics"]})
+        return 404, "text/plain", b"not found\n"
+
+    def json(self, data):
+        # NaN is not json, the Allan deviations are NaN until they are known
+        return json.dumps(clean(data)).encode("utf-8")
+
+    def prometheus(self):
+        lines = []
+        for section, field, name, help_text in METRICS:
+            values = self.current.get(section)
+            if values is None:
+                continue
+            value = values[field]
+            if field == "fix":
+                value = 1 if value == "A" else 0
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} gauge".format(name))
+            lines.append("{} {}".format(name, number(value)))
+        stats = self.current.get("stats")
+        if stats is not None:
+            lines.append("# HELP gpsdo_counter_adev Allan deviation of the counter, tau in gate times")
+            lines.append("# TYPE gpsdo_counter_adev gauge")
+            for i in range(shm_state.ADEV_LEVELS):
+                value = stats["adev{}".format(2 ** i)]
+                if not math.isnan(value):
+                    lines.append('gpsdo_counter_adev{{tau="{}"}} {}'.format(2 ** i, number(value)))
+        lines.append("# HELP gpsdo_state_updates_total Updates of a section of the shared memory")
+        lines.append("# TYPE gpsdo_state_updates_total counter")
+        for section in sorted(self.current):
+            lines.append('gpsdo_state_updates_total{{section="{}"}} {}'.format(
+                section, self.current[section]["seq"]))
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+    def report(self):
+        return "metrics: {} requests, {} responses built, state version {}".format(
+            self.requests, self.builds, self.version)
+
+
+def clean(data):
+    '''The data with NaN as None'''
+    if isinstance(data, dict):
+        return {k: clean(v) for k, v in data.items()}
+    if isinstance(data, list):
+        return [clean(v) for v in data]
+    if isinstance(data, float) and math.isnan(data):
+        return None
+    return data
+
+
+def number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def http_response(status, content_type, body, keep_alive, head=False):
+    header = ("HTTP/1.1 {} {}\r\nContent-Type: {}\r\nContent-Length: {}\r\n"
+              "Cache-Control: no-cache\r\nConnection: {}\r\n\r\n".format(
+              status, STATUS[status], content_type, len(body),
+              "keep-alive" if keep_alive else "close")).encode("ascii")
+    return header if head else header + body
+
+
+async def handle(cache, reader, writer):
+    '''The requests of a connection, as long as it is kept alive'''
+    try:
+        while True:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), IDLE_TIMEOUT)
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                    asyncio.TimeoutError, ConnectionError):
+                return
+            lines = head.decode("latin-1").split("\r\n")
+            try:
+                method, target, protocol = lines[0].split()
+            except ValueError:
+                writer.write(http_response(400, "text/plain", b"bad request\n", False))
+                return
+            headers = {}
+            for line in lines[1:]:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip().lower()
+            connection = headers.get("connection", "")
+            keep_alive = connection == "keep-alive" or (protocol == "HTTP/1.1" and connection != "close")
+            if method not in ("GET", "HEAD") or "content-length" in headers:
+                writer.write(http_response(405, "text/plain", b"only GET\n", False))
+                return
+            path, _, query = target.partition("?")
+            status, content_type, body = cache.response(path, query)
+            writer.write(http_response(status, content_type, body, keep_alive, method == "HEAD"))
+            await writer.drain()
+            if not keep_alive:
+                return
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def sampler(cache):
+    '''Keep the history going when nobody asks'''
+    while True:
+        cache.sample()
+        await asyncio.sleep(SAMPLE_INTERVAL)
+
+
+async def serve(host=None, port=None, cache=None, started=None):
+    '''
+    Run the server until it is cancelled. started, an asyncio.Future, gets
+    the port when the server is listening.
+    '''
+    host = host or HOST
+    port = PORT if port is None else port
+    cache = cache or StateCache()
+    server = await asyncio.start_server(lambda r, w: handle(cache, r, w), host, port,
+                                        limit=MAX_HEADER)
+    port = server.sockets[0].getsockname()[1]
+    print("Metrics server - Version {} on {}:{}".format(VERSION, host, port))
+    if started is not None:
+        started.set_result(port)
+    task = asyncio.ensure_future(sampler(cache))
+    try:
+        await asyncio.Future()   # forever
+    finally:
+        task.cancel()
+        server.close()
+        await server.wait_closed()
+        print(cache.report())
+
+
+# --- self test ---------------------------------------------------------------
+
+async def fetch(port, paths, keep_alive=True):
+    '''GET the paths over one connection, returns the (status, body) of each'''
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    results = []
+    try:
+        for i, path in enumerate(paths):
+            last = not keep_alive or i == len(paths) - 1
+            writer.write("GET {} HTTP/1.1\r\nHost: test\r\n{}\r\n".format(
+                path, "Connection: close\r\n" if last else "").encode("ascii"))
+            head = await reader.readuntil(b"\r\n\r\n")
+            status = int(head.split()[1])
+            length = int(head.lower().split(b"content-length:")[1].split(b"\r\n")[0])
+            results.append((status, await reader.readexactly(length)))
+    finally:
+        writer.close()
+    return results
+
+
+async def selftest_run(path):
+    errors = 0
+    writer = shm_state.StateChannel(path, writable=True)
+    cache = StateCache(path, history=100)
+    started = asyncio.get_event_loop().create_future()
+    server = asyncio.ensure_future(serve("127.0.0.1", 0, cache, started))
+    port = await started
+    try:
+        (status, body), = await fetch(port, ["/state"])
+        if status != 200 or json.loads(body) != {}:
+            errors += 1
+            print("state before any update: {} {}".format(status, body))
+
+        writer.publish("counter", 10000000.001, 1000, 28000000)
+        writer.publish("nmea", 11, 14, 11, 38.5, 30, b"A", -1200)
+        writer.publish("gpsdo", time.time(), 3600, 512, 32010, 25.25, 1)
+        adevs = [1e-12] + [float("nan")] * (shm_state.ADEV_LEVELS - 1)
+        writer.publish("stats", 5, 10000000.0005, 0.0008, 1e-10, *adevs)
+        results = await fetch(port, ["/state", "/metrics", "/history?section=counter", "/nothing",
+                                     "/history?n=x"])
+        state = json.loads(results[0][1])
+        if state["counter"]["counter"] != 10000000.001 or state["nmea"]["fix"] != "A" or \
+                state["gpsdo"]["dac"] != 32010 or state["stats"]["adev2"] is not None:
+            errors += 1
+            print("wrong state {}".format(state))
+        metrics = results[1][1].decode()
+        for expected in ("gpsdo_counter_frequency_hz 10000000.001", "gpsdo_gps_fix 1",
+                         "gpsdo_nano_temperature_celsius 25.25", 'gpsdo_counter_adev{tau="1"} 1e-12'):
+            if expected not in metrics:
+                errors += 1
+                print("not in the metrics: {}".format(expected))
+        if [r[0] for r in results] != [200, 200, 200, 404, 400]:
+            errors += 1
+            print("wrong status {}".format([r[0] for r in results]))
+
+        # many scrapers of an unchanged state: built once
+        builds = cache.builds
+        n = 200
+        start = time.perf_counter()
+        answers = await asyncio.gather(*[fetch(port, ["/metrics"] * 5) for i in range(n)])
+        elapsed = time.perf_counter() - start
+        if cache.builds != builds or any(a != results[1] for b in answers for a in b):
+            errors += 1
+            print("responses were built {} times for an unchanged state".format(cache.builds - builds))
+        print("{} requests on {} connections in {:.2f}s, {:.0f} requests/s".format(
+            n * 5, n, elapsed, n * 5 / elapsed))
+
+        for i in range(150):
+            writer.publish("counter", 10000000.0 + i / 1000.0, 1000, 28000001 + i)
+            cache.sample()
+        (status, body), = await fetch(port, ["/history?section=counter&n=1000"])
+        history = json.loads(body)["counter"]
+        if len(history) != 100 or history[-1]["tstamp"] != 28000150:
+            errors += 1
+            print("history has {} updates, the last {}".format(len(history), history[-1]))
+    finally:
+        server.cancel()
+        try:
+            await server
+        except asyncio.CancelledError:
+            pass
+        writer.close()
+    return errors
+
+
+def selftest():
+    import os
+    import tempfile
+
+    print("Metrics server self test - Version {}".format(VERSION))
+    path = os.path.join(tempfile.gettempdir(), "gpsdo_state.test.{}".format(os.getpid()))
+    try:
+        errors = asyncio.run(selftest_run(path))
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+    print("{} errors".format(errors))
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP server with the live state of the GPSDO")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--selftest", action="store_true")
+    args = parser.parse_args()
+
+    if args.selftest:
+        sys.exit(1 if selftest() else 0)
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt: # Ctrl-C
+        print("\nCtrl-C - Terminated")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,263 @@
+#!/usr/bin/python3.7
+#-------------------------------------------------------------------------------
+# Name:        nano_report.py
+# Purpose:     The format of the report line the Nano of the GPSDO sends every
+#              second, and the parsers for it.
+#              The fields are described once in REPORT. From that, a parser is
+#              compiled that turns a line into a record with named fields, and
+#              checks the number of fields and their types.
+#              load_log() turns a whole day of gpsdo.log into numpy arrays in
+#              one go, for the analysis scripts.
+#              Used by ser_mon_gpsdo.py and columnar_capture.py
+#
+#              Run it on a log file for a summary and the parse speed:
+#              python3 nano_report.py /home/pi/gpsdo_log/gpsdo.log.2026-10-17
+#
+# Author:      paulv
+#
+# Created:     18-10-2026
+# Copyright:   (c) paulv 2018 2019 2020
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+
+import re
+import sys
+import time
+
+import compressed_log
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+VERSION = "1.2"     # load_log finds the reports with one regex, and rejects a fraction in an int
+
+# The fields of the report line, in the order the Nano sends them, separated
+# by spaces or commas: (name, type, array typecode to store it as, description)
+# Adjust it to the output of your sketch. The columnar capture, the gpsdo
+# section of the shared memory (shm_state.py) and the metrics follow it.
+REPORT = [
+    ("seconds", int, "i", "seconds since the start of the Nano"),
+    ("tic", int, "i", "time interval counter value, the phase"),
+    ("dac", int, "i", "DAC value that steers the OCXO"),
+    ("temp", float, "f", "temperature in degrees C"),
+    ("status", int, "i", "lock status"),
+]
+
+# the start of a line in the log: "2026-10-18 12:00:00,123 INFO     "
+ASCTIME_LEN = 23
+PREFIX_LEN = 33
+LEVEL = b"INFO     "
+SEPARATORS = bytes.maketrans(b"\x00\t\r,", b"    ")  # to spaces, for numpy.fromstring
+
+# the numpy types of the array typecodes
+DTYPES = {"b": "i1", "h": "i2", "i": "i4", "q": "i8", "f": "f4", "d": "f8"}
+
+# a field in a log line, by its type. An int has to be a whole number, like
+# int() wants it, of at most 15 digits so a float64 holds it exactly
+FIELD_PATTERNS = {
+    int: rb"[-+]?\d{1,15}",
+    float: rb"(?:[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?|(?i:[-+]?(?:nan|inf|infinity)))",
+}
+
+
+class ReportFormatError(ValueError):
+    '''A line that does not match the report format'''
+
+
+class Schema(object):
+    '''
+    A compiled report format: the record class with a slot per field and a
+    parser that creates it without any intermediate dict.
+
+    '''
+    def __init__(self, fields=REPORT, name="Report"):
+        """Needs the list of fields, like REPORT."""
+        self.fields = list(fields)
+        self.names = tuple(f[0] for f in self.fields)
+        self.types = tuple(f[1] for f in self.fields)
+        self.typecodes = tuple(f[2] for f in self.fields)
+        self.record = make_record(name, self.names)
+        self._convert = compile_converter(self.types)
+        self.log_line = compile_log_line(self.types)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def values(self, line):
+        '''
+        Returns the converted fields of a line as a tuple, raises
+        ReportFormatError when the line does not match
+        '''
+        parts = line.replace(",", " ").split()
+        if len(parts) != len(self.names):
+            raise ReportFormatError("{} fields, expected {}: {!r}".format(
+                len(parts), len(self.names), line))
+        try:
+            return self._convert(parts)
+        except ValueError:
+            # the slow path, only to find the field that is wrong
+            for name, kind, part in zip(self.names, self.types, parts):
+                try:
+                    kind(part)
+                except ValueError:
+                    raise ReportFormatError("{} is not {}: {!r}".format(
+                        name, kind.__name__, part))
+            raise
+
+    def parse(self, line):
+        '''The line as a record'''
+        return self.record(*self.values(line))
+
+
+def make_record(name, names):
+    '''
+    Create a class with a slot per field and an __init__ that fills them
+    '''
+    body = "".join("\n    self.{0} = {0}".format(n) for n in names)
+    namespace = {}
+    exec("def __init__(self, {}):{}".format(", ".join(names), body), namespace)
+
+    def values(self):
+        return tuple(getattr(self, n) for n in names)
+
+    def __repr__(self):
+        return "{}({})".format(name, ", ".join(
+            "{}={!r}".format(n, getattr(self, n)) for n in names))
+
+    def __eq__(self, other):
+        return type(other) is type(self) and values(self) == values(other)
+
+    return type(name, (object,), {
+        "__slots__": names,
+        "_fields": names,
+        "__init__": namespace["__init__"],
+        "values": values,
+        "__repr__": __repr__,
+        "__eq__": __eq__,
+        "__hash__": None,
+    })
+
+
+def compile_converter(types):
+    '''
+    A function that converts the list of parts in one expression:
+    lambda p: (int(p[0]), int(p[1]), float(p[2]))
+    '''
+    namespace = {t.__name__: t for t in types}
+    items = "".join("{}(p[{}]), ".format(t.__name__, i) for i, t in enumerate(types))
+    return eval("lambda p: ({})".format(items), namespace)
+
+
+def compile_log_line(types, level=LEVEL):
+    '''
+    A regex for a whole report line of the log, without groups so findall()
+    returns the lines. The fields are separated by spaces or commas, like
+    Schema.values() splits them.
+    '''
+    fields = rb"[ ,\t]+".join(FIELD_PATTERNS[t] for t in types)
+    return re.compile(rb"^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3} " + re.escape(level) +
+                      rb"[ ,\t]*" + fields + rb"[ ,\t\r]*$", re.M)
+
+
+# the schema of the Nano, the parser ser_mon_gpsdo.py uses
+report = Schema(REPORT)
+parse = report.parse
+
+
+def log_reports(data, level=LEVEL):
+    '''
+    The (asctime, report) of the report lines of a log, as bytes
+    '''
+    for line in data.splitlines():
+        if line[ASCTIME_LEN + 1:PREFIX_LEN] == level:
+            yield line[:ASCTIME_LEN], line[PREFIX_LEN:]
+
+
+def load_log(path, schema=report):
+    '''
+    Turn a gpsdo.log into numpy arrays, one per field plus "time" with the
+    local time of the log line as datetime64[ms]. The lines that are not a
+    report are skipped. All report lines are converted in one pass.
+    The log can be compressed, see compressed_log.py
+    '''
+    return parse_log(compressed_log.read_log(path), schema)
+
+
+def parse_log(data, schema=report):
+    '''
+    load_log() of the contents of a log, like a day from log_archive.py.
+    One findall over the whole buffer picks out the report lines, so a line
+    with a field that is not of its type (a fraction in an int) is left out.
+    The lines go into one array of fixed width: the times are a slice of it,
+    the fields are read in one numpy.fromstring(). An int that does not fit
+    its column leaves the line out too.
+    '''
+    if numpy is None:
+        raise RuntimeError("load_log needs numpy")
+    n = len(schema)
+    lines = schema.log_line.findall(data)
+    # a byte per column, the short lines are padded with NULs
+    table = numpy.array(lines, dtype="S")
+    width = max(table.itemsize, PREFIX_LEN)
+    table = table.astype("S{}".format(width)).view("u1").reshape(len(lines), width)
+
+    # "2026-10-18 12:00:00" + 123 ms
+    times = numpy.ascontiguousarray(table[:, :19]).view("S19").ravel().astype("datetime64[ms]")
+    ms = numpy.ascontiguousarray(table[:, 20:ASCTIME_LEN]).view("S3").ravel().astype("i8")
+
+    # the fields, with a space after every line
+    text = numpy.full((len(lines), width - PREFIX_LEN + 1), ord(" "), dtype="u1")
+    text[:, :-1] = table[:, PREFIX_LEN:]
+    values = numpy.fromstring(text.tobytes().translate(SEPARATORS), sep=" ").reshape(-1, n)
+
+    keep = numpy.ones(len(lines), dtype=bool)
+    for i, typecode in enumerate(schema.typecodes):
+        dtype = numpy.dtype(DTYPES[typecode])
+        if dtype.kind == "i":
+            info = numpy.iinfo(dtype)
+            keep &= (values[:, i] >= info.min) & (values[:, i] <= info.max)
+
+    result = {"time": (times + ms.astype("timedelta64[ms]"))[keep]}
+    for i, (name, typecode) in enumerate(zip(schema.names, schema.typecodes)):
+        result[name] = values[keep, i].astype(DTYPES[typecode])
+    return result
+
+
+def summary(path):
+    print("Nano report parser - Version {}".format(VERSION))
+    lines = [text.decode("ascii", "replace")
+             for stamp, text in log_reports(compressed_log.read_log(path))]
+
+    start = time.perf_counter()
+    records = 0
+    for line in lines:
+        try:
+            parse(line)
+            records += 1
+        except ReportFormatError:
+            pass
+    elapsed = time.perf_counter() - start
+    print("{} lines, {} reports, {:.1f} us/line with the record parser".format(
+        len(lines), records, 1e6 * elapsed / max(len(lines), 1)))
+
+    if numpy is None:
+        print("no numpy, skipping the batch loader")
+        return
+    start = time.perf_counter()
+    columns = load_log(path)
+    elapsed = time.perf_counter() - start
+    print("batch loader: {} reports in {:.3f}s".format(len(columns["time"]), elapsed))
+    for name in report.names:
+        column = columns[name]
+        if len(column):
+            print("{:>10}: min {}  max {}  mean {:.4f}".format(
+                name, column.min(), column.max(), column.mean()))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("usage: python3 nano_report.py <gpsdo.log>")
+        sys.exit(1)
+    summary(sys.argv[1])
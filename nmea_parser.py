@@ -0,0 +1,423 @@
+#!/usr/bin/python3.7
+#-------------------------------------------------------------------------------
+# Name:        nmea_parser.py
+# Purpose:     Light-weight NMEA parser for the NEO GPS sentences we use.
+#              It works on the raw bytes coming from the sentence framer,
+#              validates the checksum and only splits the fields we need.
+#              pynmea2 is no longer required, but can still be used by
+#              serial_bb_gps.py as a fallback.
+#              The NMEAEngine dispatches GGA, RMC, GSA and GSV sentences on
+#              their type and keeps a satellite table with the signal levels.
+#
+#              Run it on its own to compare it with pynmea2:
+#              python3 nmea_parser.py [capture_1Hz.nmea [capture_10Hz.nmea]]
+#
+# Author:      paulv
+#
+# Created:     18-10-2026
+# Copyright:   (c) paulv 2018 2019 2020
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+
+import sys
+import time
+import tracemalloc
+from array import array
+from datetime import time as dtime
+
+VERSION = "1.3"     # subscribing a callback twice does not call it twice
+
+MAX_SATS = 64       # size of the satellite table
+MAX_AGE = 3         # fixes a satellite can be missing from the GSV before it is dropped
+
+
+class ParseError(ValueError):
+    '''Raised when a sentence is broken or has a bad checksum'''
+    pass
+
+
+def checksum_ok(sentence):
+    '''
+    The checksum is the XOR of all the characters between the $ and the *,
+    written as two hex digits after the *
+    '''
+    star = sentence.rfind(b"*")
+    if star < 0 or len(sentence) < star + 3:
+        return False
+    cs = 0
+    for c in sentence[1:star]:
+        cs ^= c
+    try:
+        return int(sentence[star+1:star+3], 16) == cs
+    except ValueError:
+        return False
+
+
+def sentence_type(sentence):
+    '''
+    "$GPGGA,..." -> b"GGA", whatever the talker is (GP, GN, GL, ...)
+    '''
+    return sentence[3:6]
+
+
+def fields(sentence):
+    '''
+    Validate the checksum and return the fields after the address field
+    '''
+    if not checksum_ok(sentence):
+        raise ParseError("checksum error: {}".format(sentence))
+    return sentence[7:sentence.rfind(b"*")].split(b",")
+
+
+def parse_time(f):
+    # hhmmss.ss
+    if len(f) < 6:
+        return None
+    try:
+        return dtime(int(f[0:2]), int(f[2:4]), int(f[4:6]))
+    except ValueError:
+        raise ParseError("bad time field: {}".format(f))
+
+
+def to_int(f):
+    return int(f) if f else 0
+
+
+def to_float(f):
+    return float(f) if f else None
+
+
+class GGA(object):
+    '''
+    The fields of a GGA sentence we use. The names are the same as the ones
+    pynmea2 uses, so the two can be swapped.
+    '''
+    __slots__ = ("timestamp", "lat", "lat_dir", "lon", "lon_dir", "gps_qual",
+                 "num_sats", "horizontal_dil", "altitude", "altitude_units")
+
+
+def parse_gga(sentence):
+    '''
+    $GPGGA,hhmmss.ss,llll.ll,a,yyyyy.yy,a,q,nn,h.h,a.a,M,g.g,M,,*hh
+    '''
+    f = fields(sentence)
+    if len(f) < 10:
+        raise ParseError("GGA has {} fields: {}".format(len(f), sentence))
+    try:
+        msg = GGA()
+        msg.timestamp = parse_time(f[0])
+        msg.lat = f[1].decode("ascii")
+        msg.lat_dir = f[2].decode("ascii")
+        msg.lon = f[3].decode("ascii")
+        msg.lon_dir = f[4].decode("ascii")
+        msg.gps_qual = to_int(f[5])
+        msg.num_sats = to_int(f[6])
+        msg.horizontal_dil = to_float(f[7])
+        msg.altitude = to_float(f[8])
+        msg.altitude_units = f[9].decode("ascii")
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ParseError("GGA {}: {}".format(e, sentence))
+    return msg
+
+
+class RMC(object):
+    __slots__ = ("timestamp", "status", "lat", "lat_dir", "lon", "lon_dir", "datestamp")
+
+
+def parse_rmc(sentence):
+    '''
+    $GPRMC,hhmmss.ss,A,llll.ll,a,yyyyy.yy,a,x.x,x.x,ddmmyy,x.x,a,m*hh
+    '''
+    f = fields(sentence)
+    if len(f) < 9:
+        raise ParseError("RMC has {} fields: {}".format(len(f), sentence))
+    try:
+        msg = RMC()
+        msg.timestamp = parse_time(f[0])
+        msg.status = f[1].decode("ascii")   # A = valid, V = warning
+        msg.lat = f[2].decode("ascii")
+        msg.lat_dir = f[3].decode("ascii")
+        msg.lon = f[4].decode("ascii")
+        msg.lon_dir = f[5].decode("ascii")
+        msg.datestamp = f[8].decode("ascii")
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ParseError("RMC {}: {}".format(e, sentence))
+    return msg
+
+
+class GSA(object):
+    __slots__ = ("mode", "mode_fix_type", "prns", "pdop", "hdop", "vdop")
+
+
+def parse_gsa(sentence):
+    '''
+    $GPGSA,A,3,04,05,,09,12,,,24,,,,,2.5,1.3,2.1*39
+    up to 12 satellites used in the fix, followed by the PDOP, HDOP and VDOP
+    '''
+    f = fields(sentence)
+    if len(f) < 17:
+        raise ParseError("GSA has {} fields: {}".format(len(f), sentence))
+    try:
+        msg = GSA()
+        msg.mode = f[0].decode("ascii")
+        msg.mode_fix_type = to_int(f[1])   # 1 = no fix, 2 = 2D, 3 = 3D
+        msg.prns = tuple(int(p) for p in f[2:14] if p)
+        msg.pdop = to_float(f[14])
+        msg.hdop = to_float(f[15])
+        msg.vdop = to_float(f[16])
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ParseError("GSA {}: {}".format(e, sentence))
+    return msg
+
+
+class SatelliteTable(object):
+    '''
+    Fixed size table with the satellites in view, kept in arrays that are
+    updated in place. A satellite gets a slot the first time it is seen and
+    keeps it until it has been missing for MAX_AGE fixes.
+
+    '''
+    def __init__(self, size=MAX_SATS):
+        self.size = size
+        self.prn = array('h', [0] * size)         # 0 = free slot
+        self.elevation = array('h', [0] * size)   # degrees
+        self.azimuth = array('h', [0] * size)     # degrees
+        self.snr = array('h', [0] * size)         # dB-Hz, 0 = not tracked
+        self.used = array('b', [0] * size)        # used in the fix
+        self.seen = array('l', [0] * size)        # fix number it was last reported in
+        self.slots = {}                           # prn -> slot
+        self.epoch = 0                            # counts the fixes
+        self.last_summary = (0, 0, 0, 0, 0)       # summary of the previous complete fix
+
+    def new_epoch(self):
+        '''
+        Called once per fix, drops the satellites we have not heard of for a while
+        '''
+        self.last_summary = self.summary()
+        self.epoch += 1
+        oldest = self.epoch - MAX_AGE
+        for i in range(self.size):
+            if self.prn[i] and self.seen[i] < oldest:
+                del self.slots[self.prn[i]]
+                self.prn[i] = 0
+            self.used[i] = 0
+
+    def update(self, prn, elevation, azimuth, snr):
+        i = self.slots.get(prn)
+        if i is None:
+            try:
+                i = self.prn.index(0)
+            except ValueError:
+                return  # table full
+            self.slots[prn] = i
+            self.prn[i] = prn
+        self.elevation[i] = elevation
+        self.azimuth[i] = azimuth
+        self.snr[i] = snr
+        self.seen[i] = self.epoch
+
+    def set_used(self, prns):
+        for prn in prns:
+            i = self.slots.get(prn)
+            if i is not None:
+                self.used[i] = 1
+
+    def summary(self):
+        '''
+        Returns (in view, tracked, used, average SNR of the used satellites, lowest SNR used)
+        '''
+        in_view = tracked = used = total = 0
+        lowest = 0
+        for i in range(self.size):
+            if not self.prn[i]:
+                continue
+            in_view += 1
+            snr = self.snr[i]
+            if snr:
+                tracked += 1
+            if self.used[i]:
+                used += 1
+                total += snr
+                if lowest == 0 or snr < lowest:
+                    lowest = snr
+        average = round(total / float(used), 1) if used else 0
+        return in_view, tracked, used, average, lowest
+
+
+def parse_gsv(sentence, table):
+    '''
+    $GPGSV,3,1,11,03,03,111,00,04,15,270,00,06,01,010,00,13,06,292,00*74
+    number of messages, message number, satellites in view, followed by up
+    to four blocks of PRN, elevation, azimuth and SNR.
+    The satellites go straight into the table.
+    '''
+    f = fields(sentence)
+    if len(f) < 3:
+        raise ParseError("GSV has {} fields: {}".format(len(f), sentence))
+    try:
+        for n in range(3, len(f) - 3, 4):
+            if f[n]:
+                table.update(int(f[n]), to_int(f[n+1]), to_int(f[n+2]), to_int(f[n+3]))
+    except ValueError as e:
+        raise ParseError("GSV {}: {}".format(e, sentence))
+    return table
+
+
+class NMEAEngine(object):
+    '''
+    Dispatch sentences on their type to a parser and the subscribers of that
+    type. Types nobody subscribed to are discarded before the checksum
+    is even calculated.
+
+    '''
+    def __init__(self, size=MAX_SATS):
+        self.sats = SatelliteTable(size)
+        self.parsers = {
+            b"GGA": parse_gga,
+            b"RMC": parse_rmc,
+            b"GSA": self._gsa,
+            b"GSV": self._gsv,
+        }
+        self.dispatch_table = {}    # type -> (parser, [callbacks])
+        self.last_time = None       # time field of the current fix
+        self.discarded = 0          # sentences nobody wanted
+
+    def set_parser(self, kind, parser):
+        '''Replace the parser for a sentence type, e.g. with pynmea2'''
+        self.parsers[kind] = parser
+        if kind in self.dispatch_table:
+            self.dispatch_table[kind] = (parser, self.dispatch_table[kind][1])
+
+    def subscribe(self, kind, callback=None):
+        '''
+        Ask for a sentence type. Without a callback the sentence is only used
+        to update the satellite table. A callback that is already subscribed
+        is not added again, so a restart of the monitor can subscribe again.
+        '''
+        if kind not in self.dispatch_table:
+            self.dispatch_table[kind] = (self.parsers[kind], [])
+        callbacks = self.dispatch_table[kind][1]
+        if callback is not None and callback not in callbacks:
+            callbacks.append(callback)
+
+    def dispatch(self, sentence):
+        kind = sentence[3:6]
+        entry = self.dispatch_table.get(kind)
+        if entry is None:
+            self.discarded += 1
+            return None
+        parser, callbacks = entry
+        msg = parser(sentence)
+        if kind == b"GGA" or kind == b"RMC":
+            # both carry the time of the fix, the first one of a fix starts a new
+            # epoch, only once the parser has checked the sentence
+            t = sentence[7:sentence.find(b",", 7)]
+            if t != self.last_time:
+                self.last_time = t
+                self.sats.new_epoch()
+        for callback in callbacks:
+            callback(msg)
+        return msg
+
+    def _gsa(self, sentence):
+        msg = parse_gsa(sentence)
+        self.sats.set_used(msg.prns)
+        return msg
+
+    def _gsv(self, sentence):
+        return parse_gsv(sentence, self.sats)
+
+
+# --- benchmark ---------------------------------------------------------------
+
+def load_capture(path):
+    '''
+    A capture is the raw NMEA output of the NEO, one sentence per line
+    '''
+    with open(path, 'rb') as f:
+        return [l.rstrip(b"\r\n") for l in f if l.startswith(b"$")]
+
+
+def run_native(sentences):
+    n = 0
+    for s in sentences:
+        if s[3:6] == b"GGA":
+            parse_gga(s)
+            n += 1
+    return n
+
+
+def run_pynmea2(sentences):
+    import pynmea2
+    n = 0
+    for s in sentences:
+        xstr = s.decode("utf-8", "ignore")
+        if xstr.find('GGA') > 0:
+            pynmea2.parse(xstr)
+            n += 1
+    return n
+
+
+def measure(name, func, parse, sentences, rate, epoch_len):
+    start = time.perf_counter()
+    func(sentences)
+    elapsed = time.perf_counter() - start
+    speed = len(sentences) / elapsed
+
+    # count the memory blocks a parse leaves behind, on a smaller sample
+    sample = sentences[:2000]
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    keep = [parse(s) for s in sample if s[3:6] == b"GGA"]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    blocks = sum(st.count_diff for st in after.compare_to(before, "filename"))
+    per_sentence = blocks / float(max(len(keep), 1))
+
+    print("{:8s} {:>5} Hz: {:10.0f} sentences/s, {:6.2f} us/sentence, {:5.1f} blocks/GGA, "
+          "{:.4f}% cpu at this rate".format(name, rate, speed, 1e6 / speed, per_sentence,
+          100.0 * rate * epoch_len / speed))
+
+
+def measure_engine(sentences, rate, epoch_len):
+    engine = NMEAEngine()
+    for kind in (b"GGA", b"RMC", b"GSA", b"GSV"):
+        engine.subscribe(kind)
+    start = time.perf_counter()
+    for s in sentences:
+        engine.dispatch(s)
+    elapsed = time.perf_counter() - start
+    speed = len(sentences) / elapsed
+    print("{:8s} {:>5} Hz: {:10.0f} sentences/s, {:6.2f} us/sentence, {:.4f}% cpu at this rate, "
+          "sats (view, tracked, used, avg snr, min snr) {}".format("engine", rate, speed,
+          1e6 / speed, 100.0 * rate * epoch_len / speed, engine.sats.last_summary))
+
+
+def benchmark(captures):
+    from sentence_framer import synthetic_nmea
+
+    print("NMEA parser benchmark - Version {}".format(VERSION))
+    try:
+        import pynmea2
+        have_pynmea2 = True
+    except ImportError:
+        print("pynmea2 is not installed, only measuring the native parser")
+        have_pynmea2 = False
+
+    for rate, path in zip((1, 10), captures + [None, None]):
+        if path:
+            sentences = load_capture(path)
+            print("capture {}: {} sentences".format(path, len(sentences)))
+        else:
+            sentences = [s.rstrip("\r\n").encode("ascii") for s in synthetic_nmea(600, rate)]
+        ggas = sum(1 for s in sentences if s[3:6] == b"GGA")
+        epoch_len = len(sentences) / float(max(ggas, 1))  # sentences per fix
+        measure("native", run_native, parse_gga, sentences, rate, epoch_len)
+        measure_engine(sentences, rate, epoch_len)
+        if have_pynmea2:
+            measure("pynmea2", run_pynmea2, lambda s: pynmea2.parse(s.decode("ascii")),
+                    sentences, rate, epoch_len)
+
+
+if __name__ == '__main__':
+    benchmark(sys.argv[1:])
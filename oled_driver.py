@@ -22,28 +22,92 @@ import locale
 locale.setlocale(locale.LC_ALL, '')  # Use '' for auto, or force e.g. to 'en_US.UTF-8'
 import json
 import os
-
-VERSION = "2.2"     # fixed bug to display sats when there is no json file
+import signal
+import functools
+import shm_state
+import inotify_watch
+import ssd1306_diff
+import oled_text
+import hotpath_stats
+
+VERSION = "3.0"     # SIGTERM clears the display and writes the stats like Ctrl-C
 DEBUG = True
 
+# wait for the monitors to replace their json files, or to touch the notify
+# file of shm_state.py when they only use the shared memory, or for the next
+# minute tick of "min. left", instead of refreshing every second
+CHANGE_DRIVEN = True
+
+# only send the pages and columns that changed to the display, instead of the
+# full 512 bytes for every update. Keeps the I2C bus free for other sensors.
+PARTIAL_UPDATE = True
+
+# Time the read, render and I2C write of every refresh, served on
+# /mnt/ramdisk/oled_stats.sock, see hotpath_stats.py
+HOTPATH_STATS = False
+
 
 # data path is on a RAM disk to protect the SD card
-neo_data_path = "/mnt/ramdisk/nmea.json"
-counter_data_path = "/mnt/ramdisk/counter.json"
+data_dir = "/mnt/ramdisk"
+neo_data_path = data_dir + "/nmea.json"
+counter_data_path = data_dir + "/counter.json"
+notify_path = shm_state.NOTIFY_PATH  # touched when there are no json files
 
 # instantiate an empty dict to pick-up the data stored by the devices
 display_data = {}
 
-# setup the OLED display
-disp = Adafruit_SSD1306.SSD1306_128_32(rst=None)
-disp.begin()
-disp.clear()
-disp.display()
-# print(disp.width, disp.height) # should be 128 x 32
+# the shared memory the monitors publish their data in, opened when it is there
+state = None
+
+# the lines that are on the display now
+last_lines = None
+
+# the OLED display and the image we draw on, setup by init_display()
+disp = None
+image = None
+draw = None
 
-image = Image.new('1', (disp.width, disp.height))   # create a blank image
-draw = ImageDraw.Draw(image) # get drawing object to draw on image
+# keeps what is on the display, used with PARTIAL_UPDATE
+differ = None
 
+# the rendered lines of text, setup by init_display()
+line_cache = None
+
+# the hot path stats, opened by init_display()
+hotpath = None
+
+# setup the display coordinates
+padding = 0 # first line
+shape_width = 20  # chars
+top = padding
+x = padding
+
+
+def init_display(display=None):
+    '''
+    Setup the OLED display, the image in memory and the font
+    '''
+    global disp, image, draw, my_font, differ, line_cache, hotpath
+
+    # setup the OLED display
+    if display is None:
+        display = Adafruit_SSD1306.SSD1306_128_32(rst=None)
+    disp = display
+    disp.begin()
+    disp.clear()
+    disp.display()
+    # print(disp.width, disp.height) # should be 128 x 32
+
+    image = Image.new('1', (disp.width, disp.height))   # create a blank image
+    draw = ImageDraw.Draw(image) # get drawing object to draw on image
+    my_font = ImageFont.load_default() # Load default font.
+    line_cache = oled_text.LineCache(my_font)
+
+    if PARTIAL_UPDATE:
+        differ = ssd1306_diff.FrameDiffer(disp)
+
+    if HOTPATH_STATS and hotpath is None:
+        hotpath = hotpath_stats.open_stats("oled", hotpath_stats.DISPLAY_STAGES)
 
 
 def read_json_nmea():
@@ -82,7 +146,7 @@ def read_json_counter():
             display_data = json.load(f)
         except ValueError:
             print("counter: ValueError from jason.load")
-            return
+            return(0, 0, 0)
 
     # check for the presence of the counter data
     # if counter is there, the rest will also be
@@ -98,96 +162,246 @@ def read_json_counter():
     return(counter, gate, tstamp)
 
 
-def main():
-    print("OLED display driver - Version {}".format(VERSION))
+def read_state():
+    '''
+    Open the shared memory as soon as a monitor has created it
+    '''
+    global state
+
+    if state is None:
+        state = shm_state.open_reader()
+    return state
+
+
+def read_counter():
+    '''
+    Get the counter data from shared memory, or from the json file when the
+    counter monitor has not published anything there
+    '''
+    channel = read_state()
+    if channel is not None:
+        snap = channel.snapshot("counter")
+        if snap is not None and snap[0] > 0:
+            counter, gate_seconds, tstamp = snap[1]
+            return(counter, "{}s".format(gate_seconds), tstamp)
+    return read_json_counter()
+
+
+def read_nmea():
+    '''
+    Get the number of satellites from shared memory, or from the json file
+    '''
+    channel = read_state()
+    if channel is not None:
+        snap = channel.snapshot("nmea")
+        if snap is not None and snap[0] > 0:
+            return(snap[1][0])
+    return read_json_nmea()
+
+
+@functools.lru_cache(maxsize=8)
+def format_counter(counter_f, gate):
+    '''
+    Returns (counter string, gate label, gate time in minutes). The counter
+    value only changes every 16 or 166 minutes, so the result is cached.
+    '''
+    # counter_p(recision) will be used in the display formatting
+    counter_p = int(counter_f)
+
+    # setup the display formatting
+    # set the number of decimals based on the selected gate time.
+    # setup the remaining time counter when we can expect the next counter update
+    gate_time_s = ""
+    gate_time = 0
+    if gate == "1000s" :
+        # strip the leading zeroes if any
+        counter_f = "{:,.3f}".format(counter_f).lstrip('0')
+        gate_time_s = "1Ks"
+        gate_time = int(1000/60)  # 16 minutes
+    if gate =="10000s":
+        #strip the leading zeroes if any
+        counter_f = "{:,.4f}".format(counter_f).lstrip('0')
+        gate_time_s = "10Ks"
+        gate_time = int(10000/60)  # 166 minutes, 2.7 hrs
+
+    # create right justified strings for the counter value
+    if counter_p < 10000:      # 90,000.0000
+        counter_s = "       {} Hz".format(counter_f) # 7 spaces padding
+    elif counter_p < 100000:   # 900,000.0000
+        counter_s = "      {} Hz".format(counter_f)  # 6 spaces padding
+    elif counter_p < 1000000:  # 900,000.0000
+        counter_s = "     {} Hz".format(counter_f)   # 5 spaces padding
+    elif counter_p < 10000000: # 9,000,000.0000
+        counter_s = "   {} Hz".format(counter_f)     # 3 spaces padding
+    elif counter_p >= 10000000: # 10.000.000.0000
+        counter_s = "  {} Hz".format(counter_f)      # 2 spaces padding
+    else:
+        counter_s = ""
 
-    # setup the display coordinates
-    padding = 0 # first line
-    shape_width = 20  # chars
-    top = padding
-    bottom = disp.height - padding
-    x = padding
-    my_font = ImageFont.load_default() # Load default font.
+    return (counter_s, gate_time_s, gate_time)
+
+
+def render_lines():
+    '''
+    Read the data of the counter and the gps, and create the 3 lines of text
+    '''
+    # get the data from the counter
+    counter, gate, tstamp = read_counter()
+    # turn the counter string into a float
+    counter_f = float(counter)
+    if DEBUG : print(gate, counter_f,tstamp)
 
+    # get the data from the neo
+    sat_nbr = read_nmea()
+
+    # there has to be a valid digit in the string
     try:
-        while True:
-            # get the data from the counter file
-            counter, gate, tstamp = read_json_counter()
-            # turn the counter string into a float
-            counter_f = float(counter)
-            # counter_p(recision) will be used in the display formatting
-            counter_p = int(counter_f)
-            if DEBUG : print(gate, counter_f,tstamp)
-
-            # get the data from the neo file
-            sat_nbr = read_json_nmea()
-
-            # there has to be a valid digit in the string
-            try:
-                sat_nbr = int(sat_nbr)
-                # ok, now right justify the number for the display position
-                if sat_nbr < 9 :
-                    sat_nbr_s = " "+str(sat_nbr)
-                else:
-                    sat_nbr_s = str(sat_nbr)
-            except ValueError:
-                print("received strange sat_nbr data : {}".format(sat_nbr))
-                sat_nbr_s = "  "
-
-            # setup the display formatting
-            # set the number of decimals based on the selected gate time.
-            # setup the remaining time counter when we can expect the next counter update
-            gate_time_s = ""
-            gate_time = 0
-            if gate == "1000s" :
-                # strip the leading zeroes if any
-                counter_f = "{:,.3f}".format(counter_f).lstrip('0')
-                gate_time_s = "1Ks"
-                gate_time = int(1000/60)  # 16 minutes
-            if gate =="10000s":
-                #strip the leading zeroes if any
-                counter_f = "{:,.4f}".format(counter_f).lstrip('0')
-                gate_time_s = "10Ks"
-                gate_time = int(10000/60)  # 166 minutes, 2.7 hrs
-
-            # calculate the remaining time until the next counter update comes
-            time_left = int(gate_time - (int(time.time()/60) - tstamp))
-
-            # create right justified strings for the counter value
-            if counter_p < 10000:      # 90,000.0000
-                counter_s = "       {} Hz".format(counter_f) # 7 spaces padding
-            elif counter_p < 100000:   # 900,000.0000
-                counter_s = "      {} Hz".format(counter_f)  # 6 spaces padding
-            elif counter_p < 1000000:  # 900,000.0000
-                counter_s = "     {} Hz".format(counter_f)   # 5 spaces padding
-            elif counter_p < 10000000: # 9,000,000.0000
-                counter_s = "   {} Hz".format(counter_f)     # 3 spaces padding
-            elif counter_p >= 10000000: # 10.000.000.0000
-                counter_s = "  {} Hz".format(counter_f)      # 2 spaces padding
-            else:
-                counter_s = ""
+        sat_nbr = int(sat_nbr)
+        # ok, now right justify the number for the display position
+        if sat_nbr < 9 :
+            sat_nbr_s = " "+str(sat_nbr)
+        else:
+            sat_nbr_s = str(sat_nbr)
+    except ValueError:
+        print("received strange sat_nbr data : {}".format(sat_nbr))
+        sat_nbr_s = "  "
+
+    counter_s, gate_time_s, gate_time = format_counter(counter_f, gate)
+
+    # calculate the remaining time until the next counter update comes
+    time_left = int(gate_time - (int(time.time()/60) - tstamp))
+
+    return (counter_s,
+            'sats: {}  gate: {}'.format(sat_nbr_s, gate_time_s),
+            'min. left: {}'.format(time_left))
+
+
+def show(lines):
+    '''
+    Put the lines on the display
+    '''
+    # draw a black filled box to clear the image
+    draw.rectangle((0, 0, disp.width, disp.height), outline=0, fill=0)
+
+    # setup the 3 lines in memory, from the cache when we had them before
+    oled_text.paste(image, line_cache.get(lines[0]), (x, top +  1))
+    oled_text.paste(image, line_cache.get(lines[1]), (x, top + 12))
+    oled_text.paste(image, line_cache.get(lines[2]), (x, top + 23))
+    if hotpath is not None:
+        hotpath.lap(hotpath_stats.RENDER)
+
+    # display the image in memory on the screen
+    if differ is not None:
+        differ.update(image)
+        if DEBUG : print(differ.frame_report())
+    else:
+        disp.image(image)
+        disp.display()
+    if hotpath is not None:
+        hotpath.lap(hotpath_stats.I2C)
+        hotpath.count(hotpath_stats.PUBLISHED)
+
+
+def refresh():
+    '''
+    Update the display, but only when the content changed.
+    Returns True when the display was updated.
+    '''
+    global last_lines
+
+    if hotpath is not None:
+        hotpath.start()
+    lines = render_lines()
+    if hotpath is not None:
+        hotpath.lap(hotpath_stats.READ)
+        hotpath.count(hotpath_stats.READS)
+        hotpath.tick()
+    if lines == last_lines:
+        return False
+    if hotpath is not None:
+        hotpath.start()     # not the time of the tick
+    show(lines)
+    last_lines = lines
+    return True
+
+
+def next_tick():
+    '''
+    Seconds until "min. left" changes, at the start of the next minute
+    '''
+    return 60.0 - time.time() % 60.0 + 0.05
+
+
+def open_watcher():
+    '''
+    Watch for the monitors replacing their json files or touching the notify
+    file, returns None when we can't
+    '''
+    try:
+        return inotify_watch.DirWatcher(data_dir, [os.path.basename(neo_data_path),
+                                                   os.path.basename(counter_data_path),
+                                                   os.path.basename(notify_path)])
+    except OSError as e:
+        print("no change notifications, refreshing every second: {}".format(e))
+        return None
+
+
+def close_stats():
+    global hotpath
+
+    if hotpath is not None:
+        hotpath.close()
+        print(hotpath.report())
+        hotpath = None
+
 
-            # draw a black filled box to clear the image
-            draw.rectangle((0, 0, disp.width, disp.height), outline=0, fill=0)
+def clear_display():
+    global last_lines
 
-            # setup the 3 lines in memory
-            draw.text((x, top +  1), str("{}".format(counter_s)), font=my_font, fill=255)
-            draw.text((x, top + 12), 'sats: {}  gate: {}'.format(sat_nbr_s, gate_time_s), font=my_font, fill=255)
-            draw.text((x, top + 23), 'min. left: {}'.format(time_left), font=my_font, fill=255)
+    if disp is None:
+        return
+    last_lines = None
+    disp.clear()
+    disp.display()
+    if differ is not None:
+        differ.invalidate()
 
-            # display the image in memory on the screen
-            disp.image(image)
-            disp.display()
 
-            time.sleep(1) # neo updates are coming every second, we don't need to be that quick
+def sigterm(signum, frame):
+    '''
+    systemd stops the service with SIGTERM, take the Ctrl-C way out so the
+    display is cleared and the stats are written
+    '''
+    raise KeyboardInterrupt
+
+
+def main():
+    print("OLED display driver - Version {}".format(VERSION))
+    signal.signal(signal.SIGTERM, sigterm)
+
+    init_display()
+    watcher = open_watcher() if CHANGE_DRIVEN else None
+
+    try:
+        while True:
+            refresh()
+            if watcher is not None:
+                # sleep until there is new data or the minute changes
+                watcher.wait(next_tick())
+            else:
+                time.sleep(1) # neo updates are coming every second, we don't need to be that quick
 
 
     except KeyboardInterrupt:
         print('\nTerminating')
 
     finally:
-        disp.clear()
-        disp.display()
+        if differ is not None:
+            print(differ.report())
+        if line_cache is not None:
+            print(line_cache.report())
+        close_stats()
+        clear_display()
 
 
 if __name__ == '__main__':
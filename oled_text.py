@@ -0,0 +1,222 @@
+#!/usr/bin/python3.7
+#-------------------------------------------------------------------------------
+# Name:        oled_text.py
+# Purpose:     Text rendering cache for the OLED display.
+#              The glyphs of the font are rasterised once into a table, a
+#              line is made by pasting its glyphs next to each other. The
+#              line images are kept in a small LRU cache by their text, so a
+#              line that did not change costs a dictionary lookup.
+#              Used by oled_driver.py
+#
+#              Run it on its own for a benchmark against draw.text:
+#              python3 oled_text.py
+#
+# Author:      paulv
+#
+# Created:     18-10-2026
+# Copyright:   (c) paulv 2018 2019 2020
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+
+from collections import OrderedDict
+import sys
+import time
+
+from PIL import Image
+from PIL import ImageDraw
+from PIL import ImageFont
+
+VERSION = "1.0"
+
+CACHE_SIZE = 32     # line images to keep
+# the characters that are checked when the glyph table is setup
+SAMPLE = "0123456789,. Hzsatgemin.lfK:"
+PAD = 2             # pixels a glyph can reach outside of its cell
+
+
+def text_size(font, text):
+    '''(width, height) of a text, for old and new versions of PIL'''
+    if hasattr(font, "getsize"):
+        return font.getsize(text)
+    bbox = font.getbbox(text)
+    return max(int(round(font.getlength(text))), bbox[2]), bbox[3]
+
+
+class GlyphTable(object):
+    '''
+    Rasterised glyphs of a bitmap font, made on first use.
+    The glyphs of the default font reach a pixel into their neighbours, and
+    draw.text lets the next glyph overwrite that. So a glyph is kept for the
+    characters next to it, as the pixels of its own cell drawn between them.
+    Only used when pasting the cells gives the same pixels as draw.text,
+    check that with usable().
+
+    '''
+    def __init__(self, font):
+        """Needs the font, like ImageFont.load_default()."""
+        self.font = font
+        self.height = text_size(font, SAMPLE)[1]
+        self.space = text_size(font, " ")[0]
+        self.advances = {}
+        self.cells = {}
+
+    def advance(self, ch):
+        width = self.advances.get(ch)
+        if width is None:
+            width = self.advances[ch] = text_size(self.font, ch)[0]
+        return width
+
+    def cell(self, prev, ch, following):
+        '''
+        The image of the cell of ch, between prev and following (None at the
+        start and the end of the line). The last cell also gets the PAD
+        pixels on its right a glyph can draw outside of its cell.
+        '''
+        key = (prev, ch, following)
+        image = self.cells.get(key)
+        if image is None:
+            if prev is None:
+                # draw.text shifts a line whose first glyph starts left of its cell
+                text, x0, origin = ch, 0, 0
+            else:
+                # a space in front keeps prev where it would be in the line
+                text, x0, origin = " " + prev + ch, self.advance(prev), -self.space
+            width = self.advance(ch) + (PAD if following is None else 0)
+            canvas = Image.new('1', (x0 + width + 2 * self.space + PAD, self.height))
+            ImageDraw.Draw(canvas).text((origin, 0), text + (following or ""),
+                                        font=self.font, fill=255)
+            image = self.cells[key] = canvas.crop((x0, 0, x0 + width, self.height))
+        return image
+
+    def render(self, text):
+        '''A new line image with the glyphs of the text'''
+        line = Image.new('1', (sum(self.advance(ch) for ch in text) + PAD, self.height))
+        x = 0
+        last = len(text) - 1
+        for i, ch in enumerate(text):
+            line.paste(self.cell(text[i - 1] if i else None, ch,
+                                 text[i + 1] if i < last else None), (x, 0))
+            x += self.advance(ch)
+        return line
+
+    def usable(self, text=SAMPLE):
+        '''
+        True when the glyphs line up the same way as draw.text does it.
+        A TrueType font has kerning and glyphs that overlap, that one is not.
+        '''
+        if not isinstance(self.font, ImageFont.ImageFont):
+            return False
+        rendered = self.render(text)
+        size = (2 * rendered.width, 2 * rendered.height)
+        drawn = Image.new('1', size)
+        ImageDraw.Draw(drawn).text((0, 0), text, font=self.font, fill=255)
+        pasted = Image.new('1', size)
+        paste(pasted, rendered, (0, 0))
+        return pasted.tobytes() == drawn.tobytes()
+
+
+def draw_line(font, text, height):
+    '''
+    A new line image with draw.text, when we can't use the glyph table.
+    A TrueType font can draw outside of the size it reports, so draw it on a
+    larger image and cut off what is empty.
+    '''
+    width = text_size(font, text)[0]
+    line = Image.new('1', (2 * width + height, 2 * height))
+    ImageDraw.Draw(line).text((0, 0), text, font=font, fill=255)
+    bbox = line.getbbox()
+    if bbox is None:
+        return Image.new('1', (max(width, 1), height))
+    return line.crop((0, 0, bbox[2], bbox[3]))
+
+
+class LineCache(object):
+    '''
+    Line images by their text, the least recently used one is dropped when
+    the cache is full.
+
+    '''
+    def __init__(self, font, size=CACHE_SIZE):
+        """Needs the font and the number of lines to keep."""
+        self.font = font
+        self.size = size
+        self.lines = OrderedDict()
+        self.glyphs = GlyphTable(font)
+        self.height = self.glyphs.height
+        if not self.glyphs.usable():
+            self.glyphs = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text):
+        line = self.lines.get(text)
+        if line is not None:
+            self.lines.move_to_end(text)
+            self.hits += 1
+            return line
+        self.misses += 1
+        if self.glyphs is not None:
+            line = self.glyphs.render(text)
+        else:
+            line = draw_line(self.font, text, self.height)
+        self.lines[text] = line
+        if len(self.lines) > self.size:
+            self.lines.popitem(last=False)
+        return line
+
+    def report(self):
+        return "line cache: {} hits, {} misses, {} lines, glyph table {}".format(
+            self.hits, self.misses, len(self.lines), "on" if self.glyphs is not None else "off")
+
+
+def paste(image, line, xy):
+    '''
+    Put a line on the image like draw.text does: only the pixels of the text
+    are set, so lines that overlap a little don't wipe each other out
+    '''
+    image.paste(255, (xy[0], xy[1], xy[0] + line.width, xy[1] + line.height), line)
+
+
+# --- benchmark ---------------------------------------------------------------
+
+def frames(n):
+    '''What the display shows over n seconds'''
+    for i in range(n):
+        yield ("   10,000,000.{:03d} Hz".format(i // 1000 % 1000),
+               "sats: 11  gate: 1Ks",
+               "min. left: {}".format(16 - i // 60 % 17))
+
+
+def benchmark(n=3600, font=None):
+    print("OLED text cache benchmark - Version {}".format(VERSION))
+    font = font or ImageFont.load_default()
+    image = Image.new('1', (128, 32))
+    draw = ImageDraw.Draw(image)
+    rows = (1, 12, 23)
+
+    start = time.perf_counter()
+    for lines in frames(n):
+        draw.rectangle((0, 0, 128, 32), outline=0, fill=0)
+        for row, text in zip(rows, lines):
+            draw.text((0, row), text, font=font, fill=255)
+    before = time.perf_counter() - start
+    expected = image.tobytes()
+
+    cache = LineCache(font)
+    start = time.perf_counter()
+    for lines in frames(n):
+        draw.rectangle((0, 0, 128, 32), outline=0, fill=0)
+        for row, text in zip(rows, lines):
+            paste(image, cache.get(text), (0, row))
+    after = time.perf_counter() - start
+
+    same = image.tobytes() == expected
+    print("draw.text : {:.1f} us/frame".format(1e6 * before / n))
+    print("cached    : {:.1f} us/frame".format(1e6 * after / n))
+    print(cache.report())
+    print("last frame {}".format("identical" if same else "DIFFERS"))
+    return 0 if same else 1
+
+
+if __name__ == '__main__':
+    sys.exit(benchmark())
@@ -0,0 +1,90 @@
+#!/usr/bin/python3.7
+#-------------------------------------------------------------------------------
+# Name:        poll_scheduler.py
+# Purpose:     Work out how long a pigpio bb_serial_read loop can sleep
+#              between reads, so we don't hammer pigpiod with thousands of
+#              socket round-trips per second while nothing is coming in.
+#              Used by serial_bb_gps.py and serial_bb_counter.py
+#
+# Author:      paulv
+#
+# Created:     18-10-2026
+# Copyright:   (c) paulv 2018 2019 2020
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+
+import time
+
+VERSION = "1.0"
+
+# pigpio keeps the bit-banged bytes in a cyclic buffer of this size. If we
+# don't read it in time, the oldest data gets overwritten.
+BB_BUFFER_SIZE = 8192
+
+
+class PollScheduler(object):
+    '''
+    Size the sleep between two bb_serial_read calls.
+
+    The longest sleep is limited by the time it takes to fill a part of the
+    pigpio buffer at this baud rate, by the expected message interval and by
+    the latency we accept. When a poll returns nothing the sleep doubles up
+    to that limit, when data comes in or a sentence is still being received
+    we go back to polling about once per sentence length.
+
+    '''
+    def __init__(self, baud, msg_interval, buffer_size=BB_BUFFER_SIZE,
+                 frame_len=82, max_latency=1.0, safety=0.25, report_interval=0):
+        """Needs the baud rate and the expected time between messages in seconds."""
+        self.char_time = 10.0 / baud    # 8 bits, a start and a stop bit
+        self.buffer_size = buffer_size
+        self.fill_time = buffer_size * self.char_time  # time before the buffer wraps
+        # the quickest we poll: about the time a complete sentence needs to come in
+        self.min_delay = max(frame_len * self.char_time, 0.005)
+        # the slowest we poll: well within the buffer fill time and the message interval
+        self.max_delay = max(min(self.fill_time * safety, msg_interval / 4.0, max_latency),
+                             self.min_delay)
+        self.report_interval = report_interval
+        self.delay = self.min_delay
+        self.reset()
+
+    def reset(self):
+        self.start = time.monotonic()
+        self.polls = 0          # total number of bb_serial_read calls
+        self.idle_polls = 0     # calls that returned nothing
+        self.max_backlog = 0    # largest number of bytes returned by a single read
+        self.overruns = 0       # reads that returned a full buffer, data may be lost
+
+    def update(self, b_count, in_frame=False):
+        '''
+        Record the result of a poll and return the time to sleep before the next one
+        '''
+        self.polls += 1
+        if b_count > 0:
+            if b_count > self.max_backlog:
+                self.max_backlog = b_count
+            if b_count >= self.buffer_size:
+                self.overruns += 1
+            self.delay = self.min_delay
+        elif in_frame:
+            # the rest of the sentence is on its way
+            self.delay = self.min_delay
+        else:
+            self.idle_polls += 1
+            self.delay = min(self.delay * 2, self.max_delay)
+        return self.delay
+
+    @property
+    def overrun_risk(self):
+        '''How full the pigpio buffer got at worst, 0.0 .. 1.0'''
+        return self.max_backlog / float(self.buffer_size)
+
+    def due(self):
+        return self.report_interval > 0 and time.monotonic() - self.start >= self.report_interval
+
+    def report(self):
+        elapsed = max(time.monotonic() - self.start, 1e-6)
+        return ("polls: {} ({:.2f}/s), {} idle, delay {:.3f}..{:.3f}s, max backlog {} bytes, "
+                "overrun risk {:.1%}, {} overruns".format(
+                self.polls, self.polls / elapsed, self.idle_polls, self.min_delay,
+                self.max_delay, self.max_backlog, self.overrun_risk, self.overruns))
@@ -0,0 +1,261 @@
+#!/usr/bin/python3.7
+#-------------------------------------------------------------------------------
+# Name:        raw_capture.py
+# Purpose:     Records the bytes of a serial port as they are read, before any
+#              framing or parsing, so a "no 3 segments" or a parse error in the
+#              log can be found back and played again (see replay.py).
+#              Every read is a record:
+#                  time.monotonic_ns()     8 bytes
+#                  time.time_ns()          8 bytes
+#                  number of bytes         4 bytes
+#                  the bytes
+#              The records are collected in a buffer and written every
+#              FLUSH_BYTES or FLUSH_INTERVAL seconds, gzip compressed with a
+#              sync flush, into a file per day and per start of the monitor
+#              on the RAM disk, so a crash never leaves a file that is appended to:
+#                  /mnt/ramdisk/raw/counter.2026-10-17.081530.raw.gz
+#              Only the files of the last KEEP_DAYS days are kept.
+#              Used by ser_mon_gpsdo.py, serial_bb_gps.py and serial_bb_counter.py
+#
+#              python3 raw_capture.py dump /mnt/ramdisk/raw/counter.2026-10-17.081530.raw.gz
+#              python3 raw_capture.py --bench
+#
+# Author:      paulv
+#
+# Created:     18-10-2026
+# Copyright:   (c) paulv 2018 2019 2020
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+
+import os
+import struct
+import sys
+import time
+import zlib
+
+import compressed_log
+
+VERSION = "1.1"     # a new file for every start of the monitor
+
+RAW_DIR = "/mnt/ramdisk/raw"
+FLUSH_BYTES = 64 * 1024     # buffer size before it is written
+FLUSH_INTERVAL = 10         # seconds, written at the latest after this time
+KEEP_DAYS = 3               # days of raw files to keep on the RAM disk
+LEVEL = 1                   # zlib level, the fastest one already gives most of it
+
+MAGIC = b"GPSDORAW"
+HEADER = struct.Struct("<8sH32sI")     # magic, version, source, baud rate
+RECORD = struct.Struct("<qqI")         # monotonic ns, wall clock ns, bytes
+
+
+class RawRecorder(object):
+    '''
+    Writes the reads of a port to a new raw file, at the start and at
+    midnight. record() only adds to a buffer, the compression and the write
+    happen at a flush.
+
+    '''
+    def __init__(self, source, baud=0, directory=RAW_DIR, compress=True):
+        """Needs the name of the port (counter, gps, gpsdo) and its baud rate."""
+        self.source = source
+        self.baud = baud
+        self.directory = directory
+        self.compress = compress
+        self.buffer = bytearray()
+        self.file = None
+        self.filename = None    # the file that is written now
+        self.compressor = None
+        self.rollover = 0       # time_ns of the next midnight
+        self.next_flush = 0     # monotonic_ns of the next flush
+        self.records = 0
+        self.bytes = 0          # bytes of the port
+        self.written = 0        # bytes in the files
+        os.makedirs(directory, exist_ok=True)
+
+    def record(self, data, mono=None, wall=None):
+        mono = time.monotonic_ns() if mono is None else mono
+        wall = time.time_ns() if wall is None else wall
+        if wall >= self.rollover:
+            self.open(wall)
+        self.buffer += RECORD.pack(mono, wall, len(data))
+        self.buffer += data
+        self.records += 1
+        self.bytes += len(data)
+        if len(self.buffer) >= FLUSH_BYTES or mono >= self.next_flush:
+            self.flush(mono)
+
+    def path(self, started, n=0):
+        '''The file that is started at started (the local time), n when that one is taken'''
+        return os.path.join(self.directory, "{}.{}{}.raw{}".format(
+            self.source, time.strftime("%Y-%m-%d.%H%M%S", started),
+            "-{}".format(n) if n else "", ".gz" if self.compress else ""))
+
+    def open(self, wall):
+        '''Start a new file at wall, the buffer goes into the old one'''
+        self.close()
+        local = time.localtime(wall / 1e9)
+        midnight = time.mktime((local.tm_year, local.tm_mon, local.tm_mday + 1, 0, 0, 0, 0, 0, -1))
+        self.rollover = int(midnight * 1e9)
+        n = 0
+        while self.file is None:
+            # never append, a file of a crash can end in the middle of a gzip member
+            try:
+                self.filename = self.path(local, n)
+                self.file = open(self.filename, "xb")
+            except FileExistsError:
+                n += 1
+        if self.compress:
+            self.compressor = zlib.compressobj(LEVEL, zlib.DEFLATED, 31)
+        source = self.source.encode("ascii", "replace")[:32]
+        self.write(HEADER.pack(MAGIC, 1, source, self.baud))
+        self.prune()
+
+    def write(self, data):
+        if self.compressor is not None:
+            data = self.compressor.compress(bytes(data)) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.file.write(data)
+        self.file.flush()
+        self.written += len(data)
+
+    def flush(self, mono=None):
+        if self.buffer and self.file is not None:
+            self.write(self.buffer)
+            del self.buffer[:]
+        self.next_flush = (time.monotonic_ns() if mono is None else mono) + FLUSH_INTERVAL * 10**9
+
+    def close(self):
+        if self.file is not None:
+            self.flush()
+            if self.compressor is not None:
+                self.file.write(self.compressor.flush(zlib.Z_FINISH))
+                self.compressor = None
+            self.file.close()
+            self.file = None
+
+    def prune(self):
+        '''Remove the files of this source of the days before the last KEEP_DAYS'''
+        prefix = self.source + "."
+        names = [e for e in os.listdir(self.directory)
+                 if e.startswith(prefix) and ".raw" in e]
+        days = sorted(set(name[len(prefix):len(prefix) + 10] for name in names))
+        old = set(days[:-KEEP_DAYS])
+        for name in names:
+            if name[len(prefix):len(prefix) + 10] in old:
+                os.remove(os.path.join(self.directory, name))
+
+    def report(self):
+        return "raw capture {}: {} reads, {} bytes, {} bytes written".format(
+            self.source, self.records, self.bytes, self.written)
+
+
+def read_records(path):
+    '''
+    Yields (monotonic ns, wall clock ns, bytes) of a raw file. A file that
+    was cut off in a crash ends at its last complete record.
+    '''
+    data = compressed_log.read_log(path)
+    pos = 0
+    while pos < len(data):
+        if data[pos:pos + len(MAGIC)] == MAGIC:
+            # the start of a file, version 1.0 appended a new one at every
+            # restart of the monitor to the file of the day
+            pos += HEADER.size
+            continue
+        if pos + RECORD.size > len(data):
+            break
+        mono, wall, length = RECORD.unpack_from(data, pos)
+        pos += RECORD.size
+        if pos + length > len(data):
+            break
+        yield mono, wall, data[pos:pos + length]
+        pos += length
+
+
+def read_header(path):
+    '''(source, baud rate) of a raw file'''
+    data = compressed_log.read_log(path)[:HEADER.size]
+    magic, version, source, baud = HEADER.unpack(data)
+    if magic != MAGIC:
+        raise ValueError("{} is not a raw capture".format(path))
+    return source.rstrip(b"\0").decode("ascii", "replace"), baud
+
+
+def dump(path):
+    source, baud = read_header(path)
+    print("{}: {} at {} baud".format(path, source, baud))
+    previous = None
+    for mono, wall, data in read_records(path):
+        delta = (mono - previous) / 1e6 if previous is not None else 0.0
+        previous = mono
+        stamp = time.strftime("%H:%M:%S", time.localtime(wall / 1e9))
+        print("{}.{:06d} +{:9.3f}ms {:4d} {!r}".format(
+            stamp, wall // 1000 % 1000000, delta, len(data), bytes(data)))
+
+
+# --- benchmark ---------------------------------------------------------------
+
+def bench(seconds=3600):
+    '''
+    The cpu time of recording an hour of the GPS at 9600 baud, about 10 reads
+    a second of 50 bytes, and the files of a crash and a restart
+    '''
+    import shutil
+    import tempfile
+
+    print("Raw capture benchmark - Version {}".format(VERSION))
+    chunk = b"$GPGGA,123519,4807.038,N,01131.000,E,1,08,0.9,545.4,M,46.9,M,,*47\r\n"[:50]
+    reads = seconds * 10
+    directory = tempfile.mkdtemp()
+    try:
+        for compress in (False, True):
+            recorder = RawRecorder("bench", 9600, directory, compress)
+            start = time.process_time()
+            for i in range(reads):
+                recorder.record(chunk)
+            recorder.close()
+            cpu = time.process_time() - start
+            print("{:5s}: {:.2f} us/read, {:.3f}s cpu per hour at 9600 baud ({:.4f}%), {} bytes into {}".format(
+                "gzip" if compress else "plain", 1e6 * cpu / reads, cpu * 3600.0 / seconds,
+                100.0 * cpu / seconds, recorder.bytes, recorder.written))
+            records = sum(1 for r in read_records(recorder.filename))
+            if records != reads:
+                print("read back {} records of {}".format(records, reads))
+                return 1
+            for entry in os.listdir(directory):
+                os.remove(os.path.join(directory, entry))
+
+            # a crash: the last records are not flushed, the file is not ended
+            recorder = RawRecorder("bench", 9600, directory, compress)
+            for i in range(1000):
+                recorder.record(chunk)
+            recorder.flush()
+            for i in range(100):
+                recorder.record(chunk)
+            recorder.file.close()
+            recorder = RawRecorder("bench", 9600, directory, compress)
+            for i in range(1000):
+                recorder.record(chunk)
+            recorder.close()
+            files = sorted(os.listdir(directory))
+            records = [sum(1 for r in read_records(os.path.join(directory, name))) for name in files]
+            if records != [1000, 1000] or any(read_header(os.path.join(directory, name)) != ("bench", 9600)
+                                              for name in files):
+                print("after a restart: {} records in {}".format(records, files))
+                return 1
+            for entry in files:
+                os.remove(os.path.join(directory, entry))
+    finally:
+        shutil.rmtree(directory)
+    return 0
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args and args[0] == "--bench":
+        sys.exit(bench(*[int(a) for a in args[1:2]]))
+    elif len(args) == 2 and args[0] == "dump":
+        dump(args[1])
+    else:
+        print("usage: python3 raw_capture.py dump <raw file>")
+        print("       python3 raw_capture.py --bench [seconds]")
+        sys.exit(1)
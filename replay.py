@@ -0,0 +1,737 @@
+#!/usr/bin/python3.7
+#-------------------------------------------------------------------------------
+# Name:        replay.py
+# Purpose:     Runs the monitors on a plain Linux box, without the Pi, the
+#              pigpio daemon, the serial port or the OLED display.
+#              Stand-ins for pigpio, pyserial and Adafruit_SSD1306 are put in
+#              sys.modules before a monitor is imported. They play a byte
+#              stream that comes from a raw capture (raw_capture.py) or is
+#              made up here, cut in chunks like the reads on the Pi, with
+#              noise (bit errors) and overruns (lost chunks) when asked for.
+#              The stream is played as fast as the monitor takes it, or at
+#              the pace it was received (times a speed factor).
+#              The monitor runs its own loop: poll() for the bit-bang ones,
+#              event_driven_reader() or polling_reader() for ser_mon_gpsdo,
+#              until the stream is done. Its log and json files go to a
+#              temporary directory.
+#
+#              python3 replay.py counter|gps|gpsdo [options]
+#              python3 replay.py gps --file /mnt/ramdisk/raw/gps.2026-10-17.081530.raw.gz --realtime
+#              python3 replay.py oled [--n frames]
+#              python3 replay.py --selftest
+#
+# Author:      paulv
+#
+# Created:     18-10-2026
+# Copyright:   (c) paulv 2018 2019 2020
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+
+import argparse
+import contextlib
+import fcntl
+import importlib
+import json
+import logging
+import math
+import os
+import random
+import resource
+import shutil
+import struct
+import sys
+import tempfile
+import termios
+import threading
+import time
+import types
+
+import compressed_log
+import hotpath_stats
+import raw_capture
+import sentence_framer
+import ssd1306_diff
+
+VERSION = "1.0"
+
+BB_BUFFER_SIZE = 8192   # bytes pigpio keeps for a bit-bang port
+
+# the gpio ports and baud rates of the monitors
+SOURCES = {
+    "counter": ("serial_bb_counter", 23, 9600),
+    "gps": ("serial_bb_gps", 24, 9600),
+    "gpsdo": ("ser_mon_gpsdo", None, 9600),
+}
+
+
+class ReplayDone(Exception):
+    '''Raised by a stand-in when the stream has been played'''
+
+
+# --- the byte streams --------------------------------------------------------
+
+def counter_lines(n, rate=1.0, seed=1):
+    '''n readings of the counter, rate readings per second'''
+    rng = random.Random(seed)
+    return [(i / rate, "Gate 1000s,S={},{:011.3f} Hz\r\n".format(
+        rng.randint(7, 12), 10e6 + rng.gauss(0, 0.002)).encode("ascii")) for i in range(n)]
+
+
+def gps_lines(n, rate=1.0, seed=1):
+    '''n fixes of a NEO, a burst of NMEA sentences per fix'''
+    rate = max(int(rate), 1)
+    sentences = sentence_framer.synthetic_nmea(int(math.ceil(n / float(rate))), rate)
+    per_fix = len(sentences) // (int(math.ceil(n / float(rate))) * rate)
+    return [(i / float(rate), "".join(sentences[i * per_fix:(i + 1) * per_fix]).encode("ascii"))
+            for i in range(n)]
+
+
+def gpsdo_lines(n, rate=1.0, seed=1):
+    '''n reports of the Nano: seconds, tic, dac, temperature, status'''
+    rng = random.Random(seed)
+    return [(i / rate, "{} {} {} {:.2f} {}\r\n".format(
+        i, 500 + rng.randint(-20, 20), 32000 + i // 600, 25 + rng.random(), 1).encode("ascii"))
+        for i in range(n)]
+
+
+LINES = {"counter": counter_lines, "gps": gps_lines, "gpsdo": gpsdo_lines}
+
+
+def timeline(lines, baud, chunk=None):
+    '''
+    The (arrival time in ns, bytes) of the chunks of the lines. A byte takes
+    10 bits on the line, a line that is not done before the next one starts
+    delays that one. chunk cuts the lines in chunks of that many bytes.
+    '''
+    char_ns = 10 * 10**9 // baud
+    end = 0
+    events = []
+    for t, data in lines:
+        start = max(int(t * 1e9), end)
+        step = chunk or len(data)
+        for pos in range(0, len(data), step):
+            part = data[pos:pos + step]
+            start += len(part) * char_ns
+            events.append((start, part))
+        end = start
+    return events
+
+
+def arrivals(lines, baud, chunk=None, marker=b""):
+    '''
+    The arrival time in ns of the chunk that ends the sentence with marker in
+    every line, the first sentence for no marker. The same times as timeline().
+    '''
+    char_ns = 10 * 10**9 // baud
+    end = 0
+    marks = []
+    for t, data in lines:
+        start = max(int(t * 1e9), end)
+        end = start + len(data) * char_ns
+        pos = data.find(b"\n", max(data.find(marker), 0)) + 1 or len(data)
+        step = chunk or len(data)
+        marks.append(start + min(-(-pos // step) * step, len(data)) * char_ns)
+    return marks
+
+
+def recorded(path):
+    '''The (time in ns from the first read, bytes) of a raw capture'''
+    events = []
+    first = None
+    for mono, wall, data in raw_capture.read_records(path):
+        first = mono if first is None else first
+        events.append((mono - first, bytes(data)))
+    return events
+
+
+def rechunk(events, chunk):
+    '''Cut the chunks of a recording into smaller ones, at the same time'''
+    if not chunk:
+        return events
+    return [(t, data[pos:pos + chunk]) for t, data in events for pos in range(0, len(data), chunk)]
+
+
+def disturb(events, noise=0.0, overrun=0.0, seed=2):
+    '''
+    A bit error in a byte with probability noise, a lost chunk with
+    probability overrun. Returns (events, bit errors, lost chunks).
+    '''
+    rng = random.Random(seed)
+    errors = lost = 0
+    out = []
+    # the distance to the next bit error, so we don't draw a number for every byte
+    gap = lambda: int(math.log(1.0 - rng.random()) / math.log(1.0 - noise)) if noise > 0 else -1
+    next_error = gap()
+    for t, data in events:
+        if overrun > 0 and rng.random() < overrun:
+            lost += 1
+            next_error = max(next_error - len(data), 0) if next_error >= 0 else -1
+            continue
+        if 0 <= next_error < len(data):
+            data = bytearray(data)
+            while 0 <= next_error < len(data):
+                data[next_error] ^= 1 << rng.randint(0, 7)
+                errors += 1
+                next_error += 1 + gap()
+            data = bytes(data)
+        if next_error >= 0:
+            next_error -= len(data)
+        out.append((t, data))
+    return out, errors, lost
+
+
+class Player(object):
+    '''
+    Hands out the chunks, the next one for every read as fast as they are
+    taken, or the ones that arrived by now at the real-time pace.
+
+    '''
+    def __init__(self, events, realtime=False, speed=1.0):
+        """Needs the (time ns, bytes) chunks, real-time or not and the speed factor."""
+        self.events = events
+        self.realtime = realtime
+        self.speed = speed
+        self.pos = 0
+        self.start = None
+        self.reads = 0
+        self.bytes = 0
+        self.overruns = 0
+
+    @property
+    def done(self):
+        return self.pos >= len(self.events)
+
+    def now(self):
+        if self.start is None:
+            self.start = time.monotonic_ns()
+        return (time.monotonic_ns() - self.start) * self.speed
+
+    def due(self, i):
+        '''The monotonic_ns time chunk i arrives'''
+        self.now()
+        return self.start + self.events[i][0] / self.speed
+
+    def read(self, limit=None):
+        '''The bytes that came in since the last read, at most limit bytes'''
+        if self.done:
+            raise ReplayDone()
+        self.reads += 1
+        if not self.realtime:
+            data = self.events[self.pos][1]
+            self.pos += 1
+        else:
+            now = self.now()
+            parts = []
+            while self.pos < len(self.events) and self.events[self.pos][0] <= now:
+                parts.append(self.events[self.pos][1])
+                self.pos += 1
+            data = b"".join(parts)
+            if limit is not None and len(data) > limit:
+                # the oldest bytes were overwritten, like the pigpio buffer does
+                self.overruns += 1
+                data = data[-limit:]
+        self.bytes += len(data)
+        return data
+
+
+# --- the stand-ins -----------------------------------------------------------
+
+players = {}    # the player of a gpio port, None for the serial port
+
+
+def player_for(port):
+    return players.get(port) or next(iter(players.values()))
+
+
+class FakePi(object):
+    '''pigpio.pi() with the bit-bang read of a port from its player'''
+    connected = True
+
+    def set_mode(self, gpio, mode):
+        pass
+
+    def write(self, gpio, level):
+        pass
+
+    def read(self, gpio):
+        return 1
+
+    def bb_serial_read_open(self, gpio, baud, bits=8):
+        return 0
+
+    def bb_serial_read_close(self, gpio):
+        return 0
+
+    def bb_serial_read(self, gpio):
+        data = player_for(gpio).read(BB_BUFFER_SIZE)
+        return len(data), bytearray(data)
+
+    def stop(self):
+        pass
+
+
+class FakeSerial(object):
+    '''
+    serial.Serial on a pipe that a thread fills from the player, so select()
+    on fileno() works like it does on the UART
+
+    '''
+    def __init__(self, port=None, baudrate=9600, timeout=None, **kwargs):
+        """Needs nothing, takes the arguments of serial.Serial."""
+        self.player = player_for(None)
+        self.rfd, self.wfd = os.pipe()
+        self.feeding = True
+        self.pending = b""
+        self.thread = threading.Thread(target=self.feed, daemon=True)
+        self.thread.start()
+
+    def feed(self):
+        player = self.player
+        try:
+            while not player.done:
+                if player.realtime:
+                    wait = (player.due(player.pos) - time.monotonic_ns()) / 1e9
+                    if wait > 0:
+                        time.sleep(wait)
+                os.write(self.wfd, player.read())
+        except (ReplayDone, OSError):
+            pass
+        finally:
+            self.feeding = False
+            os.close(self.wfd)
+
+    def fileno(self):
+        return self.rfd
+
+    @property
+    def in_waiting(self):
+        n = struct.unpack("i", fcntl.ioctl(self.rfd, termios.FIONREAD, b"\0\0\0\0"))[0]
+        n += len(self.pending)
+        if n == 0 and not self.feeding:
+            raise ReplayDone()
+        return n
+
+    def inWaiting(self):
+        return self.in_waiting
+
+    def read(self, size=1):
+        if self.pending:
+            data, self.pending = self.pending[:size], self.pending[size:]
+            return data
+        data = os.read(self.rfd, size)
+        if not data:
+            raise ReplayDone()
+        return data
+
+    def readline(self):
+        while b"\n" not in self.pending:
+            data = os.read(self.rfd, 4096)
+            if not data:
+                if self.pending:
+                    break
+                raise ReplayDone()
+            self.pending += data
+        end = self.pending.find(b"\n") + 1 or len(self.pending)
+        line, self.pending = self.pending[:end], self.pending[end:]
+        return line
+
+    def close(self):
+        os.close(self.rfd)
+
+
+class FakeSSD1306(ssd1306_diff.FakeDisplay):
+    '''Adafruit_SSD1306.SSD1306_128_32 with the display memory in FakeI2C'''
+    def __init__(self, rst=None, **kwargs):
+        ssd1306_diff.FakeDisplay.__init__(self, 128, 32)
+        self.buffer = bytearray(128 * 4)
+        self.full_updates = 0
+
+    def begin(self):
+        pass
+
+    def clear(self):
+        self.buffer = bytearray(len(self.buffer))
+
+    def image(self, image):
+        self.buffer = bytearray(ssd1306_diff.framebuffer(image, self.height // 8))
+
+    def display(self):
+        self.full_updates += 1
+        for c in (ssd1306_diff.SSD1306_COLUMNADDR, 0, self.width - 1,
+                  ssd1306_diff.SSD1306_PAGEADDR, 0, self.height // 8 - 1):
+            self.command(c)
+        for pos in range(0, len(self.buffer), 16):
+            self._i2c.writeList(0x40, self.buffer[pos:pos + 16])
+
+
+def install():
+    '''Put the stand-ins in sys.modules, before the monitors are imported'''
+    pigpio = types.ModuleType("pigpio")
+    pigpio.pi = FakePi
+    pigpio.INPUT = 0
+    pigpio.OUTPUT = 1
+    pigpio.exceptions = True
+    serial = types.ModuleType("serial")
+    serial.Serial = FakeSerial
+    serial.serialutil = types.ModuleType("serial.serialutil")
+    serial.serialutil.SerialException = type("SerialException", (IOError,), {})
+    serial.SerialException = serial.serialutil.SerialException
+    adafruit = types.ModuleType("Adafruit_SSD1306")
+    adafruit.SSD1306_128_32 = FakeSSD1306
+    sys.modules.update({"pigpio": pigpio, "serial": serial,
+                        "serial.serialutil": serial.serialutil, "Adafruit_SSD1306": adafruit})
+
+
+def load(name, directory):
+    '''
+    Import a monitor with the stand-ins, its files go into directory and it
+    stays out of the shared memory of the real monitors
+    '''
+    install()
+    mod = sys.modules.get(name)
+    mod = importlib.reload(mod) if mod is not None else importlib.import_module(name)
+    mod.DAEMON = False
+    mod.DEBUG = False
+    base = os.path.basename(getattr(mod, "LOG_FILENAME", name + ".log"))
+    mod.LOG_FILENAME = mod.log_path = os.path.join(directory, base)
+    if hasattr(mod, "display_path"):
+        mod.display_path = os.path.join(directory, os.path.basename(mod.display_path))
+    if hasattr(mod, "publish_state"):
+        mod.state = False   # False is no shared memory to the monitors
+    if hasattr(mod, "init"):
+        mod.init()
+    return mod
+
+
+def close(mod):
+    if hasattr(mod, "handler"):
+        mod.logger.removeHandler(mod.handler)
+        mod.handler.close()
+
+
+# --- running a monitor -------------------------------------------------------
+
+def run_bit_bang(mod, player):
+    '''The main loop of serial_bb_counter and serial_bb_gps'''
+    if hasattr(mod, "reset_counter"):
+        mod.reset_counter = lambda: None    # no counter to reset, and no 5.5s wait
+    mod.init_pigpio()
+    sleeps = 0.0
+    try:
+        mod.setup()
+        while True:
+            delay = mod.poll()
+            if player.realtime:
+                time.sleep(delay / player.speed)
+            sleeps += delay
+    except ReplayDone:
+        pass
+    finally:
+        if hasattr(mod, "close_capture"):
+            mod.close_capture()
+    return {"polls": mod.scheduler.polls, "idle_polls": mod.scheduler.idle_polls,
+            "sleep": sleeps}
+
+
+def run_gpsdo(mod, player):
+    '''The reader loop of ser_mon_gpsdo'''
+    if not player.realtime:
+        mod.COALESCE_CHARS = 0  # nothing to wait for
+    mod.open_port()
+    mod.open_capture()
+    try:
+        if mod.EVENT_DRIVEN:
+            mod.event_driven_reader()
+        else:
+            mod.polling_reader()
+    except ReplayDone:
+        pass
+    finally:
+        mod.close_capture()
+    return {"wakeups": mod.stats.wakeups, "reports": mod.stats.reports,
+            "rejected": mod.stats.rejected}
+
+
+def log_lines(directory):
+    '''The lines the monitor wrote to its log'''
+    count = 0
+    for entry in os.listdir(directory):
+        if ".log" in entry:
+            count += len(compressed_log.read_log(os.path.join(directory, entry)).splitlines())
+    return count
+
+
+def outputs(source, mod, runs=1):
+    '''The readings, fixes or reports that made it through the monitor, over all runs'''
+    if source == "gpsdo":
+        return mod.stats.reports
+    path = compressed_log.log_path(mod.LOG_FILENAME)
+    data = compressed_log.read_log(path) if path else b""
+    if source == "counter":
+        # less the one setup() writes for the display
+        return max(data.count(b"\tcounter\t") - runs, 0)
+    return data.count(b"Satellites:")
+
+
+def replay(source, events, realtime=False, speed=1.0, directory=None, setup=None, restarts=0):
+    '''
+    Play the events into a monitor, returns a dict with what happened.
+    setup(mod) can change the settings of the monitor before it runs.
+    restarts plays them again that many times into the same module, like
+    the supervisor restarts a task that failed.
+    '''
+    name, port, baud = SOURCES[source]
+    own = directory is None
+    directory = directory or tempfile.mkdtemp()
+    player = Player(events, realtime, speed)
+    players.clear()
+    players[port] = player
+    try:
+        mod = load(name, directory)
+        if setup is not None:
+            setup(mod)
+        out = mod.MyLogger(mod.logger, logging.INFO)
+        err = mod.MyLogger(mod.logger, logging.ERROR)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            for run in range(restarts + 1):
+                if run:
+                    player = Player(events, realtime, speed)
+                    players[port] = player
+                if source == "gpsdo":
+                    result = run_gpsdo(mod, player)
+                else:
+                    result = run_bit_bang(mod, player)
+        result["cpu"] = time.process_time() - cpu
+        result["seconds"] = time.perf_counter() - wall
+        close(mod)
+        result.update({"source": source, "chunks": len(events), "reads": player.reads,
+                       "bytes": player.bytes, "overruns": player.overruns,
+                       "log_lines": log_lines(directory), "outputs": outputs(source, mod, restarts + 1),
+                       "start": player.start, "module": mod})
+        return result
+    finally:
+        if own:
+            shutil.rmtree(directory)
+
+
+def replay_oled(frames=600, partial=True):
+    '''Render frames of the display on the FakeSSD1306, returns a dict'''
+    import oled_text
+    directory = tempfile.mkdtemp()
+    try:
+        mod = load("oled_driver", directory)
+        mod.PARTIAL_UPDATE = partial
+        mod.init_display()
+        times = []
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        for lines in oled_text.frames(frames):
+            start = time.perf_counter()
+            mod.show(lines)
+            times.append(time.perf_counter() - start)
+        result = {"source": "oled", "frames": frames, "cpu": time.process_time() - cpu,
+                  "seconds": time.perf_counter() - wall, "frame_times": times, "module": mod,
+                  "i2c_bytes": mod.differ.bytes_sent if mod.differ is not None else
+                  mod.disp.full_updates * 512}
+        return result
+    finally:
+        shutil.rmtree(directory)
+
+
+def replay_oled_paced(frames, rate, partial=True):
+    '''
+    The loop of the oled driver on the FakeSSD1306, woken up by its inotify
+    watcher, while a thread replaces the counter json file rate times per
+    second with a new reading. Returns a dict with the wake-ups of the loop,
+    its cpu time and the time from every json file to its frame.
+    '''
+    import json
+    directory = tempfile.mkdtemp()
+    try:
+        mod = load("oled_driver", directory)
+        mod.PARTIAL_UPDATE = partial
+        mod.data_dir = directory
+        mod.neo_data_path = os.path.join(directory, "nmea.json")
+        mod.counter_data_path = os.path.join(directory, "counter.json")
+        mod.notify_path = os.path.join(directory, "state.notify")
+        mod.read_state = lambda: None   # stay out of the shared memory of the real monitors
+
+        def write(path, data):
+            with open(path + ".tmp", "w") as f:
+                json.dump(data, f)
+            os.replace(path + ".tmp", path)
+
+        tstamp = int(time.time() / 60)
+        write(mod.neo_data_path, {"sat_nbr": 9})
+        write(mod.counter_data_path, {"counter": 10e6, "gate": "1000s", "tstamp": tstamp})
+        mod.init_display()
+        watcher = mod.open_watcher()
+        written = []
+
+        def produce():
+            start = time.monotonic()
+            for i in range(1, frames + 1):
+                time.sleep(max(start + i / float(rate) - time.monotonic(), 0))
+                written.append(time.monotonic_ns())
+                write(mod.counter_data_path, {"counter": 10e6 + i, "gate": "1000s", "tstamp": tstamp})
+
+        producer = threading.Thread(target=produce, daemon=True)
+        end = time.monotonic() + frames / float(rate) + 1.0
+        shown = {}      # reading -> monotonic ns it was on the display
+        wakeups = 0
+        # the cpu and the context switches of the loop only, not of the producer
+        switches = resource.getrusage(resource.RUSAGE_THREAD)
+        cpu = time.thread_time()
+        wall = time.perf_counter()
+        producer.start()
+        while time.monotonic() < end:
+            if mod.refresh():
+                reading = int(round(float(mod.last_lines[0].split()[0].replace(",", "")) - 10e6))
+                shown.setdefault(reading, time.monotonic_ns())
+            if len(shown) > frames:     # the first one and all the frames
+                break
+            if watcher is not None:
+                watcher.wait(min(mod.next_tick(), max(end - time.monotonic(), 0)))
+            else:
+                time.sleep(1)
+            wakeups += 1
+        cpu = time.thread_time() - cpu
+        seconds = time.perf_counter() - wall
+        usage = resource.getrusage(resource.RUSAGE_THREAD)
+        producer.join()
+        if watcher is not None:
+            watcher.close()
+        # every frame with the json file of its reading
+        latency = [shown[i] - written[i - 1] for i in sorted(shown) if 0 < i <= len(written)]
+        return {"source": "oled", "frames": frames, "shown": len(latency), "wakeups": wakeups,
+                "cpu": cpu, "seconds": seconds, "latency_ns": latency, "module": mod,
+                "voluntary_switches": usage.ru_nvcsw - switches.ru_nvcsw,
+                "involuntary_switches": usage.ru_nivcsw - switches.ru_nivcsw,
+                "i2c_bytes": mod.differ.bytes_sent if mod.differ is not None else
+                mod.disp.full_updates * 512}
+    finally:
+        shutil.rmtree(directory)
+
+
+def report(result):
+    return ", ".join("{} {}".format(k, "{:.3f}".format(v) if isinstance(v, float) else v)
+                     for k, v in sorted(result.items()) if k not in ("module", "frame_times", "latency_ns"))
+
+
+# --- self test ---------------------------------------------------------------
+
+def selftest():
+    '''
+    Every monitor gets a clean stream, a stream in small chunks and one with
+    noise and overruns. The clean ones must give every line, the others must
+    not crash and lose about what was disturbed.
+    '''
+    print("Replay self test - Version {}".format(VERSION))
+    errors = 0
+    n = {"counter": 200, "gps": 300, "gpsdo": 2000}
+    for source in ("counter", "gps", "gpsdo"):
+        lines = LINES[source](n[source])
+        for chunk, noise, overrun in ((None, 0, 0), (7, 0, 0), (16, 1e-3, 0.01)):
+            events, bit_errors, lost = disturb(timeline(lines, SOURCES[source][2], chunk),
+                                               noise, overrun)
+            try:
+                result = replay(source, events)
+            except ImportError as e:    # like pytz for the gps monitor
+                print("{}: skipped, {}".format(source, e))
+                break
+            got = result["outputs"]
+            ok = got == n[source] if not noise and not overrun else got <= n[source]
+            errors += not ok
+            print("{:7s} chunk {:>4} noise {} overrun {}: {} of {} lines, {} bit errors, {} lost chunks, "
+                  "{:.2f}s {}".format(source, chunk or "line", noise, overrun, got, n[source],
+                                       bit_errors, lost, result["seconds"], "ok" if ok else "WRONG"))
+
+    # a restart of the task in the supervisor: setup() again on the same
+    # module, every line must still come out once per run
+    for source in ("counter", "gps", "gpsdo"):
+        lines = LINES[source](50)
+        try:
+            result = replay(source, timeline(lines, SOURCES[source][2], 16), restarts=2)
+        except ImportError as e:
+            print("{} restart: skipped, {}".format(source, e))
+            continue
+        ok = result["outputs"] == 150
+        errors += not ok
+        print("{:7s} restarted twice: {} of 150 lines {}".format(source, result["outputs"],
+                                                                "ok" if ok else "WRONG"))
+
+    # the hot path stats of the counter over a restart, every tenth line
+    # can't be parsed
+    lines = [(t, b"Gate 1000s,S=9 10000000.001 Hz\r\n" if i % 10 == 0 else data)
+             for i, (t, data) in enumerate(counter_lines(50))]
+    directory = tempfile.mkdtemp()
+    stats_dir = hotpath_stats.STATS_DIR
+
+    def with_hotpath(mod):
+        mod.HOTPATH_STATS = True
+        hotpath_stats.STATS_DIR = directory
+
+    try:
+        replay("counter", timeline(lines, 9600, 16), setup=with_hotpath, restarts=1)
+        with open(os.path.join(directory, "counter_stats.json")) as f:
+            counters = json.load(f)["counters"]
+    finally:
+        hotpath_stats.STATS_DIR = stats_dir
+        shutil.rmtree(directory)
+    ok = counters["parse_errors"] == 5 and counters["published"] == 45
+    errors += not ok
+    print("counter restarted with hot path stats: {} parse errors, {} published {}".format(
+        counters["parse_errors"], counters["published"], "ok" if ok else "WRONG"))
+
+    # real-time pace, sped up: the reads come in as they arrive
+    events = timeline(counter_lines(20, rate=100.0), 9600)
+    result = replay("counter", events, realtime=True, speed=1.0)
+    got = result["outputs"]
+    errors += got != 20
+    print("counter real-time: {} of 20 in {:.2f}s, {} polls".format(got, result["seconds"], result["polls"]))
+
+    result = replay_oled(300)
+    print("oled: {} frames, {:.0f} us/frame, {} bytes to the display".format(
+        result["frames"], 1e6 * result["seconds"] / result["frames"], result["i2c_bytes"]))
+    print("{} errors".format(errors))
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a byte stream into a monitor")
+    parser.add_argument("source", nargs="?", choices=sorted(SOURCES) + ["oled"])
+    parser.add_argument("--file", help="a raw capture of raw_capture.py")
+    parser.add_argument("--n", type=int, default=1000, help="lines to make up, or oled frames")
+    parser.add_argument("--rate", type=float, default=1.0, help="lines per second")
+    parser.add_argument("--baud", type=int, help="baud rate of the made up stream")
+    parser.add_argument("--chunk", type=int, help="bytes per read")
+    parser.add_argument("--noise", type=float, default=0.0, help="bit error rate per byte")
+    parser.add_argument("--overrun", type=float, default=0.0, help="chance to lose a read")
+    parser.add_argument("--realtime", action="store_true", help="at the pace it came in")
+    parser.add_argument("--speed", type=float, default=1.0, help="speed factor for --realtime")
+    parser.add_argument("--selftest", action="store_true")
+    args = parser.parse_args()
+
+    if args.selftest:
+        sys.exit(1 if selftest() else 0)
+    if args.source is None:
+        parser.error("which monitor?")
+    print("Replay - Version {}".format(VERSION))
+    if args.source == "oled":
+        print(report(replay_oled(args.n)))
+        return
+    if args.file:
+        events = rechunk(recorded(args.file), args.chunk)
+    else:
+        baud = args.baud or SOURCES[args.source][2]
+        events = timeline(LINES[args.source](args.n, args.rate), baud, args.chunk)
+    events, bit_errors, lost = disturb(events, args.noise, args.overrun)
+    result = replay(args.source, events, args.realtime, args.speed)
+    result.update({"bit_errors": bit_errors, "lost_chunks": lost})
+    print(report(result))
+
+
+if __name__ == '__main__':
+    main()
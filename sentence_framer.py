@@ -0,0 +1,158 @@
+#!/usr/bin/python3.7
+#-------------------------------------------------------------------------------
+# Name:        sentence_framer.py
+# Purpose:     Rebuild complete sentences from the small segments that
+#              pigpio's bb_serial_read returns.
+#              Used by serial_bb_gps.py and serial_bb_counter.py
+#
+#              Run it on its own to get a micro-benchmark:
+#              python3 sentence_framer.py
+#
+# Author:      paulv
+#
+# Created:     18-10-2026
+# Copyright:   (c) paulv 2018 2019 2020
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+
+import sys
+import time
+import random
+
+VERSION = "1.0"
+
+
+class SentenceFramer(object):
+    '''
+    Incremental framer working on raw bytes.
+
+    Feed it every chunk that comes in, and it returns the list of all the
+    sentences that were completed by that chunk. A sentence starts with the
+    bol (included) and ends just before the eol (not included).
+    Anything between an eol and the next bol (like the "\\n" of a "\\r\\n") is
+    skipped, and an unfinished sentence stays in the buffer until the rest
+    comes in.
+    If a new bol shows up before the eol, the sentence was cut short and
+    is discarded.
+
+    '''
+    def __init__(self, bol=b"$", eol=b"\r", max_len=256):
+        """Needs the beginning and end of line delimiters as bytes."""
+        self.bol = bytes(bol)
+        self.eol = bytes(eol)
+        self.max_len = max_len  # longest sentence we are willing to buffer
+        self.buf = bytearray()
+        self.frames = 0         # number of complete sentences
+        self.discarded = 0      # sentences that were cut short by a new bol
+        self.overflows = 0      # times the buffer was dropped for being too long
+
+    @property
+    def in_frame(self):
+        # after a feed, the buffer only holds the start of a new sentence
+        return len(self.buf) > 0
+
+    def reset(self):
+        del self.buf[:]
+
+    def feed(self, data):
+        buf = self.buf
+        bol = self.bol
+        eol = self.eol
+        buf += data
+
+        frames = []
+        pos = 0
+        while True:
+            start = buf.find(bol, pos)
+            if start < 0:
+                # no start of a sentence left, nothing worth keeping
+                pos = len(buf)
+                break
+            end = buf.find(eol, start + len(bol))
+            if end < 0:
+                # the rest of this sentence is still on its way
+                pos = start
+                break
+            # look for a bol in the middle, the part before it is a broken sentence
+            cut = buf.rfind(bol, start + len(bol), end)
+            if cut >= 0:
+                self.discarded += buf.count(bol, start + len(bol), cut) + 1
+                start = cut
+            frames.append(bytes(buf[start:end]))
+            pos = end + len(eol)
+
+        del buf[:pos]
+        if len(buf) > self.max_len:
+            self.overflows += 1
+            del buf[:]
+        self.frames += len(frames)
+        return frames
+
+
+# --- micro-benchmark ---------------------------------------------------------
+
+def nmea_checksum(body):
+    '''XOR of all the characters between the $ and the *'''
+    cs = 0
+    for c in body.encode("ascii"):
+        cs ^= c
+    return "${}*{:02X}\r\n".format(body, cs)
+
+
+def synthetic_nmea(seconds, rate=1):
+    '''
+    Create a NEO-style NMEA stream: a set of sentences per fix, rate fixes per second
+    '''
+    sentences = []
+    for n in range(seconds * rate):
+        secs = n / rate
+        t = "{:02d}{:02d}{:05.2f}".format(int(secs // 3600) % 24, int(secs // 60) % 60, secs % 60)
+        sentences.append(nmea_checksum("GPRMC,{},A,5222.12345,N,00454.54321,E,0.012,,181026,,,D".format(t)))
+        sentences.append(nmea_checksum("GPVTG,,T,,M,0.012,N,0.022,K,D"))
+        sentences.append(nmea_checksum("GPGGA,{},5222.12345,N,00454.54321,E,2,11,0.88,12.3,M,46.1,M,,0000".format(t)))
+        sentences.append(nmea_checksum("GPGSA,A,3,02,05,06,12,13,15,19,24,25,29,30,,1.52,0.88,1.24"))
+        for i in range(1, 4):
+            sentences.append(nmea_checksum("GPGSV,3,{},11,02,45,123,41,05,12,045,33,06,67,270,44,12,30,310,38".format(i)))
+        sentences.append(nmea_checksum("GPGLL,5222.12345,N,00454.54321,E,{},A,D".format(t)))
+    return sentences
+
+
+def benchmark(baud=115200, seconds=60):
+    '''
+    Push a synthetic burst through the framer in random sized chunks, like
+    bb_serial_read hands them to us, and count what comes out.
+    '''
+    rate = 10
+    sentences = synthetic_nmea(seconds, rate)
+    stream = b"garbage" + "".join(sentences).encode("ascii")
+    # the burst has to fit the baud rate, 10 bits per character
+    air_time = len(stream) * 10.0 / baud
+
+    rnd = random.Random(1)
+    chunks = []
+    pos = 0
+    while pos < len(stream):
+        n = rnd.randint(1, 128)
+        chunks.append(stream[pos:pos + n])
+        pos += n
+
+    framer = SentenceFramer(b"$", b"\r")
+    count = 0
+    start = time.perf_counter()
+    for chunk in chunks:
+        count += len(framer.feed(chunk))
+    elapsed = time.perf_counter() - start
+
+    expected = len(sentences)
+    print("Sentence framer benchmark - Version {}".format(VERSION))
+    print("stream: {} bytes, {} chunks, {:.1f}s of air time at {} baud".format(
+        len(stream), len(chunks), air_time, baud))
+    print("frames: {} expected, {} received, {} dropped, {} discarded".format(
+        expected, count, expected - count, framer.discarded))
+    print("speed : {:.0f} frames/s, {:.2f} us/frame, {:.1f}x faster than the line".format(
+        count / elapsed, 1e6 * elapsed / max(count, 1), air_time / elapsed))
+    return expected - count
+
+
+if __name__ == '__main__':
+    sys.exit(1 if benchmark() else 0)
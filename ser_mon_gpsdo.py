@@ -15,15 +15,26 @@
 import serial
 import logging
 import logging.handlers
+import compressed_log
 import sys
 import os
 import traceback
 import shlex
 import string
 import glob
+import select
+import signal
+import struct
+import time
+import agg_pyramid
+import columnar_capture
+import nano_report
+import raw_capture
+import hotpath_stats
+import shm_state
 
 
-VERSION = "2.2"     # add support for a RAM disk
+VERSION = "3.4"     # a capture that can not be written does not stop the monitor
 
 # To enable the serial port on the GPIO connector, use raspi-config or:
 # sudo nano /boot/config.txt
@@ -33,13 +44,64 @@ VERSION = "2.2"     # add support for a RAM disk
 DEBUG = True
 DAEMON = True   # if false, pipe the std out/error to the console
 
+# The event-driven reader blocks in select() until the Nano sends something,
+# instead of spinning on inWaiting() at 100% of a core.
+# Set to False to fall back to the old polling loop.
+EVENT_DRIVEN = True
+READ_TIMEOUT = 10.0     # seconds, wake-up at the latest after this time
+COALESCE_CHARS = 64     # after a wake-up, let this many characters arrive before reading
+MAX_LINE = 1024         # discard a "line" that has no line-feed after this many bytes
+STATS_INTERVAL = 0      # seconds between CPU/wake-up reports in the log, 0 = only at exit
+
+# Also store the reports as numbers in binary column files, a directory per
+# day, see columnar_capture.py. Much smaller than the text log, and a month
+# loads in an instant. TEXT_LOG = False leaves the reports out of gpsdo.log.
+CAPTURE = False
+CAPTURE_DIR = columnar_capture.CAPTURE_DIR
+TEXT_LOG = True
+
+# Keep the 1 minute, 10 minute, 1 hour and 1 day min/max/mean of the reports
+# for plots of long periods, see agg_pyramid.py
+PYRAMID = False
+PYRAMID_DIR = agg_pyramid.PYRAMID_DIR
+
+# Record every read of the port with its time, before the lines are split,
+# to find back and replay what the Nano really sent, see raw_capture.py
+RAW_CAPTURE = False
+RAW_DIR = raw_capture.RAW_DIR
+
+# Time the stages of a line and count what gets lost where, served on
+# /mnt/ramdisk/gpsdo_stats.sock, see hotpath_stats.py
+HOTPATH_STATS = False
+
 
 # serial port to read the GPSDO reports from the Ardujino Nano
 #port = "/dev/ttyAMA0"
 port = "/dev/serial0"
 #port = "/dev/ttyS0"
 
-serialPort = serial.Serial(port, baudrate=9600, timeout=None)
+baudrate = 9600
+
+# the serial port, opened by open_port()
+serialPort = None
+
+# the binary capture, opened by open_capture()
+capture = None
+
+# the aggregate pyramid of the reports, opened by open_capture()
+pyramid = None
+
+# the raw capture of the port, opened by open_capture()
+raw = None
+
+# the hot path stats, opened by open_capture()
+hotpath = None
+
+# the last report of the Nano as a nano_report record, None until we have one
+last_report = None
+
+# the last report is published in shared memory, for metrics_server.py
+state = None    # the shared memory state channel, opened on the first report
 
 # data path is on a RAM disk to protect the SD card
 # every new day, the log file will be moved to the SD card by a cron job
@@ -48,6 +110,9 @@ log_path = "/mnt/ramdisk/gpsdo.log"
 # -- Logger definitions
 LOG_FILENAME = log_path
 LOG_LEVEL = logging.INFO  # Could be e.g. "INFO", "DEBUG", "ERROR" or "WARNING"
+# None writes the text log as before, "gz" or "xz" compresses it while it is
+# written (gpsdo.log.gz), about 10x less space on the RAM disk, see compressed_log.py
+LOG_COMPRESSION = None
 
 
 class MyLogger(object):
@@ -71,6 +136,40 @@ class MyLogger(object):
         return
 
 
+class ReaderStats(object):
+    '''
+    Keep track of the CPU time used by the reader loop and the number of times
+    it woke up, so we can see what the reader costs us at a given baud rate.
+
+    '''
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.start = time.monotonic()
+        self.cpu_start = time.process_time()
+        self.wakeups = 0    # number of times the loop woke up
+        self.timeouts = 0   # wake-ups without any data
+        self.lines = 0
+        self.bytes = 0
+        self.reports = 0    # lines that matched the report format
+        self.rejected = 0   # lines that did not
+
+    def report(self):
+        elapsed = max(time.monotonic() - self.start, 1e-6)
+        cpu = time.process_time() - self.cpu_start
+        return ("stats: {:.0f}s elapsed, cpu {:.3f}s ({:.2f}%), {:.2f} wakeups/s, "
+                "{} timeouts, {} lines, {} bytes, {} reports, {} rejected".format(
+                elapsed, cpu, 100.0 * cpu / elapsed, self.wakeups / elapsed,
+                self.timeouts, self.lines, self.bytes, self.reports, self.rejected))
+
+    def due(self):
+        return STATS_INTERVAL > 0 and time.monotonic() - self.start >= STATS_INTERVAL
+
+
+stats = ReaderStats()
+
+
 def init():
     global logger, handler, ds_temp_IIR
 
@@ -79,7 +178,7 @@ def init():
         print ("Setting up the logger functionality")
     logger = logging.getLogger(__name__)
     logger.setLevel(LOG_LEVEL)
-    handler = logging.handlers.TimedRotatingFileHandler(LOG_FILENAME, when="midnight", backupCount=31)
+    handler = compressed_log.log_handler(LOG_FILENAME, LOG_COMPRESSION, backup_count=31)
     formatter = logging.Formatter('%(asctime)s %(levelname)-8s %(message)s')
     handler.setFormatter(formatter)
     logger.addHandler(handler)
@@ -91,34 +190,251 @@ def init():
     return
 
 
+def print_line(line):
+    '''
+    Decode a raw line from the Nano and send it to the log (through the pipe)
+    '''
+    try:
+        ser_input = line.decode('utf-8').rstrip() # strip the cr/lf
+    except UnicodeDecodeError:
+        if DEBUG: print("decode error")
+        if hotpath is not None:
+            hotpath.count(hotpath_stats.DECODE_ERRORS)
+        return
+    stats.lines += 1
+    parse_report(ser_input)
+    if TEXT_LOG:
+        print(ser_input) # this will be captured by the pipe
+    if hotpath is not None:
+        hotpath.lap(hotpath_stats.PUBLISH)
+        hotpath.count(hotpath_stats.PUBLISHED)
+
+
+def parse_report(ser_input):
+    '''
+    Turn a line into a record, lines that are not a report (like the start-up
+    messages of the Nano) are counted and only go to the log
+    '''
+    global last_report
+
+    try:
+        record = nano_report.parse(ser_input)
+    except nano_report.ReportFormatError as e:
+        stats.rejected += 1
+        if DEBUG and stats.rejected <= 10: print("not a report: {}".format(e))
+        return None
+    if hotpath is not None:
+        hotpath.lap(hotpath_stats.PARSE)
+    stats.reports += 1
+    last_report = record
+    publish_state(record)
+    if capture is not None:
+        try:
+            capture.append(record.values())
+        except ValueError as e: # a value that does not fit its column
+            print("capture: {}".format(e))
+        except OSError as e:    # the RAM disk is full, the rows are kept for the next try
+            print("capture: not written: {}".format(e))
+    if pyramid is not None:
+        pyramid.add(time.time(), record.values())
+    return record
+
+
+def publish_state(record):
+    '''
+    Put the report in the shared memory segment, with the time it came in
+    '''
+    global state
+
+    if state is None:
+        # False when there is no shared memory, so we don't keep trying
+        state = shm_state.open_writer() or False
+    if not state:
+        return
+    try:
+        state.publish("gpsdo", time.time(), *record.values())
+    except struct.error as e:
+        # the layout follows nano_report.REPORT, only a value can be out of range
+        print("shared memory state: report not published: {}".format(e))
+
+
+def polling_reader():
+    '''
+    The original reader: keep asking the UART if there is something waiting.
+    This never blocks, so it uses a full core when there is no data.
+    '''
+    while True:
+        stats.wakeups += 1
+        while (serialPort.inWaiting() > 0):
+            if hotpath is not None:
+                hotpath.start()
+            try:
+                line = serialPort.readline()
+            except (OSError, serial.serialutil.SerialException):
+                if DEBUG : print("No data available")
+                continue
+            if raw is not None:
+                raw.record(line)
+            if hotpath is not None:
+                # readline() does the framing, it is in the read lap
+                hotpath.lap(hotpath_stats.READ)
+                hotpath.count(hotpath_stats.READS)
+                hotpath.count(hotpath_stats.BYTES, len(line))
+            stats.bytes += len(line)
+            print_line(line)
+        if stats.due():
+            print(stats.report())
+            stats.reset()
+        if hotpath is not None:
+            hotpath.tick()
+
+
+def open_port():
+    global serialPort
+    serialPort = serial.Serial(port, baudrate=baudrate, timeout=None)
+
+
+def open_capture():
+    global capture, pyramid, raw, hotpath
+    if CAPTURE:
+        capture = columnar_capture.ColumnWriter(CAPTURE_DIR)
+    if PYRAMID:
+        pyramid = agg_pyramid.Pyramid("gpsdo", nano_report.report.names, PYRAMID_DIR)
+    if RAW_CAPTURE:
+        raw = raw_capture.RawRecorder("gpsdo", baudrate, RAW_DIR)
+    if HOTPATH_STATS:
+        hotpath = hotpath_stats.open_stats("gpsdo")
+        hotpath.watch(hotpath_stats.SENTENCES, lambda: stats.lines)
+        hotpath.watch(hotpath_stats.PARSE_ERRORS, lambda: stats.rejected)
+
+
+def close_capture():
+    global capture, pyramid, raw, hotpath
+    if capture is not None:
+        try:
+            capture.close()
+        except OSError as e:
+            print("capture: last rows not written: {}".format(e))
+        print(capture.report())
+        capture = None
+    if pyramid is not None:
+        pyramid.close()
+        pyramid = None
+    if raw is not None:
+        raw.close()
+        print(raw.report())
+        raw = None
+    if hotpath is not None:
+        hotpath.close()
+        print(hotpath.report())
+        hotpath = None
+
+
+line_buf = bytearray()  # holds the start of a line that is not complete yet
+
+
+def read_available():
+    '''
+    Read everything that is waiting in one go and split it into lines.
+    A line that is not complete yet stays in the buffer for the next round.
+    '''
+    global line_buf
+
+    if hotpath is not None:
+        hotpath.start()
+    try:
+        data = serialPort.read(serialPort.in_waiting or 1)
+    except (OSError, serial.serialutil.SerialException):
+        if DEBUG : print("No data available")
+        return
+    if raw is not None:
+        raw.record(data)
+    if hotpath is not None:
+        hotpath.lap(hotpath_stats.READ)
+        hotpath.count(hotpath_stats.READS)
+        hotpath.count(hotpath_stats.BYTES, len(data))
+    stats.bytes += len(data)
+    line_buf += data
+    if b"\n" in data:
+        lines = line_buf.split(b"\n")
+        line_buf = bytearray(lines.pop())  # the start of the next line, if any
+        if hotpath is not None:
+            hotpath.lap(hotpath_stats.FRAME)
+        for line in lines:
+            print_line(line)
+    elif len(line_buf) > MAX_LINE:
+        if DEBUG: print("no end of line found, discarding {} bytes".format(len(line_buf)))
+        if hotpath is not None:
+            hotpath.count(hotpath_stats.PARTIALS)
+        del line_buf[:]
+    if hotpath is not None:
+        hotpath.tick()
+
+
+def coalesce_time():
+    # give a sentence some time to arrive, so we don't wake-up for every byte
+    return COALESCE_CHARS * 10.0 / baudrate  # 10 bits per character
+
+
+def event_driven_reader():
+    '''
+    Sleep in select() until bytes arrive or READ_TIMEOUT expires, then read
+    everything that is waiting.
+    '''
+    fd = serialPort.fileno()
+    coalesce = coalesce_time()
+
+    while True:
+        ready, _, _ = select.select([fd], [], [], READ_TIMEOUT)
+        stats.wakeups += 1
+        if ready:
+            time.sleep(coalesce)
+            read_available()
+        else:
+            stats.timeouts += 1
+
+        if stats.due():
+            print(stats.report())
+            stats.reset()
+
+
+def sigterm(signum, frame):
+    '''
+    systemd stops the service with SIGTERM, take the Ctrl-C way out so the
+    captures and the log are closed
+    '''
+    raise KeyboardInterrupt
+
+
 def main():
 
     if DEBUG:print("Serial logger Version {}".format(VERSION))
 
     init()
+    signal.signal(signal.SIGTERM, sigterm)
+    open_port()
+    open_capture()
 
     if DEBUG:print("Opened port", port, "for serial tracing")
 
     try:
-        while True:
-            while (serialPort.inWaiting() > 0):
-                try:
-                    ser_input = serialPort.readline().decode('utf-8').rstrip() # strip the cr/lf
-                    print(ser_input) # this will be captured by the pipe
-                except (OSError, serial.serialutil.SerialException):
-                    if DEBUG : print("No data available")
-                    continue
-                except UnicodeDecodeError:
-                    if DEBUG: print("decode error")
-                    continue
+        if EVENT_DRIVEN:
+            event_driven_reader()
+        else:
+            polling_reader()
 
     except KeyboardInterrupt: # Ctrl-C
+        print(stats.report())
+        close_capture()
         print("\nCtrl-C - Terminated")
+        handler.close()
         os._exit(1)
 
     except Exception as e:
         sys.stderr.write("Got exception: %s" % (e))
         print(traceback.format_exc())
+        close_capture()
+        handler.close()
         os._exit(1)
 
 
@@ -23,40 +23,68 @@ import pigpio  # pigpio library used for serial bit-banging
 from time import sleep
 import sys
 import os
+import signal
 import time
 import logging
 import logging.handlers
+import compressed_log
+import raw_capture
+import hotpath_stats
 import traceback
 import json
+from sentence_framer import SentenceFramer
+from poll_scheduler import PollScheduler
+import shm_state
+import allan_stats
+import agg_pyramid
 
 
 DEBUG = False
 DAEMON = True   # if False, pipe the print statements to the console
 GATE = 1        # 1(Ks) or 10(Ks)
 
-VERSION = "1.4"     # handling start-up msg from counter and better handling of parsing issues
+VERSION = "2.8"     # the hot path stats count the parse errors where they happen
 
 serial_port = 23    # GPIO port for the Counter
 reset_port = 22     # GPIO port for the Counter reset pin
 gate_port = 25      # GPIO port for the gate time selection
+baud = 9600
+POLL_REPORT = 0     # seconds between poll statistics in the log, 0 = only at exit
 
-bol = "G"   # beginning of line starts with "Gate"
-eol = "\r"  # end of line is "\r\n"
+bol = b"G"   # beginning of line starts with "Gate"
+eol = b"\r"  # end of line is "\r\n"
 
 # instantiate an empty dict to hold the json data
 display_data = {}
 
-# create instance of pigpio class
-pi = pigpio.pi()
-# test to see if the daemon is already running
-if not pi.connected:
-    # if the daemon is not running, start it
-    os.system("sudo pigpiod")
-    sleep(1)
-    pi = pigpio.pi()
+# the data is published in shared memory for the oled driver, the json file
+# is still written for other users when WRITE_JSON is set
+WRITE_JSON = True
+state = None    # the shared memory state channel, opened on the first write
 
-# set the GPIO pin used for the bit-banging serial RxD port
-pi.set_mode(serial_port, pigpio.INPUT)
+# the running statistics of the readings, made for the gate time in use
+allan = None
+last_tstamp = 0     # tstamp of the last reading, to find gaps
+
+# Keep the 1 minute ... 1 day min/max/mean of the readings for plots of long
+# periods, see agg_pyramid.py
+PYRAMID = False
+PYRAMID_DIR = agg_pyramid.PYRAMID_DIR
+pyramid = None  # opened with the first reading
+
+# Record every read of the port with its time, before the framer, to find back
+# and replay what the counter really sent, see raw_capture.py
+RAW_CAPTURE = False
+RAW_DIR = raw_capture.RAW_DIR
+raw = None      # opened by setup()
+
+# Time the stages of a reading and count what gets lost where, served on
+# /mnt/ramdisk/counter_stats.sock, see hotpath_stats.py
+HOTPATH_STATS = False
+hotpath = None  # opened by setup()
+
+# instance of the pigpio class, created by init_pigpio()
+pi = None
 
 # data paths are on a RAM disk to protect the SD card.
 # just before midnight, the log file will be emailed to me, activated
@@ -70,6 +98,9 @@ display_path = "/mnt/ramdisk/counter.json"
 # -- Logger definitions
 LOG_FILENAME = log_path
 LOG_LEVEL = logging.INFO  # Could be e.g. "INFO", "DEBUG", "ERROR" or "WARNING"
+# None writes the text log as before, "gz" or "xz" compresses it while it is
+# written (counter.log.gz), about 10x less space on the RAM disk, see compressed_log.py
+LOG_COMPRESSION = None
 
 
 class MyLogger(object):
@@ -93,20 +124,6 @@ class MyLogger(object):
         return
 
 
-# string slicing & dicing helpers
-# https://stackoverflow.com/questions/22586286/python-is-there-an-equivalent-of-mid-right-and-left-from-basic
-
-def right(s, amount):
-    return s[amount:]
-
-def left(s, amount):
-    return s[:amount]
-
-def mid(s, offset, amount):
-    return s[offset-1:offset+amount-1]
-
-
-
 def init():
     '''
     Setup the logger functionality
@@ -119,7 +136,7 @@ def init():
         print ("Setting up the logger functionality")
     logger = logging.getLogger(__name__)
     logger.setLevel(LOG_LEVEL)
-    handler = logging.handlers.TimedRotatingFileHandler(LOG_FILENAME, when="midnight", backupCount=31)
+    handler = compressed_log.log_handler(LOG_FILENAME, LOG_COMPRESSION, backup_count=31)
     formatter = logging.Formatter('%(asctime)s %(levelname)-8s %(message)s')
     handler.setFormatter(formatter)
     logger.addHandler(handler)
@@ -192,7 +209,12 @@ def process_data(rcv_string, tstamp):
         # separate the tree segments
         gate_s, sat, counter_s = rcv_string.split(",")
         # take off the "Gate " part, so we're left with "1000s" or "10000s"
-        gate_t, gate = gate_s.split(" ")
+        try:  # a bit error can take out the space
+            gate_t, gate = gate_s.split(" ")
+        except ValueError:
+            print ("Error: gate ValueError: {}".format(gate_s))
+            count_parse_error()
+            return
 
         # take off the "Hz" part, we're not worried about the leading zero's,
         # but there may be a leading space which creates another segment
@@ -204,6 +226,7 @@ def process_data(rcv_string, tstamp):
                 if DEBUG : print(count)
             except ValueError:
                 print ("Error: 3 segment ValueError: {}".format(counter_s))
+                count_parse_error()
                 return
         elif (len(counter_s.split(" ")) == 2):  # without leading space
             if DEBUG : print("count_s has two elements")
@@ -212,17 +235,78 @@ def process_data(rcv_string, tstamp):
                 if DEBUG : print(count)
             except ValueError:
                 print ("Error: 2 segment ValueError: {}".format(counter_s))
+                count_parse_error()
                 return
+        else:
+            print ("Error: no count in {}".format(counter_s))
+            count_parse_error()
+            return
         if DEBUG : print("counter value is {}".format(count))
+        if hotpath is not None:
+            hotpath.lap(hotpath_stats.PARSE)
+        update_stats(gate, count, tstamp)
         # save the data into a file so the display script can pick it up
         write_json_data(gate, count, tstamp)
+        if hotpath is not None:
+            hotpath.lap(hotpath_stats.PUBLISH)
+            hotpath.count(hotpath_stats.PUBLISHED)
         return
     else:
         print("Error: no 3 segments to split {}".format(rcv_string))
+        count_parse_error()
 
     return
 
 
+def count_parse_error():
+    '''A sentence that could not be parsed, for the hot path stats'''
+    if hotpath is not None:
+        hotpath.count(hotpath_stats.PARSE_ERRORS)
+
+
+
+def update_stats(gate, count, tstamp):
+    '''
+    Add the reading to the running statistics. They start over when the gate
+    time changes, a gap in the readings starts a new phase record.
+    '''
+    global allan, last_tstamp, pyramid
+
+    try:
+        tau0 = int(gate.rstrip("s"))
+        frequency = float(count)
+    except ValueError:
+        print("Error: no reading in gate {} count {}".format(gate, count))
+        return
+    if allan is None or allan.tau0 != tau0:
+        allan = allan_stats.AllanStats(tau0)
+    elif allan.n and tstamp - last_tstamp > 1.5 * tau0 / 60:
+        print("gap of {} minutes in the readings".format(tstamp - last_tstamp))
+        allan.reset_phase()
+    last_tstamp = tstamp
+    allan.add(frequency)
+    print(allan.report())
+    if PYRAMID:
+        if pyramid is None:
+            pyramid = agg_pyramid.Pyramid("counter", ["frequency"], PYRAMID_DIR)
+        pyramid.add(time.time(), [frequency])
+
+
+def close_capture():
+    '''Write the pyramid buckets that are not complete yet, the raw capture and the stats'''
+    global pyramid, raw, hotpath
+    if pyramid is not None:
+        pyramid.close()
+        pyramid = None
+    if raw is not None:
+        raw.close()
+        print(raw.report())
+        raw = None
+    if hotpath is not None:
+        hotpath.close()
+        print(hotpath.report())
+        hotpath = None
+
 
 def write_json_data(gate, count, tstamp):
     '''
@@ -238,24 +322,90 @@ def write_json_data(gate, count, tstamp):
     else:
         print("gate\t{}\tcounter\t{}".format(gate,count))
 
+    publish_state(gate, count, tstamp)
+    if not WRITE_JSON:
+        # there is no json file to wake up the oled driver
+        if state:
+            shm_state.notify()
+        return
+
     display_data["counter"] = count
     display_data["gate"] = gate
     display_data["tstamp"] = tstamp
-
-    with open(display_path, 'w') as f:
+    if allan is not None and allan.n:
+        display_data["n"] = allan.n
+        display_data["mean"] = allan.mean
+        display_data["stdev"] = allan.stdev
+        display_data["ffo"] = allan.ffo
+        display_data["adev"] = [[tau, adev] for tau, adev, n in allan.table()]
+
+    # write a new file and rename it, so a reader never sees a half-written
+    # file and the oled driver gets a single change notification
+    tmp_path = display_path + ".tmp"
+    with open(tmp_path, 'w') as f:
         try:
             json.dump(display_data, f)
         except ValueError:
             print("ValueError caused by jason.dump")
             return
+    os.replace(tmp_path, display_path)
     return
 
 
+def publish_state(gate, count, tstamp):
+    '''
+    Put the data in the shared memory segment, the gate goes in as seconds
+    '''
+    global state
 
-def main():
+    if state is None:
+        # False when there is no shared memory, so we don't keep trying
+        state = shm_state.open_writer() or False
+    if not state:
+        return
+    try:
+        state.publish("counter", float(count), int(gate.rstrip("s")), tstamp)
+    except ValueError:
+        print("ValueError publishing counter {} gate {}".format(count, gate))
+    if allan is not None and allan.n:
+        adevs = [allan.adev(i) for i in range(allan.levels)][:shm_state.ADEV_LEVELS]
+        adevs += [None] * (shm_state.ADEV_LEVELS - len(adevs))
+        state.publish("stats", allan.n, allan.mean, allan.stdev, allan.ffo,
+                      *[float("nan") if a is None else a for a in adevs])
 
-    init()
-    print("Bit Banging Serial Logger Counter - Version {}".format(VERSION))
+
+
+def init_pigpio(shared=None):
+    '''
+    Connect to the pigpio daemon, or use the connection of the supervisor
+    '''
+    global pi
+
+    if shared is not None:
+        pi = shared
+    else:
+        # create instance of pigpio class
+        pi = pigpio.pi()
+        # test to see if the daemon is already running
+        if not pi.connected:
+            # if the daemon is not running, start it
+            os.system("sudo pigpiod")
+            sleep(1)
+            pi = pigpio.pi()
+
+    # set the GPIO pin used for the bit-banging serial RxD port
+    pi.set_mode(serial_port, pigpio.INPUT)
+
+
+def setup():
+    '''
+    Set the gate, reset the counter, open the bit-bang port and create the
+    framer and the poll scheduler
+    '''
+    global framer, scheduler, raw, hotpath
+
+    if RAW_CAPTURE and raw is None:
+        raw = raw_capture.RawRecorder("counter", baud, RAW_DIR)
 
     # set the gate period
     set_gate(GATE)
@@ -271,112 +421,105 @@ def main():
     pi.bb_serial_read_close(serial_port)
     # fatal exceptions back on
     pigpio.exceptions = True
-    pi.bb_serial_read_open(serial_port, 9600)  # open the port, 8 bits is default
-
-    str_s = ""  # holds the string building of segments
-    str_r = ""  # holds the left-over from a previous string which may contain
-                # the start of a new sentence
+    pi.bb_serial_read_open(serial_port, baud)  # open the port, 8 bits is default
+
+    # rebuilds the sentences from the segments that bb_serial_read gives us
+    framer = SentenceFramer(bol, eol)
+    # works out how long we can sleep between reads, the counter only
+    # reports once every gate period
+    scheduler = PollScheduler(baud, GATE * 1000, frame_len=36, report_interval=POLL_REPORT)
+
+    if HOTPATH_STATS and hotpath is None:
+        hotpath = hotpath_stats.open_stats("counter")
+        # the framer and the scheduler are new after a restart, the
+        # parse errors are counted in process_data()
+        hotpath.watch(hotpath_stats.SENTENCES, lambda: framer.frames)
+        hotpath.watch(hotpath_stats.PARTIALS, lambda: framer.discarded + framer.overflows)
+        hotpath.watch(hotpath_stats.OVERRUNS, lambda: scheduler.overruns)
 
     # create a json file so the oled driver can display the initial data
     tstamp_s = int(time.time()/60)+1  # 16.6 or 166.6 minutes
     if DEBUG : print("starting with:")
     write_json_data(gate,0,tstamp_s)  # counter display will be "0.000 Hz" or "0.0000 Hz"
 
+
+def poll():
+    '''
+    Read the port once and process what came in.
+    Returns the time to sleep before the next poll.
+    '''
+    if hotpath is not None:
+        hotpath.start()
+    # get some data. The bb_serial_read will read small segments of the string
+    # the framer adds them together to form complete sentences.
+    (b_count, data) = pi.bb_serial_read(serial_port)  # b_count is byte count of data
+    b_count = int(b_count)
+    if raw is not None and b_count > 0:
+        raw.record(data)
+    #if b_count > 0: print("b_count: {} data: {}".format(b_count, data))
+    if b_count > 0:
+        if hotpath is not None:
+            hotpath.lap(hotpath_stats.READ)
+            hotpath.count(hotpath_stats.READS)
+            hotpath.count(hotpath_stats.BYTES, b_count)
+        sentences = framer.feed(data)
+        if hotpath is not None:
+            hotpath.lap(hotpath_stats.FRAME)
+        for sentence in sentences:
+            if hotpath is not None and not sentence.isascii():
+                hotpath.count(hotpath_stats.DECODE_ERRORS)
+            # decode to ascii so we can use string functions
+            str_s = sentence.decode("utf-8", "ignore") # discard non-ascii data
+            if DEBUG : print("received string = {}".format(str_s))
+            # create a starting timestamp so we can calculate the time
+            # left before we get the next sample
+            tstamp_s = int(time.time()/60)+1  # 16.6 or 166.6 minutes
+            # process the results and write them to a file
+            process_data(str_s, tstamp_s)
+
+    if scheduler.due():
+        print(scheduler.report())
+        scheduler.reset()
+    if hotpath is not None:
+        hotpath.tick()
+    # back off when idle, poll quicker when a sentence is coming in
+    return scheduler.update(b_count, framer.in_frame)
+
+
+def sigterm(signum, frame):
+    '''
+    systemd stops the service with SIGTERM, take the Ctrl-C way out so the
+    captures and the log are closed
+    '''
+    raise KeyboardInterrupt
+
+
+def main():
+
+    init()
+    signal.signal(signal.SIGTERM, sigterm)
+    print("Bit Banging Serial Logger Counter - Version {}".format(VERSION))
+    init_pigpio()
+    setup()
+
     if DEBUG : print("start processing...")
     try:
         while True:
-            # get some data. The bb_serial_read will read small segments of the string
-            # so they need to be added together to form a complete sentence.
-            (b_count, data) = pi.bb_serial_read(serial_port)  # b_count is byte count of data
-            #if int(b_count) > 0: print("b_count: {} data: {}".format(int(b_count), data))
-            # wait for the start of a new sentence, it starts with a begin-of-line(bol)
-            if (int(b_count) == 0): # wait for real data
-                continue
-            # we have data
-            # decode to ascii first so we can use string functions
-            try:
-                data_s = data.decode("utf-8", "ignore") # discard non-ascii data
-                if DEBUG: print(data_s)
-            except AttributeError as e:
-                print('*** Decode error: {}'.format(e))
-                continue
-            # add the left-over from the previous string if there was one
-            data_s = str_r + data_s
-            if DEBUG: print(data_s)
-            #  look for the bol in this segment
-            if bol in data_s:
-                if DEBUG: print("found bol")
-                pos = data_s.find(bol)  # get the position of the bol
-                # save the start of the sentence starting with bol
-                str_s = right(data_s, pos)  # strip everything to the left
-                # look to see if there are more bol's in this segment
-                if str_s.count(bol) > 1 :   # there is another one!
-                    # skip the first and get the position of the second bol
-                    pos = str_s[1:].find(bol)
-                    if DEBUG : print(pos)
-                    # strip everything to the left of the second bol
-                    str_s = right(str_s, pos+1)
-                if DEBUG: print(str_s)
-
-                # get more data segments to complete the sentence
-                while (int(b_count) > 0):
-                    #if DEBUG : print("building string")
-                    (b_count, data) = pi.bb_serial_read(serial_port)
-                    #if DEBUG : print("b_count: {} data: {}".format(int(b_count), data))
-                    if int(b_count) == 0 : # only process real data
-                        b_count = 1  # stay in this while loop
-                        continue
-                    # decode to ascii
-                    try:
-                        data_s = data.decode("utf-8", "ignore")
-                    except ValueError.ParseError as e:
-                        print('*** Decode error: {}'.format(e))
-                        continue
-
-                    # look for the eol "\r" of the sentence
-                    if eol in data_s:
-                        if DEBUG: print("found eol")
-                        pos = data_s.find(eol)
-                        if DEBUG: print("eol position ",pos)
-                        str_r = left(data_s, pos)  # use everything to the left of the eol
-                        str_s = str_s +  str_r     # finish the sentence
-                        if DEBUG : print("received string = {}".format(str_s))
-                        # create a starting timestamp so we can calculate the time
-                        # left before we get the next sample
-                        tstamp_s = int(time.time()/60)+1  # 16.6 or 166.6 minutes
-                        # process the results and write them to a file
-                        process_data(str_s, tstamp_s)
-                        # save the left-over, which can be the start of a new sentence
-                        str_r = right(data_s, pos+1)
-                        # if we have a single "\n", discard it
-                        if str_r == "\n" :
-                            str_r = ""   # skip the \n part of the eol
-
-                        if DEBUG: print("left over", str_r)
-                        # start looking for a bol again
-                        break
-                    else:
-                        # add the segments together
-                        str_s = str_s +  data_s
-                        if DEBUG: print(str_s)
-                        # get more segments to complete the sentence
-
-            else:
-                # continue looking for the start of a segment
-                str_s = ""
-                data_s = ""
-                continue
-
+            time.sleep(poll())
 
     except KeyboardInterrupt: # Ctrl-C
+        print(scheduler.report())
+        close_capture()
         print("\nCtrl-C - Terminated")
+        handler.close()
         os._exit(1)
 
     except Exception as e:
         sys.stderr.write("Got exception: {}".format(e))
         print(traceback.format_exc())
+        close_capture()
+        handler.close()
         os._exit(1)
 
 if __name__ == '__main__':
     main()
-
@@ -13,8 +13,21 @@
 #-------------------------------------------------------------------------------
 
 # https://github.com/Knio/pynmea2 to install use : pip install pynmea2
-# note that this only seems to work on Python 2.7
-import pynmea2 # NMEA message parser
+# it is no longer needed, the native parser in nmea_parser.py is used unless
+# USE_PYNMEA2 is set
+try:
+    import pynmea2 # NMEA message parser
+except ImportError:
+    pynmea2 = None
+import nmea_parser
+import ubx_protocol
+import shm_state
+
+# the parse errors we can get from either parser
+if pynmea2 is None:
+    PARSE_ERRORS = (nmea_parser.ParseError,)
+else:
+    PARSE_ERRORS = (nmea_parser.ParseError, pynmea2.ParseError)
 
 # sudo apt-get install pigpio
 # http://abyz.me.uk/rpi/pigpio/index.html
@@ -23,34 +36,67 @@ import pigpio  # pigpio library used for serial bit-banging
 from time import sleep
 import sys
 import os
+import signal
 from datetime import datetime, date, time, timedelta
 import pytz     # sudo pip install pytz & sudo python2.7 -m pip install pytz
 import logging
 import logging.handlers
 import traceback
 import json
+import compressed_log
+import raw_capture
+import hotpath_stats
+from sentence_framer import SentenceFramer
+from poll_scheduler import PollScheduler
 
 DEBUG = False
 DAEMON = True # if False, pipe the print statements to the console
+USE_PYNMEA2 = False # use pynmea2 instead of the native parser
 
-VERSION = "1.1"   # fixed a bug when there are empty segments in a sentence
+VERSION = "2.4"   # SIGTERM closes the captures and the log like Ctrl-C
 
 serial_port = 24 # GPIO port NMEA
+baud = 9600      # NEO default
+NMEA_INTERVAL = 1   # seconds between the NMEA bursts (1 Hz)
+POLL_REPORT = 0  # seconds between poll statistics in the log, 0 = only at exit
 
-bol = "$"   # beginning of line
-eol = "\r"  # end of line followed by \n
+# "NMEA" reads the text sentences, "UBX" reads the NAV-PVT, NAV-SAT and TIM-TP
+# binary messages. The NEO has to be set up for UBX with u-center first,
+# see ubx_protocol.py
+PROTOCOL = "NMEA"
+UBX_BAUD = 38400    # the baud rate the NEO was set to for UBX
+UBX_RATE = 1        # navigation rate in Hz
+
+bol = b"$"   # beginning of line
+eol = b"\r"  # end of line followed by \n
 
 # instantiate an empty dict to hold the json data
 display_data = {}
+json_data = {}  # what is in the json file now
+
+# the data is published in shared memory for the oled driver, the json file
+# is still written for other users when WRITE_JSON is set
+WRITE_JSON = True
+state = None    # the shared memory state channel, opened on the first write
+
+# dispatches the sentences we subscribe to, and keeps the satellite table
+engine = nmea_parser.NMEAEngine()
+ubx_engine = ubx_protocol.UBXEngine()
+fix_status = "V"    # from the RMC, V until we have a valid fix
 
-#create instance of pigpio class
-pi = pigpio.pi()
-if not pi.connected:
-    os.system("sudo pigpiod")
-    sleep(1)
-    pi = pigpio.pi()
+# Record every read of the port with its time, before the framer, to find back
+# and replay what the GPS really sent, see raw_capture.py
+RAW_CAPTURE = False
+RAW_DIR = raw_capture.RAW_DIR
+raw = None      # opened by setup()
 
-pi.set_mode(serial_port, pigpio.INPUT)
+# Time the stages of a sentence and count what gets lost where, served on
+# /mnt/ramdisk/gps_stats.sock, see hotpath_stats.py
+HOTPATH_STATS = False
+hotpath = None  # opened by setup()
+
+# instance of the pigpio class, created by init_pigpio()
+pi = None
 
 # data path is on a RAM disk to protect the SD card
 # every new day, the log file will be moved to the SD card by a cron job
@@ -60,6 +106,9 @@ display_path = "/mnt/ramdisk/nmea.json"
 # -- Logger definitions
 LOG_FILENAME = log_path
 LOG_LEVEL = logging.INFO  # Could be e.g. "INFO", "DEBUG", "ERROR" or "WARNING"
+# None writes the text log as before, "gz" or "xz" compresses it while it is
+# written (nmea.log.gz), about 10x less space on the RAM disk, see compressed_log.py
+LOG_COMPRESSION = None
 
 timeZone = pytz.timezone("Europe/Amsterdam")
 
@@ -92,7 +141,7 @@ def init():
         print ("Setting up the logger functionality")
     logger = logging.getLogger(__name__)
     logger.setLevel(LOG_LEVEL)
-    handler = logging.handlers.TimedRotatingFileHandler(LOG_FILENAME, when="midnight", backupCount=31)
+    handler = compressed_log.log_handler(LOG_FILENAME, LOG_COMPRESSION, backup_count=31)
     formatter = logging.Formatter('%(asctime)s %(levelname)-8s %(message)s')
     handler.setFormatter(formatter)
     logger.addHandler(handler)
@@ -110,70 +159,207 @@ def is_dst(dt,timeZone):
    return aware_dt.dst() != timedelta(0,0)
 
 
-def parseGPS(xstr):
+def local_time_s(hour, minute, second):
+    # a simple kludge to get local time with daylight savings aware adjustment
+    dt = datetime.now()
+    if (is_dst(dt,timeZone)):
+        dst = 2
+    else:
+        dst = 1
+
+    return ("{}:{}:{}".format(hour+dst, minute, second))
 
-    if xstr.find('GGA') > 0:  # looking for the $GGA sentence
-        if DEBUG: print("found it")
-        try:
-            msg = pynmea2.parse(xstr)
-        except pynmea2.ParseError as e:
-            print('Parse error: {}'.format(e))
-            return
 
-        # a simple kludge to get local time with daylight savings aware adjustment
-        dt = datetime.now()
-        if (is_dst(dt,timeZone)):
-            dst = 2
+def parseGPS(sentence):
+    '''
+    Process a raw sentence as it comes from the framer. Sentence types
+    nobody subscribed to are skipped on the type before they are decoded.
+    '''
+    if DEBUG: print(sentence)
+    if hotpath is not None:
+        published = hotpath.counts[hotpath_stats.PUBLISHED]
+    try:
+        engine.dispatch(sentence)
+    except PARSE_ERRORS as e:
+        if hotpath is not None:
+            hotpath.count(hotpath_stats.PARSE_ERRORS)
+        print('Parse error: {}'.format(e))
+    if hotpath is not None:
+        # on_gga did the parse lap when it published
+        if hotpath.counts[hotpath_stats.PUBLISHED] != published:
+            hotpath.lap(hotpath_stats.PUBLISH)
         else:
-            dst = 1
+            hotpath.lap(hotpath_stats.PARSE)
+    return
 
-        local_time = ("{}:{}:{}".format(msg.timestamp.hour+dst, msg.timestamp.minute, msg.timestamp.second))
 
-        print ("Time: {}  \t Lat: {} {} \t Lon: {} {} \t Altitude: {} {} \t Satellites: {}"\
-            .format(local_time,msg.lat,msg.lat_dir,msg.lon,msg.lon_dir,msg.altitude,msg.altitude_units, msg.num_sats))
+def on_rmc(msg):
+    global fix_status
+    fix_status = msg.status  # A = valid, V = receiver warning
 
-        if int(msg.num_sats) > 0 and msg.num_sats != None :
-            if DEBUG : print(int(msg.num_sats))
-            write_json_data(int(msg.num_sats))
-    else:
-        if DEBUG: print(xstr)
-        pass
+
+def on_gga(msg):
+    if hotpath is not None:
+        hotpath.lap(hotpath_stats.PARSE)
+        hotpath.count(hotpath_stats.PUBLISHED)
+    if DEBUG: print("found it")
+    if msg.timestamp is None:
+        if DEBUG: print("no time in the sentence yet")
+        return
+
+    local_time = local_time_s(msg.timestamp.hour, msg.timestamp.minute, msg.timestamp.second)
+
+    # the GSA and GSV of this fix are still to come, use the previous one
+    in_view, tracked, used, snr_avg, snr_min = engine.sats.last_summary
+
+    print ("Time: {}  \t Lat: {} {} \t Lon: {} {} \t Altitude: {} {} \t Satellites: {} \t SNR avg: {} min: {}"\
+        .format(local_time,msg.lat,msg.lat_dir,msg.lon,msg.lon_dir,msg.altitude,msg.altitude_units, msg.num_sats,
+        snr_avg, snr_min))
+
+    if msg.num_sats and int(msg.num_sats) > 0 :
+        if DEBUG : print(int(msg.num_sats))
+        write_json_data(int(msg.num_sats), in_view, used, snr_avg, snr_min)
 
     return
 
 
-def write_json_data(num_sats):
+def init_engine():
+    '''
+    Subscribe to the sentences we use, the rest is discarded unparsed
+    '''
+    if USE_PYNMEA2 and pynmea2 is not None:
+        engine.set_parser(b"GGA", lambda sentence: pynmea2.parse(sentence.decode("utf-8", "ignore")))
+    engine.subscribe(b"GGA", on_gga)
+    engine.subscribe(b"RMC", on_rmc)
+    engine.subscribe(b"GSA")    # marks the satellites used in the fix
+    engine.subscribe(b"GSV")    # fills the satellite table
+
+
+def on_nav_pvt(msg):
+    '''
+    The UBX counterpart of the GGA, produces the same log line and json data
+    '''
+    global fix_status
+    fix_status = "A" if msg.fix_ok else "V"
+    if hotpath is not None:
+        hotpath.count(hotpath_stats.PUBLISHED)
+
+    local_time = local_time_s(msg.hour, msg.minute, msg.second)
+
+    # NAV-SAT follows the NAV-PVT, so the table holds the previous epoch
+    in_view, tracked, used, snr_avg, snr_min = ubx_engine.sats.summary()
+
+    print ("Time: {}  \t Lat: {:.7f} {} \t Lon: {:.7f} {} \t Altitude: {} M \t Satellites: {} \t SNR avg: {} min: {}"\
+        .format(local_time, abs(msg.lat), "N" if msg.lat >= 0 else "S", abs(msg.lon),
+        "E" if msg.lon >= 0 else "W", msg.h_msl, msg.num_sv, snr_avg, snr_min))
+
+    if msg.num_sv > 0 :
+        write_json_data(msg.num_sv, in_view, used, snr_avg, snr_min)
+
+
+def on_tim_tp(msg):
+    '''
+    The quantization error of the next time pulse, in pico seconds
+    '''
+    display_data["qerr"] = msg.q_err
+
+
+def init_ubx():
+    ubx_engine.subscribe(ubx_protocol.NAV_PVT, on_nav_pvt)
+    ubx_engine.subscribe(ubx_protocol.NAV_SAT)     # fills the satellite table
+    ubx_engine.subscribe(ubx_protocol.TIM_TP, on_tim_tp)
+
+
+def write_json_data(num_sats, in_view=0, used=0, snr_avg=0, snr_min=0):
     global display_data
 
     display_data["sat_nbr"] = num_sats
+    display_data["sat_view"] = in_view
+    display_data["sat_used"] = used
+    display_data["snr_avg"] = snr_avg
+    display_data["snr_min"] = snr_min
+    display_data["fix"] = fix_status
+
+    publish_state()
+    if display_data == json_data:
+        # nothing new for the readers of the file, don't wake them up
+        return
+    if not WRITE_JSON:
+        # there is no json file to wake up the oled driver
+        if state:
+            shm_state.notify()
+        json_data.clear()
+        json_data.update(display_data)
+        return
 
-    with open(display_path, 'w') as f:
+    # write a new file and rename it, so a reader never sees a half-written
+    # file and the oled driver gets a single change notification
+    tmp_path = display_path + ".tmp"
+    with open(tmp_path, 'w') as f:
         try:
             json.dump(display_data, f)
         except ValueError:
             print("ValueError from jason.dump")
             return
+    os.replace(tmp_path, display_path)
+    json_data.clear()
+    json_data.update(display_data)
     return
 
 
+def publish_state():
+    '''
+    Put the data in the shared memory segment
+    '''
+    global state
 
-# string slicing & dicing helpers
-# https://stackoverflow.com/questions/22586286/python-is-there-an-equivalent-of-mid-right-and-left-from-basic
+    if state is None:
+        # False when there is no shared memory, so we don't keep trying
+        state = shm_state.open_writer() or False
+    if not state:
+        return
+    state.publish("nmea", display_data["sat_nbr"], display_data["sat_view"],
+                  display_data["sat_used"], display_data["snr_avg"], display_data["snr_min"],
+                  display_data["fix"].encode("ascii"), display_data.get("qerr", 0))
 
-def right(s, amount):
-    return s[amount:]
 
-def left(s, amount):
-    return s[:amount]
+def init_pigpio(shared=None):
+    '''
+    Connect to the pigpio daemon, or use the connection of the supervisor
+    '''
+    global pi
 
-def mid(s, offset, amount):
-    return s[offset-1:offset+amount-1]
+    if shared is not None:
+        pi = shared
+    else:
+        #create instance of pigpio class
+        pi = pigpio.pi()
+        if not pi.connected:
+            os.system("sudo pigpiod")
+            sleep(1)
+            pi = pigpio.pi()
 
+    pi.set_mode(serial_port, pigpio.INPUT)
 
-def main():
 
-    init()
-    print("Bit Banging Serial GPS logger Version {}".format(VERSION))
+def setup():
+    '''
+    Open the bit-bang port and create the framer and the poll scheduler
+    '''
+    global framer, scheduler, raw, hotpath
+
+    if PROTOCOL == "UBX":
+        init_ubx()
+        port_baud = UBX_BAUD
+        interval = 1.0 / UBX_RATE
+    else:
+        init_engine()
+        port_baud = baud
+        interval = NMEA_INTERVAL
+
+    if RAW_CAPTURE and raw is None:
+        raw = raw_capture.RawRecorder("gps", port_baud, RAW_DIR)
+
     if DEBUG : print("opening serial port")
     # from joan:
     # https://raspberrypi.stackexchange.com/questions/27488/pigpio-library-example-for-bit-banging-a-uart
@@ -182,102 +368,116 @@ def main():
     pi.bb_serial_read_close(serial_port)
     # fatal exceptions back on
     pigpio.exceptions = True
-    pi.bb_serial_read_open(serial_port, 9600)  # open the port, 8 bits is default
+    pi.bb_serial_read_open(serial_port, port_baud)  # open the port, 8 bits is default
+
+    # rebuilds the sentences or UBX frames from the segments that bb_serial_read gives us
+    if PROTOCOL == "UBX":
+        framer = ubx_engine
+    else:
+        framer = SentenceFramer(bol, eol)
+    # works out how long we can sleep between reads
+    scheduler = PollScheduler(port_baud, interval, report_interval=POLL_REPORT)
+
+    if HOTPATH_STATS and hotpath is None:
+        hotpath = hotpath_stats.open_stats("gps")
+        hotpath.watch(hotpath_stats.OVERRUNS, lambda: scheduler.overruns)
+        if PROTOCOL == "UBX":
+            hotpath.watch(hotpath_stats.SENTENCES, lambda: ubx_engine.frames)
+            hotpath.watch(hotpath_stats.PARSE_ERRORS, lambda: ubx_engine.errors)
+        else:
+            hotpath.watch(hotpath_stats.SENTENCES, lambda: framer.frames)
+            hotpath.watch(hotpath_stats.PARTIALS, lambda: framer.discarded + framer.overflows)
+
+
+def close_capture():
+    global raw, hotpath
+    if raw is not None:
+        raw.close()
+        print(raw.report())
+        raw = None
+    if hotpath is not None:
+        hotpath.close()
+        print(hotpath.report())
+        hotpath = None
+
+
+def poll():
+    '''
+    Read the port once and process what came in.
+    Returns the time to sleep before the next poll.
+    '''
+    if hotpath is not None:
+        hotpath.start()
+    # get some data. The bb_serial_read will read small segments of the string
+    # the framer adds them together to form complete sentences.
+    (b_count, data) = pi.bb_serial_read(serial_port)  # b_count is byte count of data
+    b_count = int(b_count)
+    if raw is not None and b_count > 0:
+        raw.record(data)
+    if b_count > 0:
+        if hotpath is not None:
+            hotpath.lap(hotpath_stats.READ)
+            hotpath.count(hotpath_stats.READS)
+            hotpath.count(hotpath_stats.BYTES, b_count)
+        if DEBUG: print("b_count: {} data: {}".format(b_count, data))
+        if PROTOCOL == "UBX":
+            # the UBX engine dispatches the frames itself, the frame, parse
+            # and publish of a UBX read all go in the parse lap
+            ubx_engine.feed(data)
+            if hotpath is not None:
+                hotpath.lap(hotpath_stats.PARSE)
+        else:
+            # a segment can complete more than one sentence
+            sentences = framer.feed(data)
+            if hotpath is not None:
+                hotpath.lap(hotpath_stats.FRAME)
+            for sentence in sentences:
+                if hotpath is not None and not sentence.isascii():
+                    hotpath.count(hotpath_stats.DECODE_ERRORS)
+                parseGPS(sentence)
+
+    if scheduler.due():
+        print(scheduler.report())
+        scheduler.reset()
+    if hotpath is not None:
+        hotpath.tick()
+    # back off when idle, poll quicker when a sentence is coming in
+    return scheduler.update(b_count, framer.in_frame)
+
+
+def sigterm(signum, frame):
+    '''
+    systemd stops the service with SIGTERM, take the Ctrl-C way out so the
+    captures and the log are closed
+    '''
+    raise KeyboardInterrupt
 
-    str_s = ""  # holds the string building of segments
-    str_r = ""  # holds the left-over from a previous string which may contain
-                # the start of a new sentence
+
+def main():
+
+    init()
+    signal.signal(signal.SIGTERM, sigterm)
+    print("Bit Banging Serial GPS logger Version {}".format(VERSION))
+    init_pigpio()
+    setup()
 
     try:
         while True:
-            # get some data. The bb_serial_read will read small segments of the string
-            # they need to be added together to form a complete sentence.
-            (b_count, data) = pi.bb_serial_read(serial_port)  # b_count is byte count of data
-            if DEBUG and int(b_count) > 0: print("b_count: {} data: {}".format(int(b_count), data))
-            # wait for the start of a new sentence, it starts with a bol
-            if (int(b_count) == 0): # wait for real data
-                continue
-            # we have data
-            # decode to ascii first so we can use string functions
-            try:
-                data_s = data.decode("utf-8", "ignore") # discard non-ascii data
-                if DEBUG: print(data_s)
-            except AttributeError as e:
-                print('*** Decode error: {}'.format(e))
-                continue
-            # add the left-over from the previous string if there was one
-            data_s = str_r + data_s
-            if DEBUG: print(data_s)
-            #  look for the bol in this segment
-            if bol in data_s:
-                if DEBUG: print("found bol")
-                pos = data_s.find(bol)  # get the position of the bol
-                # save the start of the sentence starting with bol
-                str_s = right(data_s, pos)  # strip everything to the left
-                # look to see if there are more bol's in this segment
-                if str_s.count(bol) > 1 :   # there is another one!
-                    # skip the first and get the position of the second bol
-                    pos = str_s[1:].find(bol)
-                    if DEBUG : print(pos)
-                    # strip everything to the left of the second bol
-                    str_s = right(str_s, pos+1)
-                if DEBUG: print(str_s)
-
-                # get more data segments to complete the sentence
-                while (int(b_count) > 0):
-                    if DEBUG : print("building string")
-                    (b_count, data) = pi.bb_serial_read(serial_port)
-                    if DEBUG : print("b_count: {} data: {}".format(int(b_count), data))
-                    if int(b_count) == 0 : # only process real data
-                        b_count = 1  # stay in this while loop
-                        continue
-                    # decode to ascii
-                    try:
-                        data_s = data.decode("utf-8", "ignore")
-                    except ValueError.ParseError as e:
-                        print('*** Decode error: {}'.format(e))
-                        continue
-
-                    # look for the eol "\r" of the sentence
-                    if eol in data_s:
-                        if DEBUG: print("found eol")
-                        pos = data_s.find(eol)
-                        if DEBUG: print("eol position ",pos)
-                        str_r = left(data_s, pos)  # use everything to the left of the eol
-                        str_s = str_s +  str_r     # finish the sentence
-                        if DEBUG : print(str_s)
-                        parseGPS(str_s)
-                        # save the left-over, which can be the start of a new sentence
-                        str_r = right(data_s, pos+1)
-                        # if we have a single "\n", discard it
-                        if str_r == "\n" :
-                            str_r = ""   # skip the \n part of the eol
-
-                        if DEBUG: print("left over", str_r)
-                        # start looking for a bol again
-                        break
-                    else:
-                        # add the segments together
-                        str_s = str_s +  data_s
-                        if DEBUG: print(str_s)
-                        # get more segments to complete the sentence
-
-            else:
-                # continue looking for the start of a segment
-                str_s = ""
-                data_s = ""
-                continue
-
+            sleep(poll())
 
     except KeyboardInterrupt: # Ctrl-C
+        print(scheduler.report())
+        close_capture()
         print("\nCtrl-C - Terminated")
+        handler.close()
         os._exit(1)
 
     except Exception as e:
         sys.stderr.write("Got exception: {}".format(e))
         print(traceback.format_exc())
+        close_capture()
+        handler.close()
         os._exit(1)
 
 if __name__ == '__main__':
     main()
-
@@ -0,0 +1,270 @@
+#!/usr/bin/python3.7
+#-------------------------------------------------------------------------------
+# Name:        shm_state.py
+# Purpose:     Shared memory state channel between the monitors and the
+#              oled driver. The producers publish their fields in place in a
+#              fixed layout on /dev/shm, the readers take a consistent
+#              snapshot without a system call or any parsing.
+#
+#              Every section starts with a sequence number. The writer makes
+#              it odd before it changes the fields, and even again when it is
+#              done. A reader copies the fields and checks that the sequence
+#              number was even and did not change, otherwise it tries again.
+#              There can only be one writer per section.
+#
+#              Run the stress test to check for torn reads:
+#              python3 shm_state.py --stress [seconds]
+#
+# Author:      paulv
+#
+# Created:     18-10-2026
+# Copyright:   (c) paulv 2018 2019 2020
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+
+import mmap
+import os
+import struct
+import sys
+import time
+
+import nano_report
+
+VERSION = "1.4"     # the gpsdo section is built from the nano_report schema
+
+SHM_PATH = "/dev/shm/gpsdo_state"
+
+# touched by the producers that don't write their json files (WRITE_JSON =
+# False), the oled driver watches it next to the json files to wake up
+NOTIFY_PATH = "/mnt/ramdisk/state.notify"
+
+MAGIC = b"GPSD"
+LAYOUT_VERSION = 3
+SIZE = 512          # bytes, leaves room for more sections
+
+HEADER = struct.Struct("<4sII4x")   # magic, layout version, size
+SEQ = struct.Struct("<I4x")         # sequence number, 8 bytes to keep the fields aligned
+
+ADEV_LEVELS = 8     # Allan deviations in the stats section, tau = 1, 2, 4 .. 128 gate times
+
+GPSDO_OFFSET = 216
+
+
+def report_layout(schema=None, offset=GPSDO_OFFSET):
+    '''
+    The layout of the gpsdo section: time.time() the report came in, then the
+    fields of the report with their array typecodes. Raises ValueError when
+    the report does not fit, so a changed REPORT stops the monitor at the
+    start instead of losing the state later.
+    '''
+    schema = schema or nano_report.report
+    for name, typecode in zip(schema.names, schema.typecodes):
+        if typecode not in "bhiqfd":
+            raise ValueError("shm_state: field {} of the report has typecode {}, "
+                             "the gpsdo section takes b, h, i, q, f or d".format(name, typecode))
+    layout = struct.Struct("<d" + "".join(schema.typecodes))
+    if offset + SEQ.size + layout.size > SIZE:
+        raise ValueError("shm_state: the report needs {} bytes, the gpsdo section has {}, "
+                         "make SIZE larger".format(layout.size, SIZE - offset - SEQ.size))
+    return layout
+
+
+# name -> (offset of the sequence number, layout of the fields)
+SECTIONS = {
+    # counter value in Hz, gate in seconds, tstamp in minutes
+    "counter": (16, struct.Struct("<dIq")),
+    # sats in the fix, in view, used, average snr, lowest snr, fix status, qErr in ps
+    "nmea": (64, struct.Struct("<iiidi1si")),
+    # counter statistics: readings, mean Hz, stdev Hz, fractional frequency
+    # offset of the last reading, Allan deviations (NaN when not known yet)
+    "stats": (112, struct.Struct("<i4xddd{}d".format(ADEV_LEVELS))),
+    # the last report of the Nano: time.time() it came in, then the fields of
+    # nano_report.REPORT
+    "gpsdo": (GPSDO_OFFSET, report_layout()),
+}
+
+# the names of the fields of the sections, for the readers that show them
+FIELDS = {
+    "counter": ("counter", "gate", "tstamp"),
+    "nmea": ("sats", "in_view", "used", "snr_avg", "snr_min", "fix", "qerr"),
+    "stats": ("n", "mean", "stdev", "ffo") + tuple("adev{}".format(2 ** i) for i in range(ADEV_LEVELS)),
+    "gpsdo": ("time",) + nano_report.report.names,
+}
+
+RETRIES = 1000      # attempts to get a consistent snapshot before giving up
+
+
+class StateChannel(object):
+    '''
+    The shared memory segment with the state of the monitors.
+    Producers open it writable, readers read-only.
+
+    '''
+    def __init__(self, path=SHM_PATH, writable=False):
+        """Needs the path of the segment, the writer creates it."""
+        self.path = path
+        self.writable = writable
+        self.buffers = {name: bytearray(layout.size) for name, (offset, layout) in SECTIONS.items()}
+        if writable:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size < SIZE:
+                    os.ftruncate(fd, SIZE)
+                self.mm = mmap.mmap(fd, SIZE, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+            finally:
+                os.close(fd)
+            magic, version, size = HEADER.unpack_from(self.mm, 0)
+            if magic != MAGIC or version != LAYOUT_VERSION:
+                # a new segment, or one with an old layout
+                self.mm[:] = bytes(SIZE)
+                HEADER.pack_into(self.mm, 0, MAGIC, LAYOUT_VERSION, SIZE)
+        else:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                self.mm = mmap.mmap(fd, SIZE, mmap.MAP_SHARED, mmap.PROT_READ)
+            finally:
+                os.close(fd)
+            magic, version, size = HEADER.unpack_from(self.mm, 0)
+            if magic != MAGIC or version != LAYOUT_VERSION:
+                self.mm.close()
+                raise ValueError("{} has an unknown layout".format(path))
+
+    def publish(self, name, *values):
+        '''
+        Write the fields of a section in place
+        '''
+        offset, layout = SECTIONS[name]
+        buf = self.buffers[name]
+        # a value that does not fit raises here, before the section is touched
+        layout.pack_into(buf, 0, *values)
+        mm = self.mm
+        start = offset + SEQ.size
+        seq = SEQ.unpack_from(mm, offset)[0]
+        SEQ.pack_into(mm, offset, (seq + 1) & 0xFFFFFFFF)   # odd: being written
+        mm[start:start + layout.size] = buf
+        SEQ.pack_into(mm, offset, (seq + 2) & 0xFFFFFFFF)   # even: done
+
+    def snapshot(self, name):
+        '''
+        Returns (sequence number, fields) of a section. The sequence number is
+        0 when nothing was published yet, None is returned when the writer
+        kept us from getting a consistent copy.
+        '''
+        offset, layout = SECTIONS[name]
+        mm = self.mm
+        for n in range(RETRIES):
+            seq = SEQ.unpack_from(mm, offset)[0]
+            if seq & 1:
+                continue
+            values = layout.unpack_from(mm, offset + SEQ.size)
+            if SEQ.unpack_from(mm, offset)[0] == seq:
+                return seq, values
+        return None
+
+    def sequence(self, name):
+        '''The sequence number of a section, it changes with every update'''
+        return SEQ.unpack_from(self.mm, SECTIONS[name][0])[0]
+
+    def close(self):
+        self.mm.close()
+
+
+def open_writer(path=SHM_PATH):
+    '''
+    Open the channel for a producer, returns None when that is not possible
+    '''
+    try:
+        return StateChannel(path, writable=True)
+    except (OSError, ValueError) as e:
+        print("shared memory state not available: {}".format(e))
+        return None
+
+
+def open_reader(path=SHM_PATH):
+    '''
+    Open the channel for a reader, returns None when there is no producer yet
+    '''
+    try:
+        return StateChannel(path, writable=False)
+    except (OSError, ValueError):
+        return None
+
+
+def notify(path=NOTIFY_PATH):
+    '''
+    Tell the readers that watch the notify file that the state changed. Closing
+    a file that was opened to write is enough for an inotify IN_CLOSE_WRITE.
+    '''
+    try:
+        os.close(os.open(path, os.O_WRONLY | os.O_CREAT, 0o644))
+    except OSError:
+        pass
+
+
+# --- stress test -------------------------------------------------------------
+
+def stress_writer(path, seconds):
+    channel = StateChannel(path, writable=True)
+    end = time.monotonic() + seconds
+    n = 0
+    while time.monotonic() < end:
+        n += 1
+        # every field of a snapshot has to come from the same update
+        channel.publish("counter", float(n), n & 0xFFFFFFFF, n)
+        channel.publish("nmea", n, n, n, float(n), n, b"A", n)
+    channel.close()
+    os._exit(0)
+
+
+def stress(seconds=10):
+    print("Shared memory state stress test - Version {}".format(VERSION))
+    path = "{}.stress.{}".format(SHM_PATH, os.getpid())
+    StateChannel(path, writable=True).close()
+
+    pid = os.fork()
+    if pid == 0:
+        stress_writer(path, seconds)
+
+    reader = StateChannel(path)
+    reads = torn = busy = 0
+    last = 0
+    try:
+        while True:
+            done, status = os.waitpid(pid, os.WNOHANG)
+            for name in ("counter", "nmea"):
+                snap = reader.snapshot(name)
+                if snap is None:
+                    busy += 1
+                    continue
+                reads += 1
+                seq, values = snap
+                n = values[-1] if name == "counter" else values[0]
+                if name == "counter":
+                    ok = values[0] == float(n) and values[1] == n & 0xFFFFFFFF
+                else:
+                    ok = values[1] == n and values[2] == n and values[3] == float(n) and values[6] == n
+                if not ok:
+                    torn += 1
+                if name == "counter":
+                    if n < last:
+                        torn += 1   # went back in time
+                    last = n
+            if done:
+                break
+    finally:
+        reader.close()
+        os.unlink(path)
+
+    print("{} snapshots, {} torn, {} gave up, writer reached update {}".format(reads, torn, busy, last))
+    return torn
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == "--stress":
+        sys.exit(1 if stress(float(sys.argv[2]) if len(sys.argv) > 2 else 10) else 0)
+    channel = open_reader()
+    if channel is None:
+        print("no state published in {}".format(SHM_PATH))
+    else:
+        for name in sorted(SECTIONS):
+            print(name, channel.snapshot(name))
@@ -0,0 +1,219 @@
+#!/usr/bin/python3.7
+#-------------------------------------------------------------------------------
+# Name:        ssd1306_diff.py
+# Purpose:     Only send the parts of the image that changed to the SSD1306.
+#              Keeps a copy of the framebuffer that is on the display, works
+#              out which columns of which pages changed, and sends just those
+#              with the column and page addressing of the controller, instead
+#              of the full 512 bytes for every frame.
+#              Used by oled_driver.py
+#
+#              Run it on its own to compare it with full updates:
+#              python3 ssd1306_diff.py
+#
+# Author:      paulv
+#
+# Created:     18-10-2026
+# Copyright:   (c) paulv 2018 2019 2020
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+
+import time
+
+from PIL import Image
+
+VERSION = "1.0"
+
+# SSD1306 commands
+SSD1306_COLUMNADDR = 0x21
+SSD1306_PAGEADDR = 0x22
+
+CHUNK = 16          # data bytes per I2C write, like the Adafruit driver
+CMD_BYTES = 2       # control byte + command byte for every command
+
+TRANSPOSE = getattr(Image, "TRANSPOSE", None)
+if TRANSPOSE is None:   # newer Pillow versions
+    TRANSPOSE = Image.Transpose.TRANSPOSE
+
+# the bits of a byte in reverse order: PIL puts the top pixel in the MSB,
+# the SSD1306 wants it in the LSB
+REVERSE = bytes(int("{:08b}".format(i)[::-1], 2) for i in range(256))
+
+
+def framebuffer(image, pages):
+    '''
+    Convert a 1-bit image to the SSD1306 memory layout: for every page of 8
+    rows, one byte per column with the top row in the LSB.
+    '''
+    # after the transpose every row holds one column, 8 pixels per byte
+    columns = image.transpose(TRANSPOSE).tobytes().translate(REVERSE)
+    return b"".join(columns[p::pages] for p in range(pages))
+
+
+class FrameDiffer(object):
+    '''
+    Keep the framebuffer that is on the display and only send what changed.
+    Also counts the bytes that went over the bus and the time it took.
+
+    '''
+    def __init__(self, disp):
+        """Needs an Adafruit_SSD1306 display that has been started with begin()."""
+        self.disp = disp
+        self.width = disp.width
+        self.pages = disp.height // 8
+        self.last = None        # what is on the display, None = unknown
+        self.frames = 0         # frames that were checked
+        self.updates = 0        # frames that needed an update
+        self.bytes_sent = 0     # bytes over the bus, not counting the address
+        self.bus_time = 0.0     # seconds spent sending
+        self.frame_bytes = 0    # for the last frame
+        self.frame_time = 0.0
+
+    def invalidate(self):
+        '''The display was changed behind our back, send everything next time'''
+        self.last = None
+
+    def command(self, *cmds):
+        for c in cmds:
+            self.disp.command(c)
+        self.frame_bytes += CMD_BYTES * len(cmds)
+
+    def data(self, data):
+        i2c = self.disp._i2c
+        for i in range(0, len(data), CHUNK):
+            chunk = data[i:i + CHUNK]
+            i2c.writeList(0x40, list(chunk))
+            self.frame_bytes += 1 + len(chunk)
+
+    def changed_columns(self, page, fb):
+        '''
+        Returns (first, last) of the changed columns in a page, or None
+        '''
+        start = page * self.width
+        new = fb[start:start + self.width]
+        if self.last is None:
+            return 0, self.width - 1
+        old = self.last[start:start + self.width]
+        if new == old:
+            return None
+        first = 0
+        while new[first] == old[first]:
+            first += 1
+        last = self.width - 1
+        while new[last] == old[last]:
+            last -= 1
+        return first, last
+
+    def update(self, image):
+        '''
+        Send the changes of this image to the display.
+        Returns the number of bytes sent.
+        '''
+        fb = framebuffer(image, self.pages)
+        self.frames += 1
+        self.frame_bytes = 0
+        start = time.perf_counter()
+
+        for page in range(self.pages):
+            cols = self.changed_columns(page, fb)
+            if cols is None:
+                continue
+            first, last = cols
+            self.command(SSD1306_COLUMNADDR, first, last)
+            self.command(SSD1306_PAGEADDR, page, page)
+            offset = page * self.width
+            self.data(fb[offset + first:offset + last + 1])
+
+        self.frame_time = time.perf_counter() - start
+        if self.frame_bytes:
+            self.updates += 1
+            self.bytes_sent += self.frame_bytes
+            self.bus_time += self.frame_time
+        self.last = fb
+        return self.frame_bytes
+
+    def frame_report(self):
+        return "i2c: {} bytes in {:.1f} ms".format(self.frame_bytes, 1000.0 * self.frame_time)
+
+    def report(self):
+        return ("i2c: {} frames, {} updated, {} bytes ({:.0f} per frame), {:.1f} ms per update".format(
+                self.frames, self.updates, self.bytes_sent,
+                self.bytes_sent / float(max(self.frames, 1)),
+                1000.0 * self.bus_time / max(self.updates, 1)))
+
+
+# --- self-check --------------------------------------------------------------
+
+class FakeI2C(object):
+    '''Plays the SSD1306 memory, in horizontal addressing mode'''
+    def __init__(self, width, pages):
+        self.width = width
+        self.pages = pages
+        self.memory = bytearray(width * pages)
+        self.cmds = []
+        self.col = self.page = 0
+        self.window = (0, width - 1, 0, pages - 1)
+
+    def write8(self, control, value):
+        self.cmds.append(value)
+        if len(self.cmds) == 3 and self.cmds[0] == SSD1306_COLUMNADDR:
+            c0, c1 = self.cmds[1:]
+            self.window = (c0, c1) + self.window[2:]
+            self.col = c0
+            self.cmds = []
+        elif len(self.cmds) == 3 and self.cmds[0] == SSD1306_PAGEADDR:
+            p0, p1 = self.cmds[1:]
+            self.window = self.window[:2] + (p0, p1)
+            self.page = p0
+            self.cmds = []
+
+    def writeList(self, control, data):
+        c0, c1, p0, p1 = self.window
+        for b in data:
+            self.memory[self.page * self.width + self.col] = b
+            self.col += 1
+            if self.col > c1:
+                self.col = c0
+                self.page = p0 if self.page >= p1 else self.page + 1
+
+
+class FakeDisplay(object):
+    def __init__(self, width=128, height=32):
+        self.width = width
+        self.height = height
+        self._i2c = FakeI2C(width, height // 8)
+
+    def command(self, c):
+        self._i2c.write8(0, c)
+
+
+def self_check(frames=600):
+    from PIL import ImageDraw, ImageFont
+
+    print("SSD1306 frame diff - Version {}".format(VERSION))
+    disp = FakeDisplay()
+    differ = FrameDiffer(disp)
+    image = Image.new('1', (disp.width, disp.height))
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default()
+
+    errors = 0
+    for n in range(frames):
+        draw.rectangle((0, 0, disp.width, disp.height), outline=0, fill=0)
+        draw.text((0, 1), "   10,000,000.000 Hz", font=font, fill=255)
+        draw.text((0, 12), "sats: 11  gate: 1Ks", font=font, fill=255)
+        draw.text((0, 23), "min. left: {}  {:02d}s".format(16 - n // 60, n % 60), font=font, fill=255)
+        differ.update(image)
+        if bytes(disp._i2c.memory) != framebuffer(image, differ.pages):
+            errors += 1
+
+    full = 6 * CMD_BYTES + 512 + 512 // CHUNK
+    print(differ.report())
+    print("full updates would have sent {} bytes per frame, {} frames differ from the display".format(
+          full, errors))
+    return errors
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(1 if self_check() else 0)
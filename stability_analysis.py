@@ -0,0 +1,319 @@
+#!/usr/bin/python3.7
+#-------------------------------------------------------------------------------
+# Name:        stability_analysis.py
+# Purpose:     Stability analysis of the archived logs, instead of plotting
+#              them in Excel. Loads a range of days of the counter or the
+#              GPSDO logs into numpy arrays and calculates the overlapping
+#              Allan deviation (ADEV), the modified Allan deviation (MDEV) and
+#              the time deviation (TDEV) at tau = 1, 2, 4, 8... samples.
+#              The days come from the archive of log_archive.py, or from the
+#              directories the crontab used to move the logs to.
+#              The sums are made with array slices and cumulative sums, there
+#              are no loops over the samples. The data is split at the gaps,
+#              like a counter reset or a restart of the monitor, and the sums
+#              of the parts are added together.
+#
+#              python3 stability_analysis.py counter 2026-10-01 2026-10-17
+#              python3 stability_analysis.py gpsdo 2026-10-01 2026-10-17 [field]
+#              python3 stability_analysis.py --selftest
+#              python3 stability_analysis.py --bench [samples]
+#
+# Author:      paulv
+#
+# Created:     18-10-2026
+# Copyright:   (c) paulv 2018 2019 2020
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+
+import math
+import sys
+import time
+
+import numpy
+
+import nano_report
+import log_archive
+
+VERSION = "1.1"     # read the days from the log archive
+
+NOMINAL = 10e6      # Hz
+GPSDO_FIELD = "tic" # the phase in the report of the Nano
+TIC_SCALE = 1e-9    # seconds per count of that field
+GAP = 1.5           # a step larger than this many samples is a gap
+
+
+def log_seconds(stamps):
+    '''Seconds of the datetime64 log times, as float64'''
+    return stamps.astype("datetime64[ms]").astype("int64") / 1000.0
+
+
+def load_counter(first, last, archive=log_archive.ARCHIVE_DIR):
+    '''
+    The counter readings of the days first..last.
+    Returns (seconds, fractional frequency, gate time).
+    '''
+    stamps = []
+    values = []
+    gates = set()
+    for day, data in log_archive.day_data("counter", first, last, archive):
+        # "gate\t1000s\tcounter\t10000000.000" and with DEBUG "\ttimestamp\t..."
+        for stamp, text in nano_report.log_reports(data):
+            parts = text.split(b"\t")
+            if len(parts) < 4 or parts[0] != b"gate" or parts[2] != b"counter":
+                continue
+            try:
+                value = float(parts[3])
+            except ValueError:
+                continue
+            if value == 0.0:
+                continue    # the start-up value after a reset
+            gates.add(parts[1])
+            stamps.append(stamp[:10] + b"T" + stamp[11:].replace(b",", b"."))
+            values.append(value)
+    if len(gates) > 1:
+        print("warning: more than one gate time in this range: {}".format(sorted(gates)))
+    tau0 = float(min(gates).rstrip(b"s")) if gates else 1000.0
+    t = log_seconds(numpy.array([s.decode() for s in stamps], dtype="datetime64[ms]"))
+    y = (numpy.array(values) - NOMINAL) / NOMINAL
+    return t, y, tau0
+
+
+def load_gpsdo(first, last, field=GPSDO_FIELD, scale=TIC_SCALE, archive=log_archive.ARCHIVE_DIR):
+    '''
+    The phase from the Nano reports of the days first..last.
+    Returns (seconds, phase in seconds, sample time).
+    '''
+    times = []
+    phases = []
+    for day, data in log_archive.day_data("gpsdo", first, last, archive):
+        columns = nano_report.parse_log(data)
+        times.append(log_seconds(columns["time"]))
+        phases.append(columns[field].astype("float64") * scale)
+    if not times:
+        return numpy.zeros(0), numpy.zeros(0), 1.0
+    t = numpy.concatenate(times)
+    tau0 = float(numpy.median(numpy.diff(t))) if len(t) > 1 else 1.0
+    return t, numpy.concatenate(phases), round(tau0) or tau0
+
+
+def split(t, tau0):
+    '''Slices of the parts of the data without gaps'''
+    if len(t) == 0:
+        return []
+    breaks = numpy.nonzero(numpy.diff(t) > GAP * tau0)[0] + 1
+    edges = [0] + breaks.tolist() + [len(t)]
+    return [slice(a, b) for a, b in zip(edges[:-1], edges[1:])]
+
+
+def frequency_to_phase(y, tau0):
+    '''The phase at the start and the end of every frequency reading'''
+    x = numpy.zeros(len(y) + 1)
+    numpy.cumsum(y * tau0, out=x[1:])
+    return x
+
+
+def detrend(x):
+    '''
+    Take a straight line out of the phase. The second differences don't
+    change, but the cumulative sums stay small, so we don't lose precision.
+    '''
+    if len(x) < 2:
+        return x - x[0] if len(x) else x
+    ramp = numpy.arange(len(x)) * ((x[-1] - x[0]) / (len(x) - 1))
+    return x - x[0] - ramp
+
+
+def adev_sum(x, m, work=None):
+    '''
+    (sum of the squared second differences, number of terms) at m samples.
+    work is an array at least as long as x to use for the differences.
+    '''
+    n = len(x) - 2 * m
+    if n <= 0:
+        return 0.0, 0
+    # x[i+2m] - 2x[i+m] + x[i], without the temporary arrays of the expression
+    d = numpy.subtract(x[2 * m:], x[m:-m], out=None if work is None else work[:n])
+    d -= x[m:-m]
+    d += x[:n]
+    return float(numpy.dot(d, d)), n
+
+
+def cumulative(x):
+    '''The cumulative sum of the phase with a 0 in front, for mdev_sum'''
+    s = numpy.zeros(len(x) + 1)
+    numpy.cumsum(x, out=s[1:])
+    return s
+
+
+def mdev_sum(s, m, work=None, work2=None):
+    '''
+    (sum of the squared second differences of the m sample averages, terms),
+    from the cumulative sum of the phase. work and work2 are arrays as long
+    as s to use for the sums and the differences.
+    '''
+    n = len(s) - 3 * m
+    if n <= 0:
+        return 0.0, 0
+    # sums of m phases
+    w = numpy.subtract(s[m:], s[:-m], out=None if work is None else work[:len(s) - m])
+    d = numpy.subtract(w[2 * m:2 * m + n], w[m:m + n], out=None if work2 is None else work2[:n])
+    d -= w[m:m + n]
+    d += w[:n]
+    return float(numpy.dot(d, d)), n
+
+
+def octaves(longest, factor):
+    '''m = 1, 2, 4... as long as there is a part of the data that is long enough'''
+    m = 1
+    result = []
+    while factor * m < longest:
+        result.append(m)
+        m *= 2
+    return result
+
+
+def analyse(parts, tau0):
+    '''
+    ADEV, MDEV and TDEV of the phase parts. Returns a list of
+    (tau, adev, mdev, tdev, adev terms, mdev terms).
+    '''
+    parts = [detrend(x) for x in parts if len(x) > 2]
+    if not parts:
+        return []
+    sums = [cumulative(x) for x in parts]
+    longest = max(len(x) for x in parts)
+    # allocated once, fresh arrays for every tau cost more than the arithmetic
+    work = numpy.empty(longest + 1)
+    work2 = numpy.empty(longest + 1)
+    rows = []
+    for m in octaves(longest, 2):
+        tau = m * tau0
+        a_sum = a_n = m_sum = m_n = 0
+        for x, cs in zip(parts, sums):
+            s, n = adev_sum(x, m, work)
+            a_sum += s
+            a_n += n
+            s, n = mdev_sum(cs, m, work, work2)
+            m_sum += s
+            m_n += n
+        adev = math.sqrt(a_sum / (2.0 * tau * tau * a_n))
+        if m_n:
+            mdev = math.sqrt(m_sum / (2.0 * m ** 4 * tau0 * tau0 * m_n))
+            tdev = tau * mdev / math.sqrt(3.0)
+        else:
+            mdev = tdev = None
+        rows.append((tau, adev, mdev, tdev, a_n, m_n))
+    return rows
+
+
+def print_table(rows):
+    print("{:>10} {:>12} {:>12} {:>12} {:>10}".format("tau s", "adev", "mdev", "tdev s", "terms"))
+    for tau, adev, mdev, tdev, a_n, m_n in rows:
+        print("{:>10.0f} {:>12.3e} {:>12} {:>12} {:>10}".format(
+            tau, adev,
+            "{:.3e}".format(mdev) if mdev is not None else "-",
+            "{:.3e}".format(tdev) if tdev is not None else "-", a_n))
+
+
+def counter_analysis(first, last):
+    t, y, tau0 = load_counter(first, last)
+    parts = split(t, tau0)
+    print("counter {} .. {}: {} readings, gate {:.0f}s, {} parts".format(
+        first, last, len(y), tau0, len(parts)))
+    if len(y):
+        print("mean fractional frequency offset {:.3e}".format(float(numpy.mean(y))))
+    print_table(analyse([frequency_to_phase(y[p], tau0) for p in parts], tau0))
+
+
+def gpsdo_analysis(first, last, field=GPSDO_FIELD):
+    t, x, tau0 = load_gpsdo(first, last, field)
+    parts = split(t, tau0)
+    print("gpsdo {} .. {}: {} reports, {:.0f}s apart, {} parts".format(
+        first, last, len(x), tau0, len(parts)))
+    print_table(analyse([x[p] for p in parts], tau0))
+
+
+# --- self-test and benchmark -------------------------------------------------
+
+def naive(parts, tau0, m):
+    '''The textbook formulas with loops, for the self-test'''
+    a_sum = m_sum = 0.0
+    a_n = m_n = 0
+    for x in parts:
+        x = [float(v) for v in x]
+        n = len(x)
+        for i in range(n - 2 * m):
+            a_sum += (x[i + 2 * m] - 2 * x[i + m] + x[i]) ** 2
+            a_n += 1
+        for j in range(n - 3 * m + 1):
+            s = 0.0
+            for i in range(j, j + m):
+                s += x[i + 2 * m] - 2 * x[i + m] + x[i]
+            m_sum += s * s
+            m_n += 1
+    tau = m * tau0
+    adev = math.sqrt(a_sum / (2 * tau * tau * a_n))
+    mdev = math.sqrt(m_sum / (2 * m ** 4 * tau0 * tau0 * m_n)) if m_n else None
+    return adev, mdev
+
+
+def selftest():
+    print("Stability analysis self-test - Version {}".format(VERSION))
+    rnd = numpy.random.RandomState(1)
+    tau0 = 1.0
+    # three parts with random walk and white phase noise, like a GPSDO with two restarts
+    t = numpy.concatenate([numpy.arange(0, 700), numpy.arange(900, 1300), numpy.arange(5000, 5150)])
+    y = 1e-9 + numpy.cumsum(rnd.normal(0, 1e-12, len(t))) + rnd.normal(0, 1e-10, len(t))
+    parts = [frequency_to_phase(y[p], tau0) for p in split(t.astype(float), tau0)]
+    errors = 0
+    if len(parts) != 3:
+        print("expected 3 parts, got {}".format(len(parts)))
+        errors += 1
+    for tau, adev, mdev, tdev, a_n, m_n in analyse(parts, tau0):
+        ref_adev, ref_mdev = naive(parts, tau0, int(tau / tau0))
+        ok = abs(adev - ref_adev) <= 1e-6 * ref_adev
+        if ref_mdev is not None:
+            ok = ok and abs(mdev - ref_mdev) <= 1e-6 * ref_mdev
+            ok = ok and abs(tdev - tau * ref_mdev / math.sqrt(3)) <= 1e-6 * tdev
+        errors += not ok
+        print("tau {:>4.0f}  adev {:.6e} / {:.6e}  mdev {} / {}  {}".format(
+            tau, adev, ref_adev,
+            "{:.6e}".format(mdev) if mdev is not None else "-",
+            "{:.6e}".format(ref_mdev) if ref_mdev is not None else "-",
+            "ok" if ok else "DIFFERS"))
+    print("{} errors".format(errors))
+    return errors
+
+
+def bench(samples=365 * 86400):
+    print("Stability analysis benchmark - Version {}".format(VERSION))
+    rnd = numpy.random.RandomState(2)
+    start = time.perf_counter()
+    t = numpy.arange(samples, dtype="float64")
+    t[samples // 2:] += 3600    # a restart halfway
+    x = numpy.cumsum(rnd.normal(0, 1e-11, samples)) + rnd.normal(0, 1e-9, samples)
+    made = time.perf_counter() - start
+
+    start = time.perf_counter()
+    parts = [x[p] for p in split(t, 1.0)]
+    rows = analyse(parts, 1.0)
+    elapsed = time.perf_counter() - start
+    print_table(rows)
+    print("{} samples ({:.1f} days at 1 Hz): made in {:.1f}s, analysed in {:.1f}s".format(
+        samples, samples / 86400.0, made, elapsed))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    if args and args[0] == "--selftest":
+        sys.exit(1 if selftest() else 0)
+    elif args and args[0] == "--bench":
+        bench(int(args[1]) if len(args) > 1 else 365 * 86400)
+    elif len(args) >= 3 and args[0] == "counter":
+        counter_analysis(args[1], args[2])
+    elif len(args) >= 3 and args[0] == "gpsdo":
+        gpsdo_analysis(args[1], args[2], *args[3:4])
+    else:
+        print("usage: python3 stability_analysis.py counter|gpsdo <first day> <last day> [field]")
+        print("       python3 stability_analysis.py --selftest | --bench [samples]")
+        sys.exit(1)
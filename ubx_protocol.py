@@ -0,0 +1,277 @@
+#!/usr/bin/python3.7
+#-------------------------------------------------------------------------------
+# Name:        ubx_protocol.py
+# Purpose:     Framing and decoding of the u-blox UBX binary protocol for the
+#              NEO receiver: NAV-PVT, NAV-SAT and TIM-TP.
+#              The messages are decoded with struct straight out of the
+#              framing buffer, nothing is copied or split.
+#              Used by serial_bb_gps.py when PROTOCOL = "UBX"
+#
+#              The bit-banged port can only listen, so the NEO has to be set
+#              up with u-center first: enable the UBX output on UART1 with the
+#              three messages at the rate you want, set the baud rate to match
+#              UBX_BAUD in serial_bb_gps.py and save it to the BBR/flash.
+#
+#              Run it on its own for a self-check and a benchmark:
+#              python3 ubx_protocol.py
+#
+# Author:      paulv
+#
+# Created:     18-10-2026
+# Copyright:   (c) paulv 2018 2019 2020
+# Licence:     <your licence>
+#-------------------------------------------------------------------------------
+
+import struct
+import sys
+import time
+import random
+
+from nmea_parser import SatelliteTable, MAX_SATS
+
+VERSION = "1.1"     # subscribing a callback twice does not call it twice
+
+SYNC = b"\xb5\x62"
+HEADER_LEN = 6      # sync, class, id and the 2 byte length
+MAX_PAYLOAD = 1024  # larger than anything we expect, protects against garbage lengths
+
+# message class and id
+NAV_PVT = (0x01, 0x07)
+NAV_SAT = (0x01, 0x35)
+TIM_TP = (0x0D, 0x01)
+
+PVT_FORMAT = struct.Struct("<IH6BIi4B4i2I5i2IHB5xihH")    # 92 bytes
+SAT_HEADER = struct.Struct("<IBB2x")                        # 8 bytes
+SAT_BLOCK = struct.Struct("<BBBbhhI")                       # 12 bytes per satellite
+TP_FORMAT = struct.Struct("<IIiHBB")                        # 16 bytes
+LENGTH = struct.Struct("<H")
+
+
+def checksum(data):
+    '''
+    8-bit Fletcher checksum over the class, id, length and payload
+    '''
+    ck_a = ck_b = 0
+    for c in data:
+        ck_a = (ck_a + c) & 0xFF
+        ck_b = (ck_b + ck_a) & 0xFF
+    return ck_a, ck_b
+
+
+def build(msg_class, msg_id, payload=b""):
+    '''
+    Create a complete UBX frame, used for testing and to configure a receiver
+    '''
+    body = bytes((msg_class, msg_id)) + LENGTH.pack(len(payload)) + payload
+    return SYNC + body + bytes(checksum(body))
+
+
+class NavPVT(object):
+    __slots__ = ("itow", "year", "month", "day", "hour", "minute", "second",
+                 "valid", "t_acc", "nano", "fix_type", "flags", "num_sv",
+                 "lon", "lat", "height", "h_msl", "h_acc", "v_acc", "p_dop")
+
+    @property
+    def fix_ok(self):
+        # gnssFixOK and at least a 2D fix
+        return bool(self.flags & 0x01) and self.fix_type >= 2
+
+
+def decode_nav_pvt(buf, offset, length):
+    if length < PVT_FORMAT.size:
+        raise ValueError("NAV-PVT too short: {}".format(length))
+    f = PVT_FORMAT.unpack_from(buf, offset)
+    msg = NavPVT()
+    (msg.itow, msg.year, msg.month, msg.day, msg.hour, msg.minute, msg.second,
+     msg.valid, msg.t_acc, msg.nano, msg.fix_type, msg.flags) = f[0:12]
+    msg.num_sv = f[13]
+    msg.lon = f[14] * 1e-7      # degrees
+    msg.lat = f[15] * 1e-7
+    msg.height = f[16] / 1000.0  # meters above the ellipsoid
+    msg.h_msl = f[17] / 1000.0   # meters above mean sea level
+    msg.h_acc = f[18] / 1000.0
+    msg.v_acc = f[19] / 1000.0
+    msg.p_dop = f[27] * 0.01
+    return msg
+
+
+def sat_key(gnss_id, sv_id):
+    # GPS satellites keep their PRN, the other systems get their own range
+    return sv_id if gnss_id == 0 else (gnss_id << 8) | sv_id
+
+
+def decode_nav_sat(buf, offset, length, table):
+    '''
+    NAV-SAT lists all satellites in view, they go straight into the table
+    '''
+    itow, version, num_svs = SAT_HEADER.unpack_from(buf, offset)
+    if length < SAT_HEADER.size + num_svs * SAT_BLOCK.size:
+        raise ValueError("NAV-SAT too short for {} satellites: {}".format(num_svs, length))
+    table.new_epoch()
+    pos = offset + SAT_HEADER.size
+    for n in range(num_svs):
+        gnss_id, sv_id, cno, elev, azim, pr_res, flags = SAT_BLOCK.unpack_from(buf, pos)
+        key = sat_key(gnss_id, sv_id)
+        table.update(key, elev, azim, cno)
+        if flags & 0x08:    # svUsed
+            table.set_used((key,))
+        pos += SAT_BLOCK.size
+    return table
+
+
+class TimTP(object):
+    __slots__ = ("tow_ms", "tow_sub_ms", "q_err", "week", "flags", "ref_info")
+
+
+def decode_tim_tp(buf, offset, length):
+    if length < TP_FORMAT.size:
+        raise ValueError("TIM-TP too short: {}".format(length))
+    msg = TimTP()
+    (msg.tow_ms, msg.tow_sub_ms, msg.q_err, msg.week,
+     msg.flags, msg.ref_info) = TP_FORMAT.unpack_from(buf, offset)
+    return msg
+
+
+class UBXEngine(object):
+    '''
+    Finds the UBX frames in the incoming chunks, checks them and dispatches
+    the messages somebody subscribed to. The payload is decoded in place in
+    the framing buffer. Messages nobody wants are skipped without even
+    calculating the checksum.
+
+    '''
+    def __init__(self, size=MAX_SATS):
+        self.sats = SatelliteTable(size)
+        self.buf = bytearray()
+        self.decoders = {
+            NAV_PVT: decode_nav_pvt,
+            NAV_SAT: self._nav_sat,
+            TIM_TP: decode_tim_tp,
+        }
+        self.dispatch_table = {}    # (class, id) -> (decoder, [callbacks])
+        self.frames = 0             # frames that were dispatched
+        self.discarded = 0          # frames nobody wanted
+        self.errors = 0             # checksum or decode errors
+
+    @property
+    def in_frame(self):
+        return len(self.buf) > 0
+
+    def subscribe(self, msg, callback=None):
+        if msg not in self.dispatch_table:
+            self.dispatch_table[msg] = (self.decoders[msg], [])
+        callbacks = self.dispatch_table[msg][1]
+        # subscribed again at a restart of the monitor, only call it once
+        if callback is not None and callback not in callbacks:
+            callbacks.append(callback)
+
+    def feed(self, data):
+        '''
+        Add a chunk and dispatch all the frames it completes.
+        Returns the number of dispatched messages.
+        '''
+        buf = self.buf
+        buf += data
+        count = 0
+        pos = 0
+        with memoryview(buf) as mv:
+            while True:
+                start = buf.find(SYNC, pos)
+                if start < 0:
+                    # keep a trailing first sync byte, the second may be on its way
+                    pos = len(buf) - 1 if buf.endswith(SYNC[:1]) else len(buf)
+                    break
+                if len(buf) - start < HEADER_LEN:
+                    pos = start
+                    break
+                length = LENGTH.unpack_from(buf, start + 4)[0]
+                if length > MAX_PAYLOAD:
+                    # not a real frame, look for the next sync
+                    self.errors += 1
+                    pos = start + 1
+                    continue
+                end = start + HEADER_LEN + length + 2
+                if end > len(buf):
+                    pos = start
+                    break
+                key = (buf[start + 2], buf[start + 3])
+                entry = self.dispatch_table.get(key)
+                if entry is None:
+                    self.discarded += 1
+                    pos = end
+                    continue
+                if bytes(checksum(mv[start + 2:end - 2])) != buf[end - 2:end]:
+                    # a false sync in the data, or a damaged frame
+                    self.errors += 1
+                    pos = start + 1
+                    continue
+                decoder, callbacks = entry
+                try:
+                    msg = decoder(mv, start + HEADER_LEN, length)
+                except (ValueError, struct.error) as e:
+                    print("UBX decode error {}".format(e))
+                    self.errors += 1
+                    pos = end
+                    continue
+                for callback in callbacks:
+                    callback(msg)
+                self.frames += 1
+                count += 1
+                pos = end
+        del buf[:pos]
+        return count
+
+    def _nav_sat(self, buf, offset, length):
+        return decode_nav_sat(buf, offset, length, self.sats)
+
+
+# --- self-check and benchmark ------------------------------------------------
+
+def synthetic_epoch(n, num_svs=32):
+    pvt = PVT_FORMAT.pack(n * 1000, 2026, 10, 18, 12, (n // 60) % 60, n % 60, 0x07, 25, 0,
+                          3, 0x01, 0, 11, 49045432, 523702067, 58123, 12345, 1500, 2500,
+                          0, 0, 0, 0, 0, 30, 0, 88, 0, 0, 0, 0)
+    sats = SAT_HEADER.pack(n * 1000, 1, num_svs)
+    for i in range(num_svs):
+        sats += SAT_BLOCK.pack(0, i + 1, 30 + i % 15, 10 + i, 10 * i, 0, 0x08 if i < 12 else 0)
+    tp = TP_FORMAT.pack(n * 1000 + 1000, 0, -1234, 2336, 0x03, 0)
+    return build(*NAV_PVT, pvt) + build(*NAV_SAT, sats) + build(*TIM_TP, tp)
+
+
+def benchmark(seconds=3600):
+    print("UBX protocol benchmark - Version {}".format(VERSION))
+    stream = b"\x00junk\xb5" + b"".join(synthetic_epoch(n) for n in range(seconds))
+    rnd = random.Random(1)
+    chunks = []
+    pos = 0
+    while pos < len(stream):
+        n = rnd.randint(1, 256)
+        chunks.append(stream[pos:pos + n])
+        pos += n
+
+    engine = UBXEngine()
+    got = {"pvt": 0, "tp": 0}
+    count_pvt = lambda m: got.__setitem__("pvt", got["pvt"] + 1)
+    engine.subscribe(NAV_PVT, count_pvt)
+    engine.subscribe(NAV_SAT)
+    engine.subscribe(TIM_TP, lambda m: got.__setitem__("tp", got["tp"] + 1))
+    # again, like a restart of the monitor does
+    engine.subscribe(NAV_PVT, count_pvt)
+
+    start = time.perf_counter()
+    for chunk in chunks:
+        engine.feed(chunk)
+    elapsed = time.perf_counter() - start
+
+    expected = 3 * seconds
+    print("stream: {} bytes in {} chunks, {} messages".format(len(stream), len(chunks), expected))
+    print("frames: {} dispatched, {} errors, pvt {}, tim-tp {}".format(
+        engine.frames, engine.errors, got["pvt"], got["tp"]))
+    print("satellites (view, tracked, used, avg snr, min snr): {}".format(engine.sats.summary()))
+    print("speed : {:.0f} messages/s, {:.1f} us/epoch".format(
+        engine.frames / elapsed, 1e6 * elapsed / seconds))
+    return expected - engine.frames + got["pvt"] - seconds
+
+
+if __name__ == '__main__':
+    sys.exit(1 if benchmark() else 0)